@@ -60,7 +60,8 @@ chrome.runtime.onMessage.addListener(
                 'diff_text': diff_text,
                 'pull_request_url': request.pull_request_url,
                 'user_name': request.user_name,
-                'min_lines_count': request.min_lines_count
+                'min_lines_count': request.min_lines_count,
+                'edit_spans': true
             })
           })
         })
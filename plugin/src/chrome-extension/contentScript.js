@@ -86,6 +86,17 @@ function get_diff_part_as_html(diff_op, text, diff_op_to_skip){
     return escape_html_markup(text);
 }
 
+function get_text_with_spans_as_html(text, spans){
+    let html = '';
+    let position = 0;
+    for (const [start, stop] of spans) {
+        html += escape_html_markup(text.slice(position, start));
+        html += `<span class='x'>${escape_html_markup(text.slice(start, stop))}</span>`;
+        position = stop;
+    }
+    return html + escape_html_markup(text.slice(position));
+}
+
 function highlightDetectedBlock(block_index, detected_block) {
     let block_match_weight = 0;
     for (const iter of detected_block.lines.entries()) {
@@ -97,18 +108,25 @@ function highlightDetectedBlock(block_index, detected_block) {
         let removed_line = matching_lines.removed_line;
         let added_line = matching_lines.added_line;
         let match_probability = matching_lines.match_probability;
-        let dmp = new diff_match_patch();
         let added_text = added_line ? added_line.leading_whitespaces + added_line.trim_text : '';
         let removed_text = removed_line ? removed_line.leading_whitespaces + removed_line.trim_text : '';
-        let diff = dmp.diff_main(removed_text, added_text);
-        dmp.diff_cleanupSemantic(diff);
         let removed_line_html = '';
         let added_line_html = '';
-        for (let i=0; i<diff.length; i++) {
-            let diff_part = diff[i];
-            let [op, text] = diff_part;
-            removed_line_html += get_diff_part_as_html(op, text, 1);
-            added_line_html += get_diff_part_as_html(op, text, -1)
+        let edit_spans = matching_lines.edit_spans;
+        if (edit_spans) {
+            // the server diffed texts of the lines already
+            removed_line_html = get_text_with_spans_as_html(removed_text, edit_spans.removed);
+            added_line_html = get_text_with_spans_as_html(added_text, edit_spans.added);
+        } else {
+            let dmp = new diff_match_patch();
+            let diff = dmp.diff_main(removed_text, added_text);
+            dmp.diff_cleanupSemantic(diff);
+            for (let i=0; i<diff.length; i++) {
+                let diff_part = diff[i];
+                let [op, text] = diff_part;
+                removed_line_html += get_diff_part_as_html(op, text, 1);
+                added_line_html += get_diff_part_as_html(op, text, -1)
+            }
         }
         let is_first_line = line_in_block_index === 0;
         let is_last_line = line_in_block_index === detected_block.lines.length - 1;
@@ -0,0 +1,189 @@
+"""Detection over a corpus of diffs - a directory or a tar archive of thousands of them - to tune thresholds and catch
+regressions (see `python -m reviewraccoon batch`).
+
+Diffs are files with DIFF_SUFFIXES. They are detected in a pool of processes which live for the whole run, so
+caches of a worker (e.g. intraline edit spans) stay warm between its diffs. The biggest diffs go first and every
+worker takes the next diff when it is done with its one, so a few big diffs found at the end do not leave the other
+workers idle. Workers read diffs themselves: files of a directory and members of an uncompressed tar archive are
+memory-mapped, members of a compressed archive are extracted to a temporary directory first.
+
+For every diff a line of JSON is written to the output file as soon as the diff is done:
+{"diff": name, "bytes": size of the file, "seconds": {stage: seconds}, "counts": {count: value}, "error": message or
+null, "result": detected blocks} - seconds and counts are the profile of the detection (see
+metrics.detection_profile), result is the JSON of a /moved-blocks response (left out without with_blocks).
+The output file is the checkpoint of the run as well - with resume diffs which are in it already are skipped.
+"""
+import contextlib
+import gzip
+import io
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+import metrics
+import serialization
+from detector import MovedBlocksDetector, diff_to_lines
+from diff_parser import iterate_binary_lines, open_diff_file
+from gram_index import GramIndex
+from time_utils import MeasureTime, collect_durations
+
+logger = logging.getLogger(__name__)
+
+DIFF_SUFFIXES = ('.diff', '.patch', '.diff.gz', '.patch.gz')
+
+# Progress of a run is logged every that many diffs.
+PROGRESS_DIFFS = 100
+
+# (detector options, min lines count, encoding, with blocks, gram index) of this worker process, see _init_worker
+_worker = None
+
+
+class DiffSource(object):
+    """Diff of a corpus: file at path or member of uncompressed tar archive at path (size bytes from offset)."""
+
+    def __init__(self, name, path, size, offset=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.offset = offset
+
+    @contextlib.contextmanager
+    def open(self):
+        """Return binary stream of the diff (see diff_parser.iterate_binary_lines)."""
+        if self.offset is None:
+            with open_diff_file(self.path) as stream:
+                yield stream
+            return
+        if self.size == 0:
+            yield io.BytesIO()
+            return
+        # only the member is mapped, from the closest offset a mapping can start at, so reads end with the member
+        map_offset = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        with open(self.path, 'rb') as archive, mmap.mmap(archive.fileno(), self.offset + self.size - map_offset,
+                                                         access=mmap.ACCESS_READ, offset=map_offset) as member:
+            member.seek(self.offset - map_offset)
+            yield gzip.GzipFile(fileobj=member, mode='rb') if self.name.endswith('.gz') else member
+
+
+def find_diffs(path, temp_dir):
+    """Return DiffSources of the directory or tar archive at path, members of a compressed archive are extracted
+    to temp_dir."""
+    if os.path.isdir(path):
+        sources = []
+        for directory, _, file_names in os.walk(path):
+            for file_name in file_names:
+                if file_name.endswith(DIFF_SUFFIXES):
+                    file_path = os.path.join(directory, file_name)
+                    sources.append(DiffSource(os.path.relpath(file_path, path), file_path, os.path.getsize(file_path)))
+        return sources
+    try:
+        with tarfile.open(path, 'r:') as archive:
+            return [DiffSource(member.name, path, member.size, member.offset_data)
+                    for member in archive if member.isfile() and member.name.endswith(DIFF_SUFFIXES)]
+    except tarfile.ReadError:
+        pass  # compressed archive
+    sources = []
+    with tarfile.open(path, 'r:*') as archive:
+        for member in archive:
+            if member.isfile() and member.name.endswith(DIFF_SUFFIXES):
+                file_path = os.path.join(temp_dir, f'{len(sources)}.gz' if member.name.endswith('.gz') else
+                                         f'{len(sources)}.diff')
+                with archive.extractfile(member) as member_file, open(file_path, 'wb') as diff_file:
+                    shutil.copyfileobj(member_file, diff_file)
+                sources.append(DiffSource(member.name, file_path, member.size))
+    return sources
+
+
+def read_checkpoint(output_path):
+    """Return names of diffs in output file of a previous run. A line cut short (e.g. by a killed run) is removed
+    from the file."""
+    names = set()
+    if not os.path.exists(output_path):
+        return names
+    with open(output_path, 'r+b') as output:
+        complete_bytes = 0
+        for line in output:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                names.add(json.loads(line)['diff'])
+            except (ValueError, KeyError, TypeError):
+                break
+            complete_bytes += len(line)
+        output.truncate(complete_bytes)
+    return names
+
+
+def _init_worker(options, min_lines_count, encoding, with_blocks, gram_index_path):
+    global _worker
+    gram_index = GramIndex(gram_index_path) if gram_index_path else None
+    _worker = (options, min_lines_count, encoding, with_blocks, gram_index)
+
+
+def detect_diff(source):
+    """Return (whether detection failed, JSON line of the result) of DiffSource - run in a worker."""
+    options, min_lines_count, encoding, with_blocks, gram_index = _worker
+    detector = None
+    body = None
+    error = None
+    with collect_durations() as durations:
+        try:
+            with MeasureTime('batch_diff'):
+                with source.open() as stream:
+                    removed_lines, added_lines = diff_to_lines(iterate_binary_lines(stream))
+                detector = MovedBlocksDetector(removed_lines, added_lines, gram_index=gram_index, **options)
+                detected_blocks = detector.detect_moved_blocks(min_lines_count)
+                if with_blocks:
+                    body = serialization.blocks_to_json(detected_blocks, **encoding)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+    record = {'diff': source.name, 'bytes': source.size}
+    record.update(metrics.detection_profile(durations, detector.counts if detector is not None else {}))
+    record['error'] = error
+    line = json.dumps(record).encode('utf-8')
+    if body is not None:
+        line = line[:-1] + b', "result": ' + body + b'}'
+    return error is not None, line + b'\n'
+
+
+def run_batch(path, output_path, options=None, min_lines_count=None, encoding=None, processes=None, resume=False,
+              gram_index_path=None, with_blocks=True):
+    """Detect diffs of the corpus at path writing lines of JSON to output_path, return (number of diffs done,
+    number of them which failed).
+
+    options are keyword arguments of MovedBlocksDetector, encoding of serialization.blocks_to_json. With resume the
+    output file is appended to and diffs which are in it are skipped.
+    """
+    done_names = read_checkpoint(output_path) if resume else set()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sources = [source for source in find_diffs(path, temp_dir) if source.name not in done_names]
+        sources.sort(key=lambda source: source.size, reverse=True)
+        processes = min(processes or os.cpu_count() or 1, max(len(sources), 1))
+        logger.info(f'Detecting {len(sources)} diffs ({len(done_names)} done before) with {processes} processes')
+        init_args = (options or {}, min_lines_count, encoding or {}, with_blocks, gram_index_path)
+        with contextlib.ExitStack() as stack:
+            if processes > 1:
+                pool = stack.enter_context(multiprocessing.get_context('fork').Pool(processes, _init_worker,
+                                                                                    init_args))
+                results = pool.imap_unordered(detect_diff, sources, chunksize=1)
+            else:
+                _init_worker(*init_args)
+                results = map(detect_diff, sources)
+            output = stack.enter_context(open(output_path, 'ab' if resume else 'wb'))
+            start = time.perf_counter()
+            done_count = failed_count = 0
+            for failed, line in results:
+                output.write(line)
+                output.flush()
+                done_count += 1
+                failed_count += failed
+                if done_count % PROGRESS_DIFFS == 0 or done_count == len(sources):
+                    logger.info(f'Detected {done_count} of {len(sources)} diffs ({failed_count} failed) in '
+                                f'{time.perf_counter() - start:.1f} seconds')
+    return done_count, failed_count
@@ -0,0 +1,103 @@
+"""Anonymize a diff for the benchmark corpus (benchmarks/corpus) - letters of paths and of lines are substituted.
+
+Every letter is replaced with another one by a fixed random permutation of the alphabet (the same for lower and
+upper case), digits, whitespaces and punctuation are kept. Equal texts stay equal and lowercase grams of texts map
+one to one, so moved blocks detected in the anonymized diff are the same as in the original one. Headers other
+than file names and hunk ranges (e.g. index lines) are dropped.
+
+Run from the server directory:
+    git diff main...feature | python -m benchmarks.anonymize_diff - --name feature_pr
+"""
+import argparse
+import gzip
+import os
+import random
+import re
+import string
+import sys
+
+import diff_parser
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'corpus')
+
+RE_BINARY_FILES = re.compile(r'^Binary files (?P<source>.+) and (?P<target>.+) differ$')
+
+
+class Anonymizer(object):
+    def __init__(self, seed=0):
+        letters = list(string.ascii_lowercase)
+        random.Random(seed).shuffle(letters)
+        mapping = dict(zip(string.ascii_lowercase, letters))
+        mapping.update((lower.upper(), upper.upper()) for lower, upper in zip(string.ascii_lowercase, letters))
+        self.table = str.maketrans(mapping)
+
+    def text(self, text):
+        return text.translate(self.table)
+
+    def path(self, path):
+        """Anonymize path keeping a/ and b/ prefixes of git and /dev/null."""
+        quote = '"' if path.startswith('"') else ''
+        path = path.strip('"')
+        if path == diff_parser.DEV_NULL:
+            return path
+        prefix = path[:2] if path[:2] in ('a/', 'b/') else ''
+        return f'{quote}{prefix}{self.text(path[len(prefix):])}{quote}'
+
+    def lines(self, lines):
+        """Yield anonymized lines (without line ends) of diff lines."""
+        hunk_lines = None  # [removed lines left, added lines left] of the current hunk
+        for line in lines:
+            line = line.rstrip('\n')
+            if hunk_lines is not None and (hunk_lines[0] > 0 or hunk_lines[1] > 0):
+                if line.startswith(diff_parser.NO_NEWLINE):
+                    yield line
+                    continue
+                line_type = line[:1] or diff_parser.CONTEXT
+                if line_type != diff_parser.ADDED:
+                    hunk_lines[0] -= 1
+                if line_type != diff_parser.REMOVED:
+                    hunk_lines[1] -= 1
+                yield line[:1] + self.text(line[1:])
+                continue
+            hunk_lines = None
+            git_header = diff_parser.RE_DIFF_GIT_HEADERS[0].match(line)
+            source_filename = diff_parser.RE_SOURCE_FILENAME.match(line)
+            target_filename = diff_parser.RE_TARGET_FILENAME.match(line)
+            hunk_header = diff_parser.RE_HUNK_HEADER.match(line)
+            binary_files = RE_BINARY_FILES.match(line)
+            if git_header:
+                yield f'diff --git {self.path(git_header.group("source"))} {self.path(git_header.group("target"))}'
+            elif source_filename:
+                yield f'--- {self.path(source_filename.group("filename"))}'
+            elif target_filename:
+                yield f'+++ {self.path(target_filename.group("filename"))}'
+            elif hunk_header:
+                source_length, target_length = hunk_header.group(2, 4)
+                hunk_lines = [int(source_length) if source_length is not None else 1,
+                              int(target_length) if target_length is not None else 1]
+                yield hunk_header.group(0)
+            elif binary_files:
+                yield f'Binary files {self.path(binary_files.group("source"))} and ' \
+                      f'{self.path(binary_files.group("target"))} differ'
+            elif (diff_parser.RE_DIFF_GIT_NEW_FILE.match(line) or diff_parser.RE_DIFF_GIT_DELETED_FILE.match(line)
+                  or line.startswith(diff_parser.NO_NEWLINE)):
+                yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('diff', help='diff file or - for standard input')
+    parser.add_argument('--name', required=True, help='name of the diff in the corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    diff = sys.stdin if args.diff == '-' else open(args.diff, encoding='utf-8', errors='replace')
+    path = os.path.join(CORPUS_PATH, f'{args.name}.diff.gz')
+    with diff, gzip.open(path, 'wt', encoding='utf-8') as output:
+        for line in Anonymizer(args.seed).lines(diff):
+            output.write(line + '\n')
+    print(f'Written {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Latency of small and large diffs sent at once to the ASGI server (main_asgi.py).
+
+--clients clients send --requests-per-client requests each, every --large-every-th request of a client has a large
+diff (the others have small ones) and every diff is different, so the result cache does not help. Latency p50/p99
+and counts of rejected (429) and timed out (503) requests are reported by diff size for the API with a pool of its
+own for diffs smaller than --small-diff-bytes and with one pool for all diffs (ASGI_SMALL_DIFF_BYTES=0), in which
+small diffs wait behind large ones. With --url requests are sent to a running server instead.
+
+Run from the server directory:
+    python -m benchmarks.asgi_load --clients 8 --requests-per-client 10 --large-every-th 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.synthetic_diff import generate_diff
+
+
+def requests_diffs(args):
+    diffs = []
+    for client in range(args.clients):
+        for i in range(args.requests_per_client):
+            large = i % args.large_every_th == args.large_every_th - 1
+            diffs.append((client, 'large' if large else 'small', generate_diff(
+                files_count=args.large_files if large else 2, lines_per_file=500 if large else 50,
+                seed=client * args.requests_per_client + i)))
+    return diffs
+
+
+async def run_in_process(diffs, args, small_diff_bytes):
+    import falcon.testing
+    os.environ['ASGI_SMALL_DIFF_BYTES'] = str(small_diff_bytes)
+    os.environ['ASGI_DETECTION_WORKERS'] = str(args.workers)
+    import main_asgi
+    results = []
+
+    async with falcon.testing.ASGIConductor(main_asgi.create_api()) as conductor:
+        async def client(client_diffs):
+            for size, diff_text in client_diffs:
+                start = time.perf_counter()
+                result = await conductor.simulate_post('/moved-blocks', json={'diff_text': diff_text})
+                results.append((size, result.status_code, time.perf_counter() - start))
+
+        await asyncio.gather(*(client([(size, diff_text) for c, size, diff_text in diffs if c == i])
+                               for i in range(args.clients)))
+    return results
+
+
+def run_over_http(diffs, args):
+    def client(client_diffs):
+        client_results = []
+        for size, diff_text in client_diffs:
+            request = urllib.request.Request(args.url, data=json.dumps({'diff_text': diff_text}).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status_code = response.status
+            except urllib.error.HTTPError as e:
+                status_code = e.code
+            client_results.append((size, status_code, time.perf_counter() - start))
+        return client_results
+
+    with ThreadPoolExecutor(args.clients) as executor:
+        return [result for client_results in executor.map(
+            client, [[(size, diff_text) for c, size, diff_text in diffs if c == i] for i in range(args.clients)])
+            for result in client_results]
+
+
+def percentile(values, share):
+    return sorted(values)[min(int(len(values) * share), len(values) - 1)] if values else float('nan')
+
+
+def report(name, results):
+    for size in ('small', 'large'):
+        latencies = [duration for result_size, status_code, duration in results
+                     if result_size == size and status_code == 200]
+        statuses = [status_code for result_size, status_code, _ in results if result_size == size]
+        print(f'{name:>12} {size:>6} {len(latencies):>5} {percentile(latencies, 0.5):>8.2f} '
+              f'{percentile(latencies, 0.99):>8.2f} {statuses.count(429):>5} {statuses.count(503):>5}'
+              f' {statistics.mean(latencies) if latencies else float("nan"):>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests-per-client', type=int, default=10)
+    parser.add_argument('--large-every-th', type=int, default=4)
+    parser.add_argument('--large-files', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--small-diff-bytes', type=int, default=64 * 1024)
+    parser.add_argument('--url')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    diffs = requests_diffs(args)
+    print(f'{"api":>12} {"diffs":>6} {"ok":>5} {"p50 s":>8} {"p99 s":>8} {"429":>5} {"503":>5} {"mean s":>8}')
+    if args.url:
+        report('server', run_over_http(diffs, args))
+    else:
+        report('small pool', asyncio.run(run_in_process(diffs, args, small_diff_bytes=args.small_diff_bytes)))
+        report('one pool', asyncio.run(run_in_process(diffs, args, small_diff_bytes=0)))
+
+
+if __name__ == '__main__':
+    main()
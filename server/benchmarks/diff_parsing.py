@@ -0,0 +1,43 @@
+"""Time and peak memory of parsing a diff with the streaming parser and with unidiff.PatchSet.
+
+Run from the server directory:
+    python -m benchmarks.diff_parsing --files 500 --lines-per-file 2000
+"""
+import argparse
+import time
+import tracemalloc
+
+from unidiff import PatchSet
+
+from detector import diff_to_lines
+from tests.synthetic_diff import generate_diff
+
+
+def measure(fun, diff_text):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fun(diff_text)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return duration, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--lines-per-file', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, seed=args.seed)
+    print(f'diff: {len(diff_text) / 2**20:.1f} MB, {len(diff_text.splitlines())} lines')
+    print(f'{"parser":>12} {"seconds":>9} {"peak MB":>9}')
+    for name, fun in (('streaming', diff_to_lines), ('unidiff', PatchSet)):
+        duration, peak = measure(fun, diff_text)
+        print(f'{name:>12} {duration:>9.2f} {peak / 2**20:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Time of edit spans of fuzzy matched lines of detected blocks (see intraline.py) compared to diffing every line.
+
+The per line diff runs SequenceMatcher on whole texts of every line, as the extension ran diff-match-patch on every
+line. Batched spans are computed once per distinct pair of texts, on texts without their common prefix and suffix,
+and are cached between calls (the second run is a request for the same diff).
+
+Run from the server directory:
+    python -m benchmarks.edit_spans --files 100 --lines-per-file 500 --edit-noise 0.3
+"""
+import argparse
+import logging
+import time
+from difflib import SequenceMatcher
+
+import intraline
+from detector import MovedBlocksDetector
+from tests.synthetic_diff import generate_diff
+
+
+def per_line_edits(blocks):
+    edits = []
+    for block in blocks:
+        for line in block.lines:
+            if line.removed_line is not None and line.added_line is not None and line.match_probability < 1:
+                edits.append(SequenceMatcher(None, str(line.removed_line), str(line.added_line),
+                                             autojunk=False).get_opcodes())
+    return edits
+
+
+def measure(fun, blocks):
+    start = time.perf_counter()
+    fun(blocks)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--edit-noise', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, edit_noise=args.edit_noise,
+                              seed=args.seed)
+    blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+    spans = intraline.edit_spans_of_blocks(blocks)
+    pairs_count = sum(line_spans is not None for block_spans in spans for line_spans in block_spans)
+    intraline.edit_spans.cache_clear()
+    print(f'{len(blocks)} blocks, {pairs_count} fuzzy matched lines')
+    print(f'{"per line s":>11} {"batched s":>10} {"cached s":>9}')
+    print(f'{measure(per_line_edits, blocks):>11.3f} {measure(intraline.edit_spans_of_blocks, blocks):>10.3f} '
+          f'{measure(intraline.edit_spans_of_blocks, blocks):>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Detection time with and without exact_anchors (runs of identical lines become blocks before fuzzy matching).
+
+For every --edit-noise (share of edited moved lines, 0 is a diff of moved code only) it reports time of
+detect_moved_blocks and recall of lines of detected blocks - share of removed lines matched by the full fuzzy
+detection which are matched with anchors too.
+
+Run from the server directory:
+    python -m benchmarks.exact_anchors --files 100 --lines-per-file 500 --edit-noise 0 0.1 0.3
+"""
+import argparse
+import logging
+import time
+
+from detector import MovedBlocksDetector, diff_to_lines
+from tests.synthetic_diff import generate_diff
+
+
+def detect(removed_lines, added_lines, exact_anchors):
+    detector = MovedBlocksDetector(removed_lines, added_lines, exact_anchors=exact_anchors)
+    start = time.perf_counter()
+    blocks = detector.detect_moved_blocks()
+    duration = time.perf_counter() - start
+    matched_lines = {(line.removed_line.file, line.removed_line.line_no)
+                     for block in blocks for line in block.lines if line.removed_line and line.added_line}
+    return duration, matched_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--edit-noise', type=float, nargs='+', default=[0, 0.1, 0.3])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"edit noise":>10} {"lines":>8} {"fuzzy s":>8} {"anchors s":>10} {"line recall":>12}')
+    for edit_noise in args.edit_noise:
+        diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, edit_noise=edit_noise,
+                                  seed=args.seed)
+        removed_lines, added_lines = diff_to_lines(diff_text)
+        duration, expected_lines = detect(removed_lines, added_lines, exact_anchors=False)
+        anchors_duration, lines = detect(removed_lines, added_lines, exact_anchors=True)
+        recall = len(lines & expected_lines) / len(expected_lines) if expected_lines else 1.0
+        print(f'{edit_noise:>10} {len(removed_lines):>8} {duration:>8.2f} {anchors_duration:>10.2f} {recall:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
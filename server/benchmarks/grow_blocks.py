@@ -0,0 +1,51 @@
+"""Time of grow_blocks with blocks looked up by their next added line compared to the former linear scan.
+
+The linear scan tried every currently matching block for every added line matching the removed line, so dense
+diffs with many low information lines (--repetition, e.g. `}` or empty lines) took time proportional to their
+product. Fuzzy matching is done once up front and is not measured.
+
+Run from the server directory:
+    python -m benchmarks.grow_blocks --files 20 --lines-per-file 500 --repetition 0.1 0.3 0.5
+"""
+import argparse
+import json
+import logging
+import time
+
+from detector import MovedBlocksDetector
+from tests.reference_detector import linear_scan_grow_blocks
+from tests.synthetic_diff import generate_diff
+
+
+def measure(grow_blocks, detector, fuzzy_matching_pairs_by_text):
+    start = time.perf_counter()
+    detected_blocks, currently_matching_blocks = grow_blocks(range(len(detector.removed_lines)),
+                                                             fuzzy_matching_pairs_by_text)
+    blocks = detected_blocks + currently_matching_blocks
+    return time.perf_counter() - start, len(blocks), json.dumps([block.to_dict() for block in blocks])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--repetition', type=float, nargs='+', default=[0.1, 0.3, 0.5])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"repetition":>10} {"blocks":>8} {"indexed s":>10} {"linear scan s":>14}')
+    for repetition in args.repetition:
+        diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, repetition=repetition,
+                                  seed=args.seed)
+        detector = MovedBlocksDetector.from_diff(diff_text)
+        fuzzy_matching_pairs_by_text = detector.find_fuzzy_matching_pairs(range(len(detector.removed_lines)))
+        duration, blocks_count, result = measure(detector.grow_blocks, detector, fuzzy_matching_pairs_by_text)
+        linear_scan_duration, _, linear_scan_result = measure(
+            lambda *args: linear_scan_grow_blocks(detector, *args), detector, fuzzy_matching_pairs_by_text)
+        assert result == linear_scan_result
+        print(f'{repetition:>10} {blocks_count:>8} {duration:>10.2f} {linear_scan_duration:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
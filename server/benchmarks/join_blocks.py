@@ -0,0 +1,43 @@
+"""Time of join_nearby_blocks on many small fragments compared to merging them pair by pair.
+
+Fragments of 2 lines with one not matching line between them are chained in groups of --chain-length, so every
+group is joined into one block. The pairwise join is the former implementation, which copied the joined block on
+every merge and scanned the rest of the chain again from every block of it.
+
+Run from the server directory:
+    python -m benchmarks.join_blocks --fragments 1000 2000 4000 --chain-length 20
+"""
+import argparse
+import json
+import logging
+import time
+
+from detector import MovedBlocksDetector
+from tests.reference_detector import fragments, pairwise_join
+
+
+def measure(join, blocks):
+    start = time.perf_counter()
+    joined_blocks = join(list(blocks))
+    return time.perf_counter() - start, json.dumps([block.to_dict() for block in joined_blocks])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fragments', type=int, nargs='+', default=[1000, 2000, 4000])
+    parser.add_argument('--chain-length', type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    detector = MovedBlocksDetector([], [])
+    print(f'{"fragments":>10} {"sweep s":>9} {"loops":>9} {"pairwise s":>11}')
+    for fragments_count in args.fragments:
+        blocks = fragments(fragments_count, args.chain_length)
+        duration, result = measure(detector.join_nearby_blocks, blocks)
+        pairwise_duration, pairwise_result = measure(lambda blocks: pairwise_join(detector, blocks), blocks)
+        assert result == pairwise_result
+        print(f'{fragments_count:>10} {duration:>9.3f} {detector.join_loops_made:>9} {pairwise_duration:>11.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Memory per changed line of LineTable storage compared to the former one object per line (and per matching line).
+
+Legacy rows rebuild what the detector kept before: a Line object with __dict__ per changed line and a file -> line
+number -> Line dict for both sides, trim text -> list of added lines (the index) and for detected blocks
+a MatchingLine object per line with two sets of line numbers per block. Keys of the table index are the distinct
+added texts the FuzzySet keeps anyway.
+
+Run from the server directory:
+    python -m benchmarks.line_memory --files 200 --lines-per-file 1000
+"""
+import argparse
+import copy
+import gc
+import logging
+import tracemalloc
+from array import array
+from collections import defaultdict
+
+from detector import MovedBlocksDetector, diff_to_lines, split_to_leading_whitespace_and_trim_text
+from diff_parser import ADDED, REMOVED, parse_changed_lines
+from tests.synthetic_diff import generate_diff
+
+
+class LegacyLine(object):
+    def __init__(self, file, line_no, text):
+        self.file = file
+        self.line_no = int(line_no)
+        self.leading_whitespaces, self.trim_text = split_to_leading_whitespace_and_trim_text(text)
+        self.trim_text_len = len(self.trim_text)
+
+
+class LegacyMatchingLine(object):
+    def __init__(self, removed_line, added_line, match_probability):
+        self.added_line = added_line
+        self.removed_line = removed_line
+        self.match_probability = match_probability
+
+
+def legacy_lines(diff_text):
+    removed_lines = []
+    added_lines = []
+    file_name_to_line_no_to_line = {ADDED: defaultdict(dict), REMOVED: defaultdict(dict)}
+    for line_type, file, line_no, text in parse_changed_lines(diff_text):
+        line = LegacyLine(file, line_no, text)
+        (added_lines if line_type == ADDED else removed_lines).append(line)
+        file_name_to_line_no_to_line[line_type][line.file][line.line_no] = line
+    return removed_lines, added_lines, file_name_to_line_no_to_line
+
+
+def legacy_index(added_lines):
+    trim_text_to_array_of_added_lines = defaultdict(list)
+    for line in added_lines:
+        trim_text_to_array_of_added_lines[line.trim_text].append(line)
+    return trim_text_to_array_of_added_lines
+
+
+def table_index(added_lines):
+    added_indexes_by_trim_text = {}
+    for added_index in range(len(added_lines)):
+        trim_text = added_lines.trim_text(added_index)
+        added_indexes_by_trim_text.setdefault(trim_text, array('i')).append(added_index)
+    return added_indexes_by_trim_text
+
+
+def interval_numbers(intervals):
+    return {line_no for start, stop in intervals for line_no in range(start, stop)}
+
+
+def legacy_blocks(blocks, lines_by_key):
+    """Return blocks in the former layout, reusing legacy Line objects (only block storage is measured)."""
+    legacy = []
+    for block in blocks:
+        lines = [LegacyMatchingLine(lines_by_key.get((REMOVED, line.removed_line.file, line.removed_line.line_no))
+                                    if line.removed_line else None,
+                                    lines_by_key.get((ADDED, line.added_line.file, line.added_line.line_no))
+                                    if line.added_line else None,
+                                    line.match_probability)
+                 for line in block.lines]
+        legacy.append((lines, interval_numbers(block.removed_line_intervals()),
+                       interval_numbers(block.added_line_intervals())))
+    return legacy
+
+
+def retained_memory(fun, *args):
+    gc.collect()
+    tracemalloc.start()
+    result = fun(*args)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--lines-per-file', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, seed=args.seed)
+    changed_lines_count = sum(1 for _ in parse_changed_lines(diff_text))
+
+    table_size, (removed_lines, added_lines) = retained_memory(diff_to_lines, diff_text)
+    table_index_size, _ = retained_memory(table_index, added_lines)
+    legacy_size, legacy = retained_memory(legacy_lines, diff_text)
+    legacy_index_size, _ = retained_memory(legacy_index, legacy[1])
+
+    blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+    block_lines_count = sum(len(block.removed_indexes) for block in blocks)
+    lines_by_key = {(line_type, file, line_no): line
+                    for line_type, files in legacy[2].items()
+                    for file, lines in files.items() for line_no, line in lines.items()}
+    legacy_blocks_size, _ = retained_memory(legacy_blocks, blocks, lines_by_key)
+    blocks_size, _ = retained_memory(copy.deepcopy, blocks)  # tables are not copied, see __getstate__
+
+    print(f'diff: {len(diff_text) / 2**20:.1f} MB, {changed_lines_count} changed lines, '
+          f'{len(blocks)} blocks of {block_lines_count} lines')
+    print(f'{"storage":>16} {"MB":>8} {"bytes per line":>15}')
+    for name, size, count in (('legacy lines', legacy_size, changed_lines_count),
+                              ('line tables', table_size, changed_lines_count),
+                              ('legacy index', legacy_index_size, changed_lines_count),
+                              ('table index', table_index_size, changed_lines_count),
+                              ('legacy blocks', legacy_blocks_size, block_lines_count),
+                              ('index blocks', blocks_size, block_lines_count)):
+        print(f'{name:>16} {size / 2**20:>8.1f} {size / max(count, 1):>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Detection time on pathological diffs of low information lines with and without max_new_blocks_per_line.
+
+Without the cap every removed `}` starts a block at every added `}` not extending a block, and every such block
+is tried for every following line, so time grows with the cube of --lines. --lines of `}` are removed from one file
+and added to another one, the repetitive diff adds the same number of lines of synthetic code with --repetition
+share of low information lines. Uncapped detection is skipped for more than --max-uncapped-lines lines.
+
+Run from the server directory:
+    python -m benchmarks.low_information_lines --lines 250 500 10000 --max-new-blocks 1
+"""
+import argparse
+import logging
+import time
+
+from detector import MovedBlocksDetector, diff_to_lines
+from tests.reference_detector import braces_diff
+from tests.synthetic_diff import generate_diff
+
+
+def detect(diff_text, **kwargs):
+    removed_lines, added_lines = diff_to_lines(diff_text)
+    detector = MovedBlocksDetector(removed_lines, added_lines, **kwargs)
+    start = time.perf_counter()
+    blocks = detector.detect_moved_blocks()
+    return time.perf_counter() - start, len(blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, nargs='+', default=[250, 500, 10000])
+    parser.add_argument('--max-new-blocks', type=int, default=1)
+    parser.add_argument('--max-uncapped-lines', type=int, default=500)
+    parser.add_argument('--repetition', type=float, default=0.5)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"diff":>12} {"lines":>8} {"uncapped s":>11} {"blocks":>7} {"capped s":>9} {"blocks":>7} '
+          f'{"capped+idf s":>13} {"blocks":>7}')
+    for lines_count in args.lines:
+        for name, diff_text in (('braces', braces_diff(lines_count)),
+                                ('repetitive', generate_diff(files_count=4, lines_per_file=lines_count // 4 * 3,
+                                                             repetition=args.repetition))):
+            uncapped = f'{"-":>11} {"-":>7}'
+            if lines_count <= args.max_uncapped_lines:
+                uncapped = '{:>11.2f} {:>7}'.format(*detect(diff_text))
+            capped = '{:>9.2f} {:>7}'.format(*detect(diff_text, max_new_blocks_per_line=args.max_new_blocks))
+            weighted = '{:>13.2f} {:>7}'.format(*detect(diff_text, max_new_blocks_per_line=args.max_new_blocks,
+                                                        idf_weighting=True))
+            print(f'{name:>12} {lines_count:>8} {uncapped} {capped} {weighted}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Speedup of detect_moved_blocks(processes=N) over the serial detection.
+
+Run from the server directory:
+    python -m benchmarks.parallel_detection --files 200 --lines-per-file 500
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from detector import MovedBlocksDetector
+from tests.synthetic_diff import generate_diff
+
+
+def detect(diff_text, processes):
+    start = time.perf_counter()
+    detector = MovedBlocksDetector.from_diff(diff_text)
+    blocks = detector.detect_moved_blocks(processes=processes)
+    duration = time.perf_counter() - start
+    return duration, json.dumps([block.to_dict() for block in blocks])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=sorted({1, 2, 4, 8, 16, os.cpu_count() or 1}))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, seed=args.seed)
+    print(f'diff: {len(diff_text.splitlines())} lines, {os.cpu_count()} cpus')
+    serial_duration, serial_result = detect(diff_text, processes=None)
+    print(f'{"processes":>9} {"seconds":>9} {"speedup":>8}')
+    print(f'{"serial":>9} {serial_duration:>9.2f} {1:>8.2f}')
+    for processes in args.processes:
+        duration, result = detect(diff_text, processes=processes)
+        assert result == serial_result, f'result with {processes} processes differs from serial result'
+        print(f'{processes:>9} {duration:>9.2f} {serial_duration / duration:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Size and encode time of detected blocks in schemas of serialization.py compared to json.dumps of to_dict trees.
+
+Blocks are detected once and encoded --repeat times with each encoder, the best time is reported.
+
+Run from the server directory:
+    python -m benchmarks.result_encoding --files 100 --lines-per-file 500
+"""
+import argparse
+import json
+import logging
+import time
+
+import serialization
+from detector import MovedBlocksDetector
+from main import CustomJsonEncoder
+from tests.synthetic_diff import generate_diff
+
+
+def measure(encode, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = encode()
+        durations.append(time.perf_counter() - start)
+    return min(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--edit-noise', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, edit_noise=args.edit_noise,
+                              seed=args.seed)
+    blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+    print(f'{len(blocks)} blocks of {sum(len(block.removed_indexes) for block in blocks)} lines, '
+          f'orjson: {"yes" if serialization.orjson is not None else "no"}')
+    legacy_duration, legacy_result = measure(
+        lambda: json.dumps(blocks, cls=CustomJsonEncoder).encode('utf-8'), args.repeat)
+    full_duration, full_result = measure(lambda: serialization.blocks_to_json(blocks), args.repeat)
+    assert full_result == legacy_result
+    compact_duration, compact_result = measure(lambda: serialization.blocks_to_json(blocks, serialization.COMPACT),
+                                               args.repeat)
+    print(f'{"encoder":>10} {"seconds":>8} {"bytes":>11}')
+    for name, duration, result in (('to_dict', legacy_duration, legacy_result),
+                                   (serialization.FULL, full_duration, full_result),
+                                   (serialization.COMPACT, compact_duration, compact_result)):
+        print(f'{name:>10} {duration:>8.3f} {len(result):>11}')
+
+
+if __name__ == '__main__':
+    main()
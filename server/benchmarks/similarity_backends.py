@@ -0,0 +1,60 @@
+"""Speed and recall of similarity backends (see similarity.py) compared to the default fuzzyset backend.
+
+For every backend it reports time of fuzzy matching and of the whole detection, recall of matching pairs
+(removed text, added text) and recall of lines of detected blocks - share of removed lines in blocks found with
+fuzzyset which are in blocks found with the backend too.
+
+Run from the server directory:
+    python -m benchmarks.similarity_backends --files 100 --lines-per-file 500 --edit-noise 0.3
+"""
+import argparse
+import logging
+import time
+
+import similarity
+from detector import MovedBlocksDetector, diff_to_lines
+from tests.synthetic_diff import generate_diff
+
+
+def detect(removed_lines, added_lines, similarity_backend):
+    start = time.perf_counter()
+    detector = MovedBlocksDetector(removed_lines, added_lines, similarity_backend=similarity_backend)
+    pairs = detector.find_fuzzy_matching_pairs(range(len(removed_lines)))
+    matching_duration = time.perf_counter() - start
+    detector.fuzzy_matching_pairs_by_text = pairs
+    blocks = detector.detect_moved_blocks()
+    duration = time.perf_counter() - start
+    matching_pairs = {(text, added_text) for text, text_pairs in pairs.items() for _, added_text in text_pairs or ()}
+    block_lines = {(line.removed_line.file, line.removed_line.line_no)
+                   for block in blocks for line in block.lines if line.removed_line is not None}
+    return matching_duration, duration, matching_pairs, block_lines
+
+
+def recall(found, expected):
+    return len(found & expected) / len(expected) if expected else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--edit-noise', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', nargs='+', default=list(similarity.BACKENDS))
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    diff_text = generate_diff(files_count=args.files, lines_per_file=args.lines_per_file, edit_noise=args.edit_noise,
+                              seed=args.seed)
+    removed_lines, added_lines = diff_to_lines(diff_text)
+    print(f'{len(removed_lines)} removed and {len(added_lines)} added lines')
+    print(f'{"backend":>10} {"matching s":>11} {"total s":>8} {"pairs":>8} {"pair recall":>12} {"line recall":>12}')
+    _, _, expected_pairs, expected_lines = detect(removed_lines, added_lines, similarity.FuzzySetBackend.name)
+    for backend in args.backends:
+        matching_duration, duration, pairs, lines = detect(removed_lines, added_lines, backend)
+        print(f'{backend:>10} {matching_duration:>11.2f} {duration:>8.2f} {len(pairs):>8} '
+              f'{recall(pairs, expected_pairs):>12.3f} {recall(lines, expected_lines):>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""Benchmark suite of the whole detection pipeline on synthetic diffs and on the corpus of anonymized real diffs.
+
+Every case is timed stage by stage:
+* parse - diff_to_lines,
+* init - MovedBlocksDetector.__init__,
+* detect - detect_moved_blocks, with its steps (find_fuzzy_matching_pairs, grow_blocks, join_nearby_blocks and
+  filter_blocks) as measured by measure_fun_time,
+* encode and encode_compact - JSON of detected blocks in full and compact schema (see serialization.py).
+Times are the best of --repeat runs. Peak memory traced by tracemalloc during each stage (not of steps of detect)
+is measured in one more run, as tracing slows everything down.
+
+Synthetic cases are diffs of tests.synthetic_diff with sizes, move ratios, edit noise, repetition of lines and
+file counts of SYNTHETIC_CASES, --files and the other generator options add a custom one. Corpus cases are
+diffs in benchmarks/corpus (see benchmarks.anonymize_diff).
+
+Wide cases are diffs of tests.synthetic_diff.generate_wide_diff (many files edited in place and a few blocks moved
+between them), detected with and without file_pair_filter (see file_pairs.py) - cases with detector_options are
+detected with those MovedBlocksDetector keyword arguments.
+
+Cases with gram_index are detected with a gram index (see gram_index.py): an empty one in every run (vectors are
+computed and stored) or a warm one, which has vectors of all lines of the diff (as for a pull request touching
+the same files as earlier ones). Their steps include load_gram_vectors and store_gram_vectors as well.
+
+Results are written as JSON (--output). Given results of an earlier run (--baseline), stages slower than in it by
+more than --threshold (and by more than --min-seconds) or with peak memory higher by more than --threshold (and
+by more than --min-bytes) are reported as regressions and the exit code is 1.
+
+Run from the server directory:
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --output results.json
+"""
+import argparse
+import gzip
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import serialization
+from benchmarks.anonymize_diff import CORPUS_PATH
+from detector import MovedBlocksDetector, diff_to_lines
+from gram_index import GramIndex
+from tests.synthetic_diff import generate_diff, generate_wide_diff
+from time_utils import collect_durations
+
+EMPTY_GRAM_INDEX = 'empty'
+WARM_GRAM_INDEX = 'warm'
+
+SYNTHETIC_CASES = {
+    'small': dict(files_count=10, lines_per_file=200),
+    'medium': dict(files_count=50, lines_per_file=500),
+    'noisy': dict(files_count=50, lines_per_file=500, edit_noise=0.3),
+    'repetitive': dict(files_count=20, lines_per_file=500, repetition=0.5),
+    'mostly_moved': dict(files_count=20, lines_per_file=500, move_ratio=0.8),
+    'many_files': dict(files_count=1000, lines_per_file=30),
+    'large': dict(files_count=200, lines_per_file=1000),
+    'gram_index_empty': dict(files_count=50, lines_per_file=500, gram_index=EMPTY_GRAM_INDEX),
+    'gram_index_warm': dict(files_count=50, lines_per_file=500, gram_index=WARM_GRAM_INDEX),
+    'wide': dict(generator=generate_wide_diff, files_count=500, edited_lines=10, moves_count=20, move_lines=15),
+    'wide_file_pair_filter': dict(generator=generate_wide_diff, files_count=500, edited_lines=10, moves_count=20,
+                                  move_lines=15, detector_options=dict(file_pair_filter=True)),
+}
+# cases run when none are given
+DEFAULT_SYNTHETIC_CASES = ['small', 'medium', 'noisy', 'repetitive', 'mostly_moved', 'many_files',
+                           'gram_index_empty', 'gram_index_warm', 'wide', 'wide_file_pair_filter']
+# options of SYNTHETIC_CASES which are not options of their generator, but of run_case
+RUN_OPTIONS = ['gram_index', 'detector_options']
+
+STAGES = ['parse', 'init', 'detect', 'encode', 'encode_compact']
+DETECT_STEPS = ['find_fuzzy_matching_pairs', 'grow_blocks', 'join_nearby_blocks', 'filter_blocks']
+GRAM_INDEX_STEPS = ['load_gram_vectors', 'store_gram_vectors']
+# counts of the detector added to results of cases which have them
+DETECTOR_COUNTS = ['loaded_gram_vectors', 'stored_gram_vectors', 'file_groups']
+
+
+def corpus_cases():
+    if not os.path.isdir(CORPUS_PATH):
+        return []
+    return sorted(name[:-len('.diff.gz')] for name in os.listdir(CORPUS_PATH) if name.endswith('.diff.gz'))
+
+
+def case_diff(name, custom_options):
+    """Return (diff text, keyword arguments of run_case - RUN_OPTIONS of the case)."""
+    if name == 'custom':
+        return generate_diff(**custom_options), {}
+    if name in SYNTHETIC_CASES:
+        options = dict(SYNTHETIC_CASES[name])
+        generator = options.pop('generator', generate_diff)
+        run_options = {option: options.pop(option) for option in RUN_OPTIONS if option in options}
+        return generator(**options), run_options
+    with gzip.open(os.path.join(CORPUS_PATH, f'{name}.diff.gz'), 'rt', encoding='utf-8') as diff:
+        return diff.read(), {}
+
+
+class Stages(object):
+    """Durations and peak memory of stages of one run of the pipeline."""
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+
+    def run(self, stage, fun, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = fun(*args, **kwargs)
+        self.seconds[stage] = time.perf_counter() - start
+        if self.trace_memory:
+            self.peak_bytes[stage] = tracemalloc.get_traced_memory()[1]
+        return result
+
+
+def run_pipeline(diff_text, trace_memory=False, gram_index=None, detector_options=None):
+    stages = Stages(trace_memory)
+    with collect_durations() as durations:
+        removed_lines, added_lines = stages.run('parse', diff_to_lines, diff_text)
+        detector = stages.run('init', MovedBlocksDetector, removed_lines, added_lines, gram_index=gram_index,
+                              **(detector_options or {}))
+        blocks = stages.run('detect', detector.detect_moved_blocks)
+    steps = DETECT_STEPS + (GRAM_INDEX_STEPS if gram_index is not None else [])
+    stages.seconds.update((step, durations.get(step, 0.0)) for step in steps)
+    stages.run('encode', serialization.blocks_to_json, blocks)
+    stages.run('encode_compact', serialization.blocks_to_json, blocks, serialization.COMPACT)
+    counts = {'removed_lines': len(removed_lines), 'added_lines': len(added_lines), 'blocks': len(blocks)}
+    counts.update((name, detector.counts[name]) for name in DETECTOR_COUNTS if name in detector.counts)
+    return stages, counts
+
+
+def run_case(diff_text, repeat, trace_memory, gram_index=None, detector_options=None):
+    """Return results of a case, gram_index is EMPTY_GRAM_INDEX, WARM_GRAM_INDEX or None (see the docstring),
+    detector_options are keyword arguments of MovedBlocksDetector."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        runs = itertools.count()
+
+        def case_gram_index():
+            if gram_index is None:
+                return None
+            file_name = 'warm.sqlite' if gram_index == WARM_GRAM_INDEX else f'empty-{next(runs)}.sqlite'
+            return GramIndex(os.path.join(temp_dir, file_name))
+
+        if gram_index == WARM_GRAM_INDEX:
+            run_pipeline(diff_text, gram_index=case_gram_index(), detector_options=detector_options)  # fills the index
+        seconds = {}
+        counts = None
+        for _ in range(repeat):
+            stages, counts = run_pipeline(diff_text, gram_index=case_gram_index(), detector_options=detector_options)
+            for stage, duration in stages.seconds.items():
+                seconds[stage] = min(duration, seconds.get(stage, duration))
+        result = {'diff_bytes': len(diff_text.encode('utf-8')), **counts,
+                  'seconds': {stage: round(duration, 6) for stage, duration in seconds.items()}}
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                stages, _ = run_pipeline(diff_text, trace_memory=True, gram_index=case_gram_index(),
+                                         detector_options=detector_options)
+            finally:
+                tracemalloc.stop()
+            result['peak_bytes'] = stages.peak_bytes
+    return result
+
+
+def regressions(results, baseline, threshold, min_seconds, min_bytes):
+    """Return list of (case, stage, metric, baseline value, value) of stages worse than in baseline."""
+    found = []
+    for case, case_result in results['cases'].items():
+        baseline_case = baseline['cases'].get(case)
+        if baseline_case is None:
+            continue
+        for metric, min_difference in (('seconds', min_seconds), ('peak_bytes', min_bytes)):
+            for stage, value in case_result.get(metric, {}).items():
+                baseline_value = baseline_case.get(metric, {}).get(stage)
+                if (baseline_value is not None and value > baseline_value * (1 + threshold)
+                        and value - baseline_value > min_difference):
+                    found.append((case, stage, metric, baseline_value, value))
+    return found
+
+
+def print_results(results, baseline):
+    print(f'{"case":>24} {"stage":>26} {"seconds":>9} {"baseline":>9} {"peak MB":>8} {"baseline":>9}')
+    for case, case_result in results['cases'].items():
+        baseline_case = (baseline or {}).get('cases', {}).get(case, {})
+        for stage, seconds in case_result['seconds'].items():
+            baseline_seconds = baseline_case.get('seconds', {}).get(stage)
+            peak_bytes = case_result.get('peak_bytes', {}).get(stage)
+            baseline_peak_bytes = baseline_case.get('peak_bytes', {}).get(stage)
+            print(f'{case:>24} {stage:>26} {seconds:>9.3f} {format_value(baseline_seconds, 1, 3):>9} '
+                  f'{format_value(peak_bytes, 2 ** 20, 1):>8} {format_value(baseline_peak_bytes, 2 ** 20, 1):>9}')
+
+
+def format_value(value, unit, digits):
+    return '-' if value is None else f'{value / unit:.{digits}f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+',
+                        help=f'cases to run: synthetic ({", ".join(SYNTHETIC_CASES)}), corpus '
+                             f'({", ".join(corpus_cases()) or "empty"}) or groups synthetic, corpus and all '
+                             f'(default: {", ".join(DEFAULT_SYNTHETIC_CASES)} and corpus)')
+    parser.add_argument('--files', type=int, help='files of custom synthetic case')
+    parser.add_argument('--lines-per-file', type=int, default=500)
+    parser.add_argument('--move-ratio', type=float, default=0.3)
+    parser.add_argument('--edit-noise', type=float, default=0.1)
+    parser.add_argument('--repetition', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON file of results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative increase')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='smaller increases of time are ignored')
+    parser.add_argument('--min-bytes', type=int, default=2 ** 20, help='smaller increases of memory are ignored')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    groups = {'synthetic': list(SYNTHETIC_CASES), 'corpus': corpus_cases()}
+    groups['all'] = groups['synthetic'] + groups['corpus']
+    cases = []
+    for case in args.cases or DEFAULT_SYNTHETIC_CASES + groups['corpus']:
+        for name in groups.get(case, [case]):
+            if name not in SYNTHETIC_CASES and name not in groups['corpus']:
+                parser.error(f'unknown case: {name}')
+            if name not in cases:
+                cases.append(name)
+    custom_options = None
+    if args.files is not None:
+        custom_options = dict(files_count=args.files, lines_per_file=args.lines_per_file, move_ratio=args.move_ratio,
+                              edit_noise=args.edit_noise, repetition=args.repetition, seed=args.seed)
+        cases.append('custom')
+
+    results = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': {},
+    }
+    for case in cases:
+        print(f'Running {case}', file=sys.stderr)
+        diff_text, run_options = case_diff(case, custom_options)
+        results['cases'][case] = run_case(diff_text, args.repeat, not args.no_memory, **run_options)
+        if case == 'custom':
+            results['cases'][case]['options'] = custom_options
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if baseline is not None:
+        found = regressions(results, baseline, args.threshold, args.min_seconds, args.min_bytes)
+        for case, stage, metric, baseline_value, value in found:
+            print(f'REGRESSION {case} {stage} {metric}: {baseline_value} -> {value} '
+                  f'({value / baseline_value - 1:+.0%})')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
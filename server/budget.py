@@ -0,0 +1,102 @@
+"""Budgets of work of one detection and steps detection degrades with when they are exceeded - so an oversized diff
+(e.g. of vendored dependencies) gets a worse result instead of holding a worker for minutes.
+
+Steps, every one is applied together with the ones before it:
+* EXACT_ONLY - texts of removed lines are matched only with equal texts of added lines (if it happens before
+  detection starts, the fuzzy index of added lines is not even built),
+* SKIPPED_FILES - removed lines of files with more than max_file_changed_lines changed lines (lockfiles, generated
+  code) are not matched,
+* PARTIAL - the rest of removed lines is not matched, blocks of lines matched so far are returned.
+
+Budgets:
+* max_diff_bytes - UTF-8 bytes of the diff text parsed, the rest of it is read (so a raw diff is hashed whole) but
+  not parsed (EXACT_ONLY, reported as PARTIAL as well),
+* max_changed_lines - removed and added lines (EXACT_ONLY),
+* max_fuzzy_candidates - fuzzy matching (removed text, added text) pairs found (EXACT_ONLY),
+* max_seconds - time since the budget was created: a third of it moves detection to EXACT_ONLY, two thirds to
+  SKIPPED_FILES and all of it to PARTIAL.
+The detector checks them every detector.PROGRESS_LINES removed lines (see MovedBlocksDetector budget argument).
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+EXACT_ONLY = 'exact-only'
+SKIPPED_FILES = 'skipped-files'
+PARTIAL = 'partial'
+STEPS = (EXACT_ONLY, SKIPPED_FILES, PARTIAL)
+
+DEFAULT_MAX_FILE_CHANGED_LINES = 5000
+
+
+class DetectionBudget(object):
+    def __init__(self, max_diff_bytes=None, max_changed_lines=None, max_fuzzy_candidates=None, max_seconds=None,
+                 max_file_changed_lines=DEFAULT_MAX_FILE_CHANGED_LINES, time_function=time.monotonic):
+        self.max_diff_bytes = max_diff_bytes
+        self.max_changed_lines = max_changed_lines
+        self.max_fuzzy_candidates = max_fuzzy_candidates
+        self.max_seconds = max_seconds
+        self.max_file_changed_lines = max_file_changed_lines
+        self._time = time_function
+        self.started_at = time_function()
+        self.steps_count = 0  # number of STEPS applied
+        self.diff_truncated = False
+
+    @property
+    def degradations(self):
+        """Return steps applied, in order - with PARTIAL if the diff was not parsed whole."""
+        degradations = list(STEPS[:self.steps_count])
+        if self.diff_truncated and PARTIAL not in degradations:
+            degradations.append(PARTIAL)
+        return degradations
+
+    @property
+    def exact_only(self):
+        return self.steps_count >= 1
+
+    @property
+    def skipped_files(self):
+        return self.steps_count >= 2
+
+    @property
+    def partial(self):
+        return self.steps_count >= 3
+
+    def degrade_to(self, step, reason):
+        steps_count = STEPS.index(step) + 1
+        if steps_count > self.steps_count:
+            logger.info(f'Detection degraded to {step}: {reason}')
+            self.steps_count = steps_count
+
+    def limited_lines(self, lines):
+        """Yield lines of diff until they are longer than max_diff_bytes in total (encoded as UTF-8), the rest is read
+        but not yielded."""
+        if self.max_diff_bytes is None:
+            yield from lines
+            return
+        lines = iter(lines)
+        diff_bytes = 0
+        for line in lines:
+            diff_bytes += len(line) if line.isascii() else len(line.encode('utf-8', 'surrogatepass'))
+            if diff_bytes > self.max_diff_bytes:
+                self.diff_truncated = True
+                self.degrade_to(EXACT_ONLY, f'diff is longer than {self.max_diff_bytes} bytes')
+                for _ in lines:
+                    pass
+                return
+            yield line
+
+    def check_changed_lines(self, changed_lines_count):
+        if self.max_changed_lines is not None and changed_lines_count > self.max_changed_lines:
+            self.degrade_to(EXACT_ONLY, f'{changed_lines_count} changed lines is more than {self.max_changed_lines}')
+
+    def check(self, fuzzy_candidates=0):
+        """Degrade detection if fuzzy candidates found so far or time are over budget."""
+        if self.max_fuzzy_candidates is not None and fuzzy_candidates > self.max_fuzzy_candidates:
+            self.degrade_to(EXACT_ONLY, f'{fuzzy_candidates} fuzzy candidates is more than {self.max_fuzzy_candidates}')
+        if self.max_seconds is not None:
+            seconds = self._time() - self.started_at
+            steps_count = min(int(seconds * len(STEPS) / self.max_seconds), len(STEPS))
+            if steps_count > self.steps_count:
+                self.degrade_to(STEPS[steps_count - 1], f'detection took {seconds:.1f} of {self.max_seconds} seconds')
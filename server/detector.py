@@ -1,59 +1,74 @@
 import json
 import logging
-from collections import defaultdict
+import math
+import multiprocessing
+from array import array
+from collections import Counter, defaultdict
 from textwrap import dedent
 from typing import List, Dict
 
-from unidiff import PatchSet
-
-from fuzzyset import FuzzySet
+import diff_parser
+import file_pairs
+import incremental
+import metrics
+import similarity
 from time_utils import measure_fun_time
 
 logger = logging.getLogger(__name__)
 
+# Diffs with fewer removed lines per worker are not worth forking for.
+MIN_REMOVED_LINES_PER_PROCESS = 1000
+
+# Min score of fuzzy match of a removed line text (and of a text of 1-2 characters) with an added line text.
+MIN_MATCH_SCORE = 0.5
+SHORT_TEXT_MIN_MATCH_SCORE = 0.35
+
+# Min number of not empty lines of a run of identical lines to become a block without fuzzy matching (exact_anchors).
+MIN_EXACT_RUN_LINES = 3
+
+# Texts of more added lines are low information ones (think of `}`), new blocks they start can be capped.
+LOW_INFORMATION_LINES_COUNT = 32
+
+# Removed lines fuzzy matched between calls of progress of detect_moved_blocks.
+PROGRESS_LINES = 1000
+
+# MovedBlocksDetector shared with forked worker processes of detect_moved_blocks(processes=...).
+_worker_detector = None
+
 
 def filepath(patched_file):
     """Return target path as this is convinient to use in GitHub"""
-    if patched_file.source_file.startswith('a/') and patched_file.target_file.startswith('b/'):
-        filepath = patched_file.target_file[2:]
-    elif patched_file.source_file.startswith('a/') and patched_file.target_file == '/dev/null':
-        filepath = patched_file.source_file[2:]
-    elif patched_file.target_file.startswith('b/') and patched_file.source_file == '/dev/null':
-        filepath = patched_file.target_file[2:]
-    else:
-        filepath = patched_file.source_file
-    return filepath
+    return diff_parser.filepath(patched_file.source_file, patched_file.target_file)
 
 
 def diff_to_added_and_removed_lines(diff_text):
-    patch = PatchSet(diff_text)
-    added_lines = []
-    removed_lines = []
-    for patched_file in patch:
-        file = filepath(patched_file)
-        for hunk in patched_file:
-            for line in hunk:
-                leading_whitespace, trim_text = split_to_leading_whitespace_and_trim_text(line.value.rstrip('\n'))
-                if line.is_added:
-                    line_no = line.target_line_no
-                    lines_list = added_lines
-                elif line.is_removed:
-                    line_no = line.source_line_no
-                    lines_list = removed_lines
-                else:
-                    continue
-                lines_list.append({
-                    'file': file,
-                    'line_no': line_no,
-                    'trim_text': trim_text,
-                    'leading_whitespaces': leading_whitespace,
-                })
+    removed_lines, added_lines = diff_to_lines(diff_text)
     return {
-        'added_lines': added_lines,
-        'removed_lines': removed_lines,
+        'added_lines': [line.to_dict() for line in added_lines],
+        'removed_lines': [line.to_dict() for line in removed_lines],
     }
 
 
+@measure_fun_time()
+def diff_to_lines(diff, budget=None):
+    """Return (removed lines, added lines) tables of diff given as text or iterable of lines (e.g. a file).
+
+    With budget only its max_diff_bytes of the diff are parsed (see budget.DetectionBudget.limited_lines), a hunk
+    cut short there is parsed up to the cut."""
+    tables = {diff_parser.ADDED: LineTable(), diff_parser.REMOVED: LineTable()}
+    if budget is not None:
+        diff = budget.limited_lines(diff_parser.iterate_lines(diff))
+    try:
+        for line_type, file, line_no, text in diff_parser.parse_changed_lines(diff):
+            tables[line_type].append(file, line_no, text)
+    except diff_parser.DiffParseError:
+        if budget is None or not budget.diff_truncated:
+            raise
+    for table in tables.values():
+        table.join_texts()
+    return tables[diff_parser.REMOVED], tables[diff_parser.ADDED]
+
+
 def split_to_leading_whitespace_and_trim_text(text):
     trim_text = text.lstrip() if text else ''
     if trim_text:
@@ -63,12 +78,164 @@ def split_to_leading_whitespace_and_trim_text(text):
     return leading_whitespaces, trim_text
 
 
+class LineTable(object):
+    """Lines stored in columns: interned file id, line number, offset of text in one text buffer and length of
+    leading whitespaces - about 16 bytes per line plus its text. Line objects are views of rows.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.file_ids = array('i')
+        self.line_nos = array('i')
+        self.text_offsets = array('q', [0])  # text of line index is text[text_offsets[index]:text_offsets[index + 1]]
+        self.leading_whitespaces_lengths = array('i')
+        # lines of every file are one run of growing line numbers, as in diffs made by git
+        self.ordered = True
+        self._file_id_by_file = {}
+        self._text = ''
+        self._text_chunks = []
+        self._pending_texts = []
+        self._indexes = None
+
+    def append(self, file, line_no, text):
+        """Add line and return its index."""
+        leading_whitespaces, trim_text = split_to_leading_whitespace_and_trim_text(text)
+        file_id = self._file_id_by_file.get(file)
+        if file_id is None:
+            file_id = self._file_id_by_file[file] = len(self.files)
+            self.files.append(file)
+        elif self.file_ids[-1] != file_id:
+            self.ordered = False
+        line_no = int(line_no)
+        if self.line_nos and self.file_ids[-1] == file_id and self.line_nos[-1] >= line_no:
+            self.ordered = False
+        self.file_ids.append(file_id)
+        self.line_nos.append(line_no)
+        self.text_offsets.append(self.text_offsets[-1] + len(leading_whitespaces) + len(trim_text))
+        self.leading_whitespaces_lengths.append(len(leading_whitespaces))
+        self._pending_texts.append(leading_whitespaces)
+        self._pending_texts.append(trim_text)
+        if len(self._pending_texts) >= 8192:
+            self._text_chunks.append(''.join(self._pending_texts))
+            self._pending_texts = []
+        self._indexes = None
+        return len(self.line_nos) - 1
+
+    def join_texts(self):
+        """Move texts of lines appended since the last call to the text buffer (reading text does it as well)."""
+        if self._pending_texts:
+            self._text_chunks.append(''.join(self._pending_texts))
+            self._pending_texts = []
+        if self._text_chunks:
+            self._text = ''.join([self._text] + self._text_chunks)
+            self._text_chunks = []
+
+    def split_files(self, parts):
+        """Return LineTables of lines of files of each of parts (lists of file ids, a file can be in more of them),
+        lines are in order."""
+        parts_by_file_id = defaultdict(list)
+        for part, file_ids in enumerate(parts):
+            for file_id in file_ids:
+                parts_by_file_id[file_id].append(part)
+        tables = [LineTable() for _ in parts]
+        text = self.text
+        text_offsets = self.text_offsets
+        for index, file_id in enumerate(self.file_ids):
+            for part in parts_by_file_id.get(file_id, ()):
+                tables[part].append(self.files[file_id], self.line_nos[index],
+                                    text[text_offsets[index]:text_offsets[index + 1]])
+        for table in tables:
+            table.join_texts()
+        return tables
+
+    @property
+    def text(self):
+        if self._pending_texts or self._text_chunks:
+            self.join_texts()
+        return self._text
+
+    def file(self, index):
+        return self.files[self.file_ids[index]]
+
+    def leading_whitespaces(self, index):
+        start = self.text_offsets[index]
+        return self.text[start:start + self.leading_whitespaces_lengths[index]]
+
+    def trim_text(self, index):
+        start = self.text_offsets[index] + self.leading_whitespaces_lengths[index]
+        return self.text[start:self.text_offsets[index + 1]]
+
+    def trim_text_len(self, index):
+        return self.text_offsets[index + 1] - self.text_offsets[index] - self.leading_whitespaces_lengths[index]
+
+    def next_line_index(self, index):
+        """Return index of the line right after line index in the same file or -1 if there is no such line."""
+        if self.ordered:
+            next_index = index + 1
+            if (next_index < len(self.line_nos) and self.file_ids[next_index] == self.file_ids[index]
+                    and self.line_nos[next_index] == self.line_nos[index] + 1):
+                return next_index
+            return -1
+        if self._indexes is None:
+            self._indexes = {key: i for i, key in enumerate(zip(self.file_ids, self.line_nos))}
+        return self._indexes.get((self.file_ids[index], self.line_nos[index] + 1), -1)
+
+    def previous_line_index(self, index):
+        """Return index of the line right before line index in the same file or -1 if there is no such line."""
+        if self.ordered:
+            previous_index = index - 1
+            if (previous_index >= 0 and self.file_ids[previous_index] == self.file_ids[index]
+                    and self.line_nos[previous_index] == self.line_nos[index] - 1):
+                return previous_index
+            return -1
+        if self._indexes is None:
+            self._indexes = {key: i for i, key in enumerate(zip(self.file_ids, self.line_nos))}
+        return self._indexes.get((self.file_ids[index], self.line_nos[index] - 1), -1)
+
+    def __len__(self):
+        return len(self.line_nos)
+
+    def __getitem__(self, index):
+        return Line.of(self, index)
+
+    def __iter__(self):
+        return (Line.of(self, index) for index in range(len(self.line_nos)))
+
+
 class Line(object):
+    """View of a row of LineTable - Line(file, line_no, text) creates a table with a single line."""
+    __slots__ = ('table', 'index')
+
     def __init__(self, file, line_no, text):
-        self.file = file
-        self.line_no = int(line_no)
-        self.leading_whitespaces, self.trim_text = split_to_leading_whitespace_and_trim_text(text)
-        self.trim_text_len = len(self.trim_text)
+        self.table = LineTable()
+        self.index = self.table.append(file, line_no, text)
+
+    @classmethod
+    def of(cls, table, index):
+        line = cls.__new__(cls)
+        line.table = table
+        line.index = index
+        return line
+
+    @property
+    def file(self):
+        return self.table.file(self.index)
+
+    @property
+    def line_no(self):
+        return self.table.line_nos[self.index]
+
+    @property
+    def leading_whitespaces(self):
+        return self.table.leading_whitespaces(self.index)
+
+    @property
+    def trim_text(self):
+        return self.table.trim_text(self.index)
+
+    @property
+    def trim_text_len(self):
+        return self.table.trim_text_len(self.index)
 
     @staticmethod
     def from_dict(line_dict):
@@ -77,6 +244,12 @@ class Line(object):
                     text=line_dict['leading_whitespaces'] + line_dict['trim_text'])
         return line
 
+    def index_in(self, table):
+        """Return index of this line in table (it is added to table if it is a line of another table)."""
+        if self.table is table:
+            return self.index
+        return table.append(self.file, self.line_no, str(self))
+
     def is_line_before(self, line):
         return self.file == line.file and self.line_no + 1 == line.line_no
 
@@ -99,6 +272,8 @@ class Line(object):
 
 
 class MatchingLine(object):
+    __slots__ = ('added_line', 'removed_line', 'match_probability')
+
     def __init__(self, removed_line, added_line, match_probability):
         self.added_line: Line = added_line
         self.removed_line: Line = removed_line
@@ -116,88 +291,131 @@ class MatchingLine(object):
 
 
 class MatchingBlock(object):
-
-    def __init__(self):
-        self.lines: List[MatchingLine] = []
-        self.first_removed_line = None
-        self.first_added_line = None
-        self.last_removed_line = None
-        self.last_added_line = None
+    """Matching lines stored as indexes of removed and added lines in their tables.
+
+    Index -1 means there is no line on this side - the block was extended with an empty line on the other one.
+    MatchingLine objects are created only when lines are read.
+    """
+    __slots__ = ('removed_table', 'added_table', 'removed_indexes', 'added_indexes', 'match_probabilities',
+                 'last_removed_index', 'last_added_index', 'not_empty_lines', 'weighted_lines_count',
+                 'weighted_chars_count', 'char_count', 'match_density', 'remove_part_is_inside_larger_block')
+
+    def __init__(self, removed_table=None, added_table=None):
+        self.removed_table: LineTable = removed_table
+        self.added_table: LineTable = added_table
+        self.removed_indexes = array('i')
+        self.added_indexes = array('i')
+        self.match_probabilities = []
+        self.last_removed_index = -1
+        self.last_added_index = -1
         self.not_empty_lines = 0
         self.weighted_lines_count = 0
         self.weighted_chars_count = 0
         self.char_count = 0
         self.match_density = 0
-        self.added_lines_numbers = set()
-        self.removed_lines_numbers = set()
 
     @classmethod
     def from_line(cls, removed_line, added_line, match_probability=1):
-        block = MatchingBlock()
-        block.lines = [MatchingLine(removed_line, added_line, match_probability)]
-        block.first_removed_line = removed_line
-        block.first_added_line = added_line
-        block.last_removed_line = removed_line
-        block.last_added_line = added_line
-        block.not_empty_lines = 0 if removed_line.is_empty() else 1
-        block.weighted_lines_count = 0 if removed_line.is_empty() else match_probability
-        block.char_count = removed_line.trim_text_len + added_line.trim_text_len
-        block.weighted_chars_count = (removed_line.trim_text_len + added_line.trim_text_len) * match_probability
+        return cls.from_indexes(removed_line.table, added_line.table, removed_line.index, added_line.index,
+                                match_probability)
+
+    @classmethod
+    def from_indexes(cls, removed_table, added_table, removed_index, added_index, match_probability=1):
+        block = MatchingBlock(removed_table, added_table)
+        block.removed_indexes.append(removed_index)
+        block.added_indexes.append(added_index)
+        block.match_probabilities.append(match_probability)
+        block.last_removed_index = removed_index
+        block.last_added_index = added_index
+        removed_trim_text_len = removed_table.trim_text_len(removed_index)
+        chars_count = removed_trim_text_len + added_table.trim_text_len(added_index)
+        block.not_empty_lines = 0 if removed_trim_text_len == 0 else 1
+        block.weighted_lines_count = 0 if removed_trim_text_len == 0 else match_probability
+        block.char_count = chars_count
+        block.weighted_chars_count = chars_count * match_probability
         block.match_density = block.weighted_chars_count / block.char_count
-        block.added_lines_numbers.add(added_line.line_no)
-        block.removed_lines_numbers.add(removed_line.line_no)
         return block
 
     def try_extend_with_line(self, removed_line, added_line, match_probability=1):
         if (self.last_removed_line.is_line_before(removed_line)
                 and self.last_added_line.is_line_before(added_line)):
-            self.lines.append(MatchingLine(removed_line, added_line, match_probability))
-            self.last_removed_line = removed_line
-            self.last_added_line = added_line
-            self.not_empty_lines += 0 if removed_line.is_empty() else 1
-            self.weighted_lines_count += 0 if removed_line.is_empty() else match_probability
-            self.char_count += removed_line.trim_text_len + added_line.trim_text_len
-            self.weighted_chars_count += (removed_line.trim_text_len + added_line.trim_text_len) * match_probability
-            self.match_density = self.weighted_chars_count / self.char_count
-            self.added_lines_numbers.add(added_line.line_no)
-            self.removed_lines_numbers.add(removed_line.line_no)
+            self.extend_with_indexes(removed_line.index_in(self.removed_table), added_line.index_in(self.added_table),
+                                     match_probability)
             return True
         return False
 
+    def try_extend_with_indexes(self, removed_index, added_index, match_probability=1):
+        removed_table = self.removed_table
+        last_removed_index = self.last_removed_index
+        if (removed_table.line_nos[last_removed_index] + 1 != removed_table.line_nos[removed_index]
+                or removed_table.file_ids[last_removed_index] != removed_table.file_ids[removed_index]):
+            return False
+        added_table = self.added_table
+        last_added_index = self.last_added_index
+        if (added_table.line_nos[last_added_index] + 1 != added_table.line_nos[added_index]
+                or added_table.file_ids[last_added_index] != added_table.file_ids[added_index]):
+            return False
+        self.extend_with_indexes(removed_index, added_index, match_probability)
+        return True
+
+    def extend_with_indexes(self, removed_index, added_index, match_probability):
+        self.removed_indexes.append(removed_index)
+        self.added_indexes.append(added_index)
+        self.match_probabilities.append(match_probability)
+        self.last_removed_index = removed_index
+        self.last_added_index = added_index
+        removed_trim_text_len = self.removed_table.trim_text_len(removed_index)
+        chars_count = removed_trim_text_len + self.added_table.trim_text_len(added_index)
+        self.not_empty_lines += 0 if removed_trim_text_len == 0 else 1
+        self.weighted_lines_count += 0 if removed_trim_text_len == 0 else match_probability
+        self.char_count += chars_count
+        self.weighted_chars_count += chars_count * match_probability
+        self.match_density = self.weighted_chars_count / self.char_count
+
     def extend_with_empty_added_line(self, next_added_line):
-        self.lines.append(MatchingLine(None, next_added_line, 0))
-        self.last_added_line = next_added_line
+        self.extend_with_empty_added_index(next_added_line.index_in(self.added_table))
+
+    def extend_with_empty_added_index(self, next_added_index):
+        self.removed_indexes.append(-1)
+        self.added_indexes.append(next_added_index)
+        self.match_probabilities.append(0)
+        self.last_added_index = next_added_index
 
     def extend_with_empty_removed_line(self, next_removed_line):
-        self.lines.append(MatchingLine(next_removed_line, None, 0))
-        self.last_removed_line = next_removed_line
         assert next_removed_line is not None
+        self.extend_with_empty_removed_index(next_removed_line.index_in(self.removed_table))
+
+    def extend_with_empty_removed_index(self, next_removed_index):
+        self.removed_indexes.append(next_removed_index)
+        self.added_indexes.append(-1)
+        self.match_probabilities.append(0)
+        self.last_removed_index = next_removed_index
 
     def clear_empty_lines_at_end(self):
         last_index = None
-        for i in range(len(self.lines)-1, 0, -1):
-            matching_lines = self.lines[i]
-            if matching_lines.removed_line is None or matching_lines.added_line is None:
-                self.last_removed_line = None
-                self.last_added_line = None
+        for i in range(len(self.removed_indexes)-1, 0, -1):
+            if self.removed_indexes[i] == -1 or self.added_indexes[i] == -1:
+                self.last_removed_index = -1
+                self.last_added_index = -1
             else:
                 last_index = i
                 break
         if last_index is None:
             return None
-        self.lines = self.lines[:last_index+1]
-        # now we need to correct last_removed_line and last_added_line
-        for i in range(len(self.lines)-1, 0, -1):
-            if self.last_added_line is not None and self.last_removed_line is not None:
+        del self.removed_indexes[last_index+1:]
+        del self.added_indexes[last_index+1:]
+        del self.match_probabilities[last_index+1:]
+        # now we need to correct last_removed_index and last_added_index
+        for i in range(len(self.removed_indexes)-1, 0, -1):
+            if self.last_added_index != -1 and self.last_removed_index != -1:
                 break
 
-            matching_lines = self.lines[i]
-            if matching_lines.removed_line is not None and self.last_removed_line is None:
-                self.last_removed_line = matching_lines.removed_line
+            if self.removed_indexes[i] != -1 and self.last_removed_index == -1:
+                self.last_removed_index = self.removed_indexes[i]
 
-            if matching_lines.added_line is not None and self.last_added_line is None:
-                self.last_added_line = matching_lines.added_line
-        assert self.last_removed_line is not None and self.last_added_line is not None
+            if self.added_indexes[i] != -1 and self.last_added_index == -1:
+                self.last_added_index = self.added_indexes[i]
+        assert self.last_removed_index != -1 and self.last_added_index != -1
         return self
 
     def line_count(self):
@@ -212,39 +430,90 @@ class MatchingBlock(object):
     #     return count
 
     def get_filter_sort_tuple_for_remove(self):
-        return (self.last_removed_line.file,
-                self.lines[0].removed_line.line_no,
-                -self.last_removed_line.line_no,
+        return (self.removed_table.file(self.last_removed_index),
+                self.removed_table.line_nos[self.removed_indexes[0]],
+                -self.removed_table.line_nos[self.last_removed_index],
                 -self.weighted_lines_count)
 
     def get_filter_sort_tuple_for_add(self):
-        return (self.last_removed_line.file,
-                self.lines[0].added_line.line_no,
-                -self.last_added_line.line_no,
+        return (self.removed_table.file(self.last_removed_index),
+                self.added_table.line_nos[self.added_indexes[0]],
+                -self.added_table.line_nos[self.last_added_index],
                 -self.weighted_lines_count)
 
+    @property
+    def lines(self) -> List[MatchingLine]:
+        return [MatchingLine(Line.of(self.removed_table, removed_index) if removed_index != -1 else None,
+                             Line.of(self.added_table, added_index) if added_index != -1 else None,
+                             match_probability)
+                for removed_index, added_index, match_probability
+                in zip(self.removed_indexes, self.added_indexes, self.match_probabilities)]
+
+    @property
+    def first_removed_line(self):
+        return Line.of(self.removed_table, self.removed_indexes[0])
+
+    @property
+    def first_added_line(self):
+        return Line.of(self.added_table, self.added_indexes[0])
+
+    @property
+    def last_removed_line(self):
+        return Line.of(self.removed_table, self.last_removed_index) if self.last_removed_index != -1 else None
+
+    @property
+    def last_added_line(self):
+        return Line.of(self.added_table, self.last_added_index) if self.last_added_index != -1 else None
+
+    def removed_line_intervals(self):
+        """Return line numbers of removed lines matched with added ones as sorted [start, stop) intervals."""
+        return line_intervals(self.removed_table.line_nos, self.removed_indexes, self.added_indexes)
+
+    def added_line_intervals(self):
+        """Return line numbers of added lines matched with removed ones as sorted [start, stop) intervals."""
+        return line_intervals(self.added_table.line_nos, self.added_indexes, self.removed_indexes)
+
+    @property
+    def first_removed_line_no(self):
+        return self.removed_table.line_nos[self.removed_indexes[0]]
+
+    @property
+    def first_added_line_no(self):
+        return self.added_table.line_nos[self.added_indexes[0]]
+
+    @property
+    def last_removed_line_no(self):
+        return self.removed_table.line_nos[self.last_removed_index]
+
+    @property
+    def last_added_line_no(self):
+        return self.added_table.line_nos[self.last_added_index]
+
     @property
     def file_removed(self):
-        return self.last_removed_line.file
+        return self.removed_table.file(self.last_removed_index)
 
     @property
     def file_added(self):
-        return self.last_added_line.file
+        return self.added_table.file(self.last_added_index)
+
+    def __getstate__(self):
+        """Tables are left out - blocks grown by worker processes are attached to tables of the parent one."""
+        return {slot: getattr(self, slot) for slot in self.__slots__
+                if slot not in ('removed_table', 'added_table') and hasattr(self, slot)}
 
-    # @property
-    # def first_removed_line(self):
-    #     return self.lines[0].removed_line
-    #
-    # @property
-    # def first_added_line(self):
-    #     return self.lines[0].added_line
+    def __setstate__(self, state):
+        self.removed_table = None
+        self.added_table = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
 
     def __str__(self):
         return dedent(f"""Block(
         removed_file: {self.last_removed_line.file}
         added_file: {self.last_added_line.file}
-        removed_lines: {self.lines[0].removed_line.line_no}-{self.last_removed_line.line_no}
-        added_lines: {self.lines[0].added_line.line_no}-{self.last_added_line.line_no}
+        removed_lines: {self.first_removed_line.line_no}-{self.last_removed_line.line_no}
+        added_lines: {self.first_added_line.line_no}-{self.last_added_line.line_no}
         );\n""")
 
     def __repr__(self):
@@ -259,66 +528,275 @@ class MatchingBlock(object):
         return json.dumps(self.to_dict())
 
 
+def line_intervals(line_nos, indexes, other_indexes):
+    """Return runs of consecutive line_nos[index] for indexes whose other_indexes entry is not -1 either.
+
+    Line numbers of one side of a block grow (blocks grow line by line and are joined only with blocks after them),
+    so the runs are sorted and disjoint.
+    """
+    intervals = []
+    for index, other_index in zip(indexes, other_indexes):
+        if index == -1 or other_index == -1:
+            continue
+        line_no = line_nos[index]
+        if intervals and intervals[-1][1] == line_no:
+            intervals[-1][1] = line_no + 1
+        else:
+            intervals.append([line_no, line_no + 1])
+    return intervals
+
+
+def intervals_contain(intervals, other_intervals):
+    """Check if every number of other_intervals is in intervals (both are sorted disjoint [start, stop) runs)."""
+    i = 0
+    for start, stop in other_intervals:
+        while i < len(intervals) and intervals[i][1] <= start:
+            i += 1
+        if i == len(intervals) or intervals[i][0] > start or intervals[i][1] < stop:
+            return False
+    return True
+
+
 class MovedBlocksDetector(object):
-    def __init__(self, removed_lines_dicts, added_lines_dicts):
-        self.removed_lines = []
-        self.trim_text_to_array_of_added_lines = defaultdict(list)
-        self.added_file_name_to_line_no_to_line = defaultdict(dict)
-        self.removed_file_name_to_line_no_to_line = defaultdict(dict)
-        self.added_lines_fuzzy_set = FuzzySet()
-
-        for added_line_dict in added_lines_dicts:
-            line = Line.from_dict(added_line_dict)
-            self.trim_text_to_array_of_added_lines[line.trim_text].append(line)
-            self.added_lines_fuzzy_set.add(line.trim_text)
-            self.added_file_name_to_line_no_to_line[line.file][line.line_no] = line
-
-        for removed_line_dict in removed_lines_dicts:
-            line = Line.from_dict(removed_line_dict)
-            self.removed_lines.append(line)
-            self.removed_file_name_to_line_no_to_line[line.file][line.line_no] = line
+    def __init__(self, removed_lines_dicts, added_lines_dicts, previous_state=None, keep_state=False,
+                 similarity_backend=None, exact_anchors=False, max_new_blocks_per_line=None, idf_weighting=False,
+                 gram_index=None, budget=None, file_pair_filter=False, gram_vectors=None):
+        """Lines are given as LineTables (see diff_to_lines), dicts (see Line.to_dict) or Line objects.
+
+        previous_state is DetectionState of previous version of the diff whose fuzzy matching results are
+        reused, with keep_state detection_state() can be called after detect_moved_blocks. Both need the default
+        similarity_backend (name of one of similarity.BACKENDS). With exact_anchors runs of identical lines become
+        blocks before fuzzy matching (see find_exact_runs).
+
+        With max_new_blocks_per_line a removed line matching a low information text (one of more than
+        LOW_INFORMATION_LINES_COUNT added lines) still extends all blocks it can, but it starts new blocks only
+        while it is in fewer than max_new_blocks_per_line blocks. With idf_weighting match probability of such
+        lines is lowered by inverse frequency of their text among added lines (see low_information_weights), so
+        blocks made mostly of them are filtered out as small.
+
+        gram_index is a gram_index.GramIndex of gram vectors of texts seen by previous detections - vectors of
+        texts of lines found there are not computed again and new ones are added to it by detect_moved_blocks
+        (only the default similarity_backend uses it).
+
+        budget is a budget.DetectionBudget, when it is exceeded detection degrades step by step (see budget.py).
+        Budgets are checked after fuzzy matching of every PROGRESS_LINES removed lines and growing blocks over them.
+        If changed lines are over budget, the similarity backend is not used at all and neither are previous_state,
+        keep_state and gram_index.
+
+        With file_pair_filter removed lines of every group of removed files with candidate added files (see
+        file_pairs.py) are detected by a detector of theirs and lines of those added files only - removed files
+        without candidates are not matched at all. Detection split to groups is not incremental (previous_state and
+        keep_state are not used). gram_vectors is a dict of gram vectors of texts shared with other detectors (only
+        the default similarity_backend uses it)."""
+        self.removed_lines = self.lines_table(removed_lines_dicts)
+        self.added_lines = self.lines_table(added_lines_dicts)
+        self.budget = budget
+        if budget is not None:
+            budget.check_changed_lines(len(self.removed_lines) + len(self.added_lines))
+        self.fuzzy_matching = budget is None or not budget.exact_only
+        # ids of files of removed lines skipped by budget (see skipped_removed_file_ids)
+        self._skipped_removed_file_ids = None
+        similarity_backend = similarity_backend or similarity.DEFAULT_BACKEND
+        # (removed file ids, added file ids) groups detected by detectors of their own (see file_pairs.file_groups)
+        self.file_groups = None
+        if file_pair_filter:
+            self.file_groups = file_pairs.file_groups(self.removed_lines, self.added_lines)
+            self.group_detector_options = dict(similarity_backend=similarity_backend, exact_anchors=exact_anchors,
+                                               max_new_blocks_per_line=max_new_blocks_per_line,
+                                               idf_weighting=idf_weighting, budget=budget)
+            if self.file_groups is None:
+                logger.info('Files are not split to groups, too many of them can share moved blocks')
+            else:
+                logger.info(f'{len(self.file_groups)} groups of files which can share moved blocks')
+        # added trim text -> indexes of added lines with it
+        self.added_indexes_by_trim_text: Dict[str, array] = {}
+        requested_keep_state = keep_state or previous_state is not None
+        incremental_detection = self.fuzzy_matching and self.file_groups is None
+        self.previous_state = previous_state if incremental_detection else None
+        self.keep_state = requested_keep_state and incremental_detection
+        self.fuzzy_matching_pairs_by_text = None
+        self.fuzzy_matches = None
+        self.join_loops_made = None
+        # counts of lines, fuzzy matches and blocks of detection observed in metrics (see metrics.DETECTION_COUNT)
+        self.counts = Counter()
+        self.exact_anchors = exact_anchors
+        self.anchored_removed_indexes = None
+        self.max_new_blocks_per_line = max_new_blocks_per_line
+        if requested_keep_state and similarity_backend != similarity.FuzzySetBackend.name:
+            raise ValueError(f'Incremental detection is not supported by {similarity_backend} similarity backend')
+        self.gram_index = (gram_index if similarity_backend == similarity.FuzzySetBackend.name and self.fuzzy_matching
+                           else None)
+        # keys of gram vectors which are in the gram index already (loaded from it or kept in previous state)
+        self.indexed_gram_vector_keys = set()
+        if (self.keep_state or self.gram_index is not None or similarity_backend == similarity.FuzzySetBackend.name
+                and (gram_vectors is not None or self.file_groups is not None)):
+            if gram_vectors is None:
+                gram_vectors = dict(self.previous_state.gram_vectors) if self.previous_state is not None else {}
+            self.similarity = similarity.create_backend(similarity_backend, gram_vectors=gram_vectors)
+        else:
+            self.similarity = similarity.create_backend(similarity_backend)
+        self.added_lines_fuzzy_set = getattr(self.similarity, 'fuzzy_set', None)
+        if self.gram_index is not None:
+            self.load_gram_vectors()
+
+        for added_index in range(len(self.added_lines)):
+            trim_text = self.added_lines.trim_text(added_index)
+            added_indexes = self.added_indexes_by_trim_text.get(trim_text)
+            if added_indexes is None:
+                added_indexes = self.added_indexes_by_trim_text[trim_text] = array('i')
+            added_indexes.append(added_index)
+            if self.fuzzy_matching and self.file_groups is None:
+                self.similarity.add(trim_text)
+        self.low_information_weights = self.low_information_weights() if idf_weighting else {}
+        self.counts['removed_lines'] = len(self.removed_lines)
+        self.counts['added_lines'] = len(self.added_lines)
+
+    @measure_fun_time()
+    def load_gram_vectors(self):
+        """Add gram vectors of texts of removed and added lines found in gram_index to gram vectors of the fuzzy
+        set (before added lines are added to it)."""
+        fuzzy_set = self.added_lines_fuzzy_set
+        gram_vectors = fuzzy_set.gram_vectors
+        # vectors of previous state were stored by the detection of the previous version of the diff
+        self.indexed_gram_vector_keys.update(gram_vectors)
+        lvalues = {table.trim_text(index).lower() for table in (self.removed_lines, self.added_lines)
+                   for index in range(len(table))}
+        lvalues.difference_update(lvalue for lvalue, _ in gram_vectors)
+        gram_sizes = range(fuzzy_set.gram_size_lower, fuzzy_set.gram_size_upper + 1)
+        loaded_vectors = self.gram_index.load(lvalues, gram_sizes)
+        gram_vectors.update(loaded_vectors)
+        self.indexed_gram_vector_keys.update(loaded_vectors)
+        self.counts['loaded_gram_vectors'] = len(loaded_vectors)
+
+    @measure_fun_time()
+    def store_gram_vectors(self):
+        """Add gram vectors computed by this detection to gram_index."""
+        new_vectors = {key: vector for key, vector in self.added_lines_fuzzy_set.gram_vectors.items()
+                       if key not in self.indexed_gram_vector_keys}
+        self.gram_index.store(new_vectors)
+        self.indexed_gram_vector_keys.update(new_vectors)
+        self.counts['stored_gram_vectors'] += len(new_vectors)
+
+    def low_information_weights(self):
+        """Return low information added text -> its IDF (log of added lines count / lines with the text) relative
+        to IDF of a text of LOW_INFORMATION_LINES_COUNT lines, i.e. a weight between 0 and 1."""
+        lines_count = len(self.added_lines)
+        if lines_count <= LOW_INFORMATION_LINES_COUNT:
+            return {}
+        max_idf = math.log(lines_count / LOW_INFORMATION_LINES_COUNT)
+        return {trim_text: math.log(lines_count / len(added_indexes)) / max_idf
+                for trim_text, added_indexes in self.added_indexes_by_trim_text.items()
+                if len(added_indexes) > LOW_INFORMATION_LINES_COUNT}
+
+    @staticmethod
+    def lines_table(lines):
+        """Return LineTable of lines given as LineTable, dicts or Line objects (the first one is returned as is)."""
+        if isinstance(lines, LineTable):
+            return lines
+        table = LineTable()
+        for line in lines:
+            if isinstance(line, Line):
+                table.append(line.file, line.line_no, str(line))
+            else:
+                table.append(line['file'], line['line_no'], line['leading_whitespaces'] + line['trim_text'])
+        table.join_texts()
+        return table
 
     @staticmethod
-    def from_diff(diff_text):
-        parsed = diff_to_added_and_removed_lines(diff_text)
-        return MovedBlocksDetector(parsed['removed_lines'], parsed['added_lines'])
+    def from_diff(diff, previous_state=None, keep_state=False, **kwargs):
+        """Return detector of diff given as text or iterable of lines (e.g. a file opened in text mode), kwargs are
+        other options of MovedBlocksDetector."""
+        removed_lines, added_lines = diff_to_lines(diff, kwargs.get('budget'))
+        return MovedBlocksDetector(removed_lines, added_lines, previous_state=previous_state, keep_state=keep_state,
+                                   **kwargs)
+
+    def skipped_removed_file_ids(self):
+        """Return ids of files of removed lines with more than max_file_changed_lines of budget removed and added
+        lines (see budget.SKIPPED_FILES)."""
+        if self._skipped_removed_file_ids is None:
+            changed_lines_counts = Counter()
+            for table in (self.removed_lines, self.added_lines):
+                for file_id, count in Counter(table.file_ids).items():
+                    changed_lines_counts[table.files[file_id]] += count
+            self._skipped_removed_file_ids = {
+                file_id for file_id, file in enumerate(self.removed_lines.files)
+                if changed_lines_counts[file] > self.budget.max_file_changed_lines
+            }
+            logger.info(f'Skipping removed lines of {len(self._skipped_removed_file_ids)} files')
+        return self._skipped_removed_file_ids
+
+    def not_skipped(self, removed_indexes):
+        """Return removed_indexes without lines of files skipped by budget (see skipped_removed_file_ids)."""
+        skipped_file_ids = self.skipped_removed_file_ids()
+        if not skipped_file_ids:
+            return removed_indexes
+        file_ids = self.removed_lines.file_ids
+        return [removed_index for removed_index in removed_indexes if file_ids[removed_index] not in skipped_file_ids]
+
+    def detection_state(self):
+        """Return DetectionState to pass as previous_state to detector of the next version of this diff."""
+        assert self.fuzzy_matches is not None, 'detection_state() needs keep_state and detect_moved_blocks() first'
+        added_texts = set(self.added_lines_fuzzy_set.item_indexes)
+        gram_vectors = {key: vector for key, vector in self.added_lines_fuzzy_set.gram_vectors.items()
+                        if key[0] in added_texts}
+        return incremental.DetectionState(
+            added_texts=added_texts,
+            matches=self.fuzzy_matches,
+            gram_vectors=gram_vectors,
+        )
 
     @measure_fun_time()
     def filter_out_block_inside_other_blocks(self, filtered_blocks: List[MatchingBlock]):
+        """Sweep over blocks sorted by start and drop blocks inside the last not dropped one.
+
+        Containment of lines is checked on interval lists (computed once per compared block) in linear time.
+        """
         filtered_blocks.sort(key=lambda fb: fb.get_filter_sort_tuple_for_remove())
 
         last_matching_block = None
+        last_intervals = None
         for matching_block in filtered_blocks:
             if last_matching_block is None:
                 last_matching_block = matching_block
+                last_intervals = None
                 continue
             if matching_block.last_removed_line.file == last_matching_block.last_removed_line.file \
                     and matching_block.first_removed_line.line_no >= last_matching_block.first_removed_line.line_no \
                     and matching_block.last_removed_line.line_no <= last_matching_block.last_removed_line.line_no:
-                if matching_block.weighted_lines_count < last_matching_block.weighted_lines_count\
-                   and matching_block.removed_lines_numbers.issubset(last_matching_block.removed_lines_numbers):
-                    matching_block.remove_part_is_inside_larger_block = True
+                if matching_block.weighted_lines_count < last_matching_block.weighted_lines_count:
+                    if last_intervals is None:
+                        last_intervals = last_matching_block.removed_line_intervals()
+                    if intervals_contain(last_intervals, matching_block.removed_line_intervals()):
+                        matching_block.remove_part_is_inside_larger_block = True
             else:
                 last_matching_block = matching_block
+                last_intervals = None
 
         filtered_blocks.sort(key=lambda fb: fb.get_filter_sort_tuple_for_add())
         ok_blocks = []
         last_matching_block = None
+        last_intervals = None
         for matching_block in filtered_blocks:
             if getattr(matching_block, "remove_part_is_inside_larger_block", False): # TODO getattr was used to act like in javascript - rewrite it without getattr
                 continue
             if last_matching_block is None:
                 last_matching_block = matching_block
+                last_intervals = None
                 ok_blocks.append(matching_block)
                 continue
             if matching_block.last_added_line.file == last_matching_block.last_added_line.file \
                     and matching_block.first_added_line.line_no >= last_matching_block.first_added_line.line_no \
                     and matching_block.last_added_line.line_no <= last_matching_block.last_added_line.line_no\
-                    and matching_block.weighted_lines_count < last_matching_block.weighted_lines_count\
-                    and not matching_block.added_lines_numbers.issubset(last_matching_block.added_lines_numbers):
-                pass
+                    and matching_block.weighted_lines_count < last_matching_block.weighted_lines_count:
+                if last_intervals is None:
+                    last_intervals = last_matching_block.added_line_intervals()
+                if intervals_contain(last_intervals, matching_block.added_line_intervals()):
+                    last_matching_block = matching_block
+                    last_intervals = None
+                    ok_blocks.append(matching_block)
             else:
                 last_matching_block = matching_block
+                last_intervals = None
                 ok_blocks.append(matching_block)
 
         return ok_blocks
@@ -334,26 +812,42 @@ class MovedBlocksDetector(object):
                 filtered_blocks.append(matching_block)
         return filtered_blocks
 
-    def merge_blocks(self, block1, block2):
-        new_block = MatchingBlock()
-        new_block.lines.extend(block1.lines)
-        new_block.lines.extend(block2.lines)
+    def merge_blocks(self, blocks: List[MatchingBlock]):
+        """Return a new block with lines of blocks (in order) - a whole chain of joined blocks is built at once."""
+        first_block = blocks[0]
+        new_block = MatchingBlock(first_block.removed_table, first_block.added_table)
+        for block in blocks:
+            new_block.removed_indexes.extend(block.removed_indexes)
+            new_block.added_indexes.extend(block.added_indexes)
+            new_block.match_probabilities.extend(block.match_probabilities)
         # TODO what about lines between those 2 blocks?
-        new_block.first_added_line = block1.first_added_line or block2.first_added_line
-        new_block.first_removed_line = block1.first_removed_line or block2.first_removed_line
-        new_block.last_added_line = block2.last_added_line or block1.last_added_line
-        new_block.last_removed_line = block2.last_removed_line or block1.last_removed_line
-        new_block.weighted_lines_count = block1.weighted_lines_count + block2.weighted_lines_count
-        new_block.not_empty_lines = block1.not_empty_lines + block2.not_empty_lines
-        new_block.char_count = block1.char_count + block2.char_count
-        new_block.weighted_chars_count = block1.weighted_chars_count + block2.weighted_chars_count
+        new_block.last_added_index = first_block.last_added_index
+        new_block.last_removed_index = first_block.last_removed_index
+        new_block.weighted_lines_count = first_block.weighted_lines_count
+        new_block.not_empty_lines = first_block.not_empty_lines
+        new_block.char_count = first_block.char_count
+        new_block.weighted_chars_count = first_block.weighted_chars_count
+        for block in blocks[1:]:
+            if block.last_added_index != -1:
+                new_block.last_added_index = block.last_added_index
+            if block.last_removed_index != -1:
+                new_block.last_removed_index = block.last_removed_index
+            new_block.weighted_lines_count += block.weighted_lines_count
+            new_block.not_empty_lines += block.not_empty_lines
+            new_block.char_count += block.char_count
+            new_block.weighted_chars_count += block.weighted_chars_count
         new_block.match_density = new_block.weighted_chars_count / new_block.char_count
-        new_block.added_lines_numbers = block1.added_lines_numbers | block2.added_lines_numbers
-        new_block.removed_lines_numbers = block1.removed_lines_numbers | block2.removed_lines_numbers
         return new_block
 
     @measure_fun_time()
     def join_nearby_blocks(self, matching_blocks: List[MatchingBlock], max_space_between=2):
+        """Join blocks of the same files which follow each other with at most max_space_between lines between.
+
+        Blocks sorted by first removed line are swept once to find for every block the first block it can be joined
+        with. That block is the same whatever was joined before it, so chains are followed through those links and
+        every joined block is built once. A block can start its own chain even if it was joined into an earlier one
+        (both are returned, filter_blocks drops the smaller one).
+        """
         max_space_between += 1  # if we want to allow 2 lines between blocks difference between line numbers is 3
         blocks_grouped_by_files: Dict[tuple, List[MatchingBlock]] = defaultdict(list)
         for block in matching_blocks:
@@ -361,31 +855,46 @@ class MovedBlocksDetector(object):
         blocks_after_merge: List[MatchingBlock] = []
 
         merged_blocks = 0
+        loops_made = 0
         for block_list in blocks_grouped_by_files.values():
-            loops_made = 0
-            block_list.sort(key=lambda block: (block.first_removed_line.line_no, -block.match_density))
-            indexes_of_merged_blocks = set()
-            merged_blocks_list = []
-            for i in range(len(block_list)):
-                block = block_list[i]
+            block_list.sort(key=lambda block: (block.first_removed_line_no, -block.match_density))
+            first_removed_line_nos = [block.first_removed_line_no for block in block_list]
+            first_added_line_nos = [block.first_added_line_no for block in block_list]
+            next_indexes = [-1] * len(block_list)  # index of block joined to block i
+            for i, block in enumerate(block_list):
+                last_removed_line_no = block.last_removed_line_no
+                last_added_line_no = block.last_added_line_no
                 for j in range(i+1, len(block_list)):
                     loops_made += 1
-                    next_block = block_list[j]
-                    if next_block.first_removed_line.line_no - block.last_removed_line.line_no > max_space_between:
+                    if first_removed_line_nos[j] - last_removed_line_no > max_space_between:
                         break
-                    elif (next_block.first_removed_line.line_no > block.last_removed_line.line_no
-                            and next_block.first_added_line.line_no - block.last_added_line.line_no <= max_space_between
-                            and next_block.first_added_line.line_no > block.last_added_line.line_no):
-                        block = self.merge_blocks(block, next_block)
-                        merged_blocks += 1
-                        indexes_of_merged_blocks.add(i)
-                        indexes_of_merged_blocks.add(j)
-                if i in indexes_of_merged_blocks:
-                    merged_blocks_list.append(block)
+                    elif (first_removed_line_nos[j] > last_removed_line_no
+                            and first_added_line_nos[j] - last_added_line_no <= max_space_between
+                            and first_added_line_nos[j] > last_added_line_no):
+                        next_indexes[i] = j
+                        break
+
+            indexes_of_merged_blocks = {i for i, j in enumerate(next_indexes) if j != -1}
+            indexes_of_merged_blocks.update(j for j in next_indexes if j != -1)
+            merged_blocks_list = []
             for i in range(len(block_list)):
                 if i not in indexes_of_merged_blocks:
                     blocks_after_merge.append(block_list[i])
+                elif next_indexes[i] == -1:
+                    merged_blocks_list.append(block_list[i])
+                else:
+                    chain = [block_list[i]]
+                    j = next_indexes[i]
+                    while j != -1:
+                        chain.append(block_list[j])
+                        j = next_indexes[j]
+                    merged_blocks_list.append(self.merge_blocks(chain))
+                    merged_blocks += len(chain) - 1
             blocks_after_merge.extend(merged_blocks_list)
+        self.join_loops_made = loops_made
+        self.counts['merged_blocks'] += merged_blocks
+        self.counts['join_loops_made'] += loops_made
+        logger.info(f'Joined {merged_blocks} blocks in {loops_made} loops')
         return blocks_after_merge
 
     @measure_fun_time()
@@ -397,41 +906,200 @@ class MovedBlocksDetector(object):
         return self.filter_out_block_inside_other_blocks(filtered_blocks)
 
     def extend_matching_blocks_with_empty_added_lines_if_possible(self, currently_matching_blocks):
+        added_lines = self.added_lines
         for matching_block in currently_matching_blocks:
             while True:
-                last_line = matching_block.last_added_line
-                next_added_line = self.added_file_name_to_line_no_to_line[last_line.file].get(last_line.line_no + 1)
-                if next_added_line and next_added_line.trim_text == '':
-                    matching_block.extend_with_empty_added_line(next_added_line)
+                next_added_index = added_lines.next_line_index(matching_block.last_added_index)
+                if next_added_index != -1 and added_lines.trim_text_len(next_added_index) == 0:
+                    matching_block.extend_with_empty_added_index(next_added_index)
                 else:
                     break
 
     def extend_matching_blocks_with_empty_removed_lines_if_possible(self, currently_matching_blocks: List[MatchingBlock]):
         extended_blocks = []
         not_extended_blocks = []
+        removed_lines = self.removed_lines
         for matching_block in currently_matching_blocks:
-            last_line = matching_block.last_removed_line
-            next_removed_line = self.removed_file_name_to_line_no_to_line[last_line.file].get(last_line.line_no + 1)
-            if next_removed_line and next_removed_line.trim_text == '':
-                matching_block.extend_with_empty_removed_line(next_removed_line)
+            next_removed_index = removed_lines.next_line_index(matching_block.last_removed_index)
+            if next_removed_index != -1 and removed_lines.trim_text_len(next_removed_index) == 0:
+                matching_block.extend_with_empty_removed_index(next_removed_index)
                 extended_blocks.append(matching_block)
             else:
                 not_extended_blocks.append(matching_block)
 
         return extended_blocks, not_extended_blocks
 
+    def texts_by_min_match_score(self, removed_indexes):
+        """Return min match score -> distinct not empty texts of removed lines (as dict keys, in order)."""
+        texts_by_min_match_score = defaultdict(dict)
+        for removed_index in removed_indexes:
+            trim_text = self.removed_lines.trim_text(removed_index)
+            if trim_text:
+                min_match_score = MIN_MATCH_SCORE if len(trim_text) > 2 else SHORT_TEXT_MIN_MATCH_SCORE
+                texts_by_min_match_score[min_match_score][trim_text] = None
+        return texts_by_min_match_score
+
+    def exact_matching_pairs(self, texts):
+        """Return (score, added trim_text) pairs of added lines with the same trim text for each of texts (or None
+        if there is none) - matching of texts with an exact-only budget (see budget.EXACT_ONLY)."""
+        return [[(1, text)] if text in self.added_indexes_by_trim_text else None for text in texts]
+
+    @measure_fun_time()
+    def find_fuzzy_matching_pairs(self, removed_indexes, progress=None):
+        """Return trim_text -> fuzzy matching (score, added trim_text) pairs for not empty removed lines.
+
+        Every distinct text is scored once and all of them are scored in one get_many batch of the similarity
+        backend per threshold. With progress or budget texts are scored in batches of PROGRESS_LINES removed lines,
+        progress(processed lines, len(removed_indexes)) is called and budget is checked after each one. Texts of
+        lines which are not matched because of the budget have no pairs.
+        """
+        fuzzy_matching_pairs = {}
+        budget = self.budget
+        batch_size = PROGRESS_LINES if progress is not None or budget is not None else max(len(removed_indexes), 1)
+        for start in range(0, len(removed_indexes), batch_size):
+            batch = removed_indexes[start:start + batch_size]
+            if budget is not None:
+                if budget.partial:
+                    self.counts['not_matched_lines'] += len(removed_indexes) - start
+                    break
+                if budget.skipped_files:
+                    batch = self.not_skipped(batch)
+            for min_match_score, texts in self.texts_by_min_match_score(batch).items():
+                texts = [text for text in texts if text not in fuzzy_matching_pairs]
+                if budget is None or not budget.exact_only:
+                    matches = self.similarity.get_many(texts, min_match_score)
+                else:
+                    matches = self.exact_matching_pairs(texts)
+                fuzzy_matching_pairs.update(zip(texts, matches))
+                self.counts['scored_texts'] += len(texts)
+                self.counts['fuzzy_matches'] += sum(len(pairs) for pairs in matches if pairs)
+            if budget is not None:
+                budget.check(self.counts['fuzzy_matches'])
+            if progress is not None:
+                progress(start + len(batch), len(removed_indexes))
+        return fuzzy_matching_pairs
+
+    @measure_fun_time()
+    def find_fuzzy_matching_pairs_incrementally(self):
+        """Like find_fuzzy_matching_pairs of all removed lines, but reusing scores from previous_state and keeping
+        them for detection_state()."""
+        fuzzy_matching_pairs, self.fuzzy_matches = incremental.find_fuzzy_matching_pairs(
+            self.added_lines_fuzzy_set, self.texts_by_min_match_score(range(len(self.removed_lines))),
+            self.previous_state
+        )
+        self.counts['scored_texts'] += len(fuzzy_matching_pairs)
+        self.counts['fuzzy_matches'] += sum(len(pairs) for pairs in fuzzy_matching_pairs.values() if pairs)
+        return fuzzy_matching_pairs
+
     @measure_fun_time()
-    def detect_moved_blocks(self, min_lines_count=None) -> List[MatchingBlock]:
+    def find_exact_runs(self, min_lines_count=MIN_EXACT_RUN_LINES):
+        """Return blocks of maximal runs of consecutive lines with identical trim texts on both sides.
+
+        Like anchors of patience diff, runs are seeded by lines whose text is unique among both removed and added
+        lines and extended in both directions over any identical lines. A run starts and ends with an informative
+        line - not empty and with text of at most LOW_INFORMATION_LINES_COUNT added lines (think of `}`). Runs with
+        at least min_lines_count informative lines, all of them unique as well, are kept and their removed lines
+        are marked in anchored_removed_indexes, so grow_blocks skips them. A run with a repeated informative line
+        has more candidate added runs (which fuzzy matching finds, as in repetitive code), so it is left to
+        fuzzy matching. Every removed line is looked at a constant number of times, so a diff of moved code only
+        is handled in linear time.
+        """
+        removed_lines = self.removed_lines
+        added_lines = self.added_lines
+        added_indexes_by_trim_text = self.added_indexes_by_trim_text
+        removed_counts = Counter(removed_lines.trim_text(removed_index) for removed_index in range(len(removed_lines)))
+
+        def informative(removed_index):
+            trim_text = removed_lines.trim_text(removed_index)
+            return trim_text and len(added_indexes_by_trim_text[trim_text]) <= LOW_INFORMATION_LINES_COUNT
+
+        def unique(removed_index):
+            trim_text = removed_lines.trim_text(removed_index)
+            return removed_counts[trim_text] == 1 and len(added_indexes_by_trim_text.get(trim_text, ())) == 1
+
+        anchored = bytearray(len(removed_lines))
+        # lines of runs found already, kept or not - every seed of a run finds the same run
+        visited = bytearray(len(removed_lines))
+        blocks = []
+        for seed_index in range(len(removed_lines)):
+            if visited[seed_index] or removed_lines.trim_text_len(seed_index) == 0 or not unique(seed_index):
+                continue
+            pairs = [(seed_index, added_indexes_by_trim_text[removed_lines.trim_text(seed_index)][0])]
+            removed_index, added_index = pairs[0]
+            while True:
+                removed_index = removed_lines.previous_line_index(removed_index)
+                added_index = added_lines.previous_line_index(added_index)
+                if (removed_index == -1 or added_index == -1 or anchored[removed_index]
+                        or removed_lines.trim_text(removed_index) != added_lines.trim_text(added_index)):
+                    break
+                pairs.append((removed_index, added_index))
+            pairs.reverse()
+            removed_index, added_index = pairs[-1]
+            while True:
+                removed_index = removed_lines.next_line_index(removed_index)
+                added_index = added_lines.next_line_index(added_index)
+                if (removed_index == -1 or added_index == -1 or anchored[removed_index]
+                        or removed_lines.trim_text(removed_index) != added_lines.trim_text(added_index)):
+                    break
+                pairs.append((removed_index, added_index))
+            for removed_index, _ in pairs:
+                visited[removed_index] = 1
+            while not informative(pairs[0][0]):
+                del pairs[0]
+            while not informative(pairs[-1][0]):
+                del pairs[-1]
+            informative_indexes = [removed_index for removed_index, _ in pairs if informative(removed_index)]
+            if len(informative_indexes) < min_lines_count or not all(map(unique, informative_indexes)):
+                continue
+            block = MatchingBlock.from_indexes(removed_lines, added_lines, *pairs[0])
+            for removed_index, added_index in pairs[1:]:
+                block.extend_with_indexes(removed_index, added_index, 1)
+                anchored[removed_index] = 1
+            anchored[pairs[0][0]] = 1
+            blocks.append(block)
+        self.anchored_removed_indexes = anchored
+        logger.info(f'Found {len(blocks)} runs of identical lines with {sum(anchored)} removed lines')
+        return blocks
+
+    def not_anchored(self, removed_indexes):
+        """Return removed_indexes without lines of runs found by find_exact_runs (all of them if it was not run)."""
+        anchored = self.anchored_removed_indexes
+        if anchored is None:
+            return removed_indexes
+        return [removed_index for removed_index in removed_indexes if not anchored[removed_index]]
+
+    @measure_fun_time()
+    def grow_blocks(self, removed_indexes, fuzzy_matching_pairs_by_text):
+        """Grow matching blocks line by line over removed lines with removed_indexes (in order, e.g. a range).
+
+        Returns blocks which ended (in order they ended) and blocks still matching after the last line. With budget
+        it is checked every PROGRESS_LINES lines, lines of skipped files are skipped and once the budget turns
+        partial here, the rest of lines is not looked at (lines not matched before have no fuzzy matching pairs).
+        """
+        removed_lines = self.removed_lines
+        added_lines = self.added_lines
+        max_new_blocks_per_line = self.max_new_blocks_per_line
+        budget = self.budget
+        partial_before = budget is not None and budget.partial
+        removed_file_ids = removed_lines.file_ids
+        skipped_file_ids = ()
         detected_blocks: List[MatchingBlock] = []
         currently_matching_blocks = []
         new_matching_blocks = []
 
-        for removed_line in self.removed_lines:
-            if removed_line.trim_text:
-                min_match_score = 0.5 if len(removed_line.trim_text) > 2 else 0.35
-                fuzzy_matching_pairs = self.added_lines_fuzzy_set.get(
-                    removed_line.trim_text, default=None, exact_match_only=False, min_match_score=min_match_score
-                )
+        for position, removed_index in enumerate(removed_indexes):
+            if budget is not None and position % PROGRESS_LINES == 0:
+                budget.check(self.counts['fuzzy_matches'])
+                if budget.partial and not partial_before:
+                    self.counts['not_grown_lines'] += len(removed_indexes) - position
+                    break
+                if budget.skipped_files:
+                    skipped_file_ids = self.skipped_removed_file_ids()
+            if removed_file_ids[removed_index] in skipped_file_ids:
+                continue
+            removed_trim_text = removed_lines.trim_text(removed_index)
+            if removed_trim_text:
+                fuzzy_matching_pairs = fuzzy_matching_pairs_by_text.get(removed_trim_text)
                 # iterate over currently_matching_blocks and try to extend them with empty lines
                 self.extend_matching_blocks_with_empty_added_lines_if_possible(currently_matching_blocks)
             else:
@@ -440,27 +1108,44 @@ class MovedBlocksDetector(object):
             if not fuzzy_matching_pairs:
                 continue
 
+            # blocks by (added file id, line number of the next added line), the only added line they can be
+            # extended with - a block extended with this removed line cannot be extended again
+            blocks_by_next_added_line = {}
+            added_file_ids = added_lines.file_ids
+            added_line_nos = added_lines.line_nos
+            for matching_block in currently_matching_blocks:
+                last_added_index = matching_block.last_added_index
+                key = (added_file_ids[last_added_index], added_line_nos[last_added_index] + 1)
+                blocks = blocks_by_next_added_line.get(key)
+                if blocks is None:
+                    blocks_by_next_added_line[key] = [matching_block]
+                else:
+                    blocks.append(matching_block)
+
             for fuzz_pair in fuzzy_matching_pairs:
                 match_probability, text = fuzz_pair
-                added_lines = self.trim_text_to_array_of_added_lines[text]
-                for added_line in added_lines:
+                added_indexes = self.added_indexes_by_trim_text.get(text, ())
+                if text in self.low_information_weights:
+                    match_probability *= self.low_information_weights[text]
+                if max_new_blocks_per_line is not None and len(added_indexes) > LOW_INFORMATION_LINES_COUNT:
+                    self.grow_blocks_with_low_information_text(removed_index, text, added_indexes, match_probability,
+                                                               currently_matching_blocks, new_matching_blocks)
+                    continue
+                for added_index in added_indexes:
                     line_extended_any_block = False
-                    already_added = set()
-                    for i, matching_block in enumerate(currently_matching_blocks):
-                        if i in already_added:
-                            continue
-                        extended = matching_block.try_extend_with_line(removed_line, added_line, match_probability)
-                        if extended:
+                    for matching_block in blocks_by_next_added_line.get(
+                            (added_file_ids[added_index], added_line_nos[added_index]), ()):
+                        if matching_block.try_extend_with_indexes(removed_index, added_index, match_probability):
                             new_matching_blocks.append(matching_block)
                             line_extended_any_block = True
-                            already_added.add(i)
 
-                    if not line_extended_any_block and removed_line.trim_text != '':
-                        new_matching_blocks.append(MatchingBlock.from_line(removed_line, added_line, match_probability))
-                    currently_matching_blocks = [matching_block for i, matching_block in
-                                                 enumerate(currently_matching_blocks) if i not in already_added]
+                    if not line_extended_any_block and removed_trim_text != '':
+                        new_matching_blocks.append(MatchingBlock.from_indexes(removed_lines, added_lines, removed_index,
+                                                                              added_index, match_probability))
+            currently_matching_blocks = [matching_block for matching_block in currently_matching_blocks
+                                         if matching_block.last_removed_index != removed_index]
 
-            if removed_line.trim_text == '':
+            if removed_trim_text == '':
                 extended_blocks, not_extended_blocks = \
                     self.extend_matching_blocks_with_empty_removed_lines_if_possible(currently_matching_blocks)
                 new_matching_blocks.extend(extended_blocks)
@@ -472,10 +1157,196 @@ class MovedBlocksDetector(object):
             currently_matching_blocks = new_matching_blocks
             new_matching_blocks = []
 
+        return detected_blocks, currently_matching_blocks
+
+    def grow_blocks_with_low_information_text(self, removed_index, text, added_indexes, match_probability,
+                                              currently_matching_blocks, new_matching_blocks):
+        """Extend blocks whose next added line has text and start blocks at added lines with text which extended
+        none of them, as grow_blocks does - but only while the line is in fewer than max_new_blocks_per_line blocks
+        (none are started for an empty removed line). With a cap of at least the number of added lines with text
+        blocks are the same as without it. It takes time linear in the number of blocks and the cap instead of
+        the number of added lines with text, and with a small cap a run of such lines keeps extending the blocks
+        it started instead of starting new ones at every line.
+
+        Extended and started blocks are appended to new_matching_blocks in order of their added lines."""
+        removed_lines = self.removed_lines
+        added_lines = self.added_lines
+        extended_blocks_by_added_index = {}
         for matching_block in currently_matching_blocks:
-            detected_blocks.append(matching_block)
+            next_added_index = added_lines.next_line_index(matching_block.last_added_index)
+            if (next_added_index != -1 and added_lines.trim_text(next_added_index) == text
+                    and matching_block.try_extend_with_indexes(removed_index, next_added_index, match_probability)):
+                extended_blocks_by_added_index.setdefault(next_added_index, []).append(matching_block)
+        new_blocks_count = 0
+        if removed_lines.trim_text_len(removed_index):
+            new_blocks_count = max(self.max_new_blocks_per_line - len(extended_blocks_by_added_index), 0)
+        for added_index in added_indexes:
+            if new_blocks_count == 0:
+                break
+            extended_blocks = extended_blocks_by_added_index.pop(added_index, None)
+            if extended_blocks is not None:
+                new_matching_blocks.extend(extended_blocks)
+            else:
+                new_matching_blocks.append(MatchingBlock.from_indexes(removed_lines, added_lines, removed_index,
+                                                                      added_index, match_probability))
+                new_blocks_count -= 1
+        for added_index in sorted(extended_blocks_by_added_index):
+            new_matching_blocks.extend(extended_blocks_by_added_index[added_index])
+
+    def is_independent_split_point(self, index):
+        """Check if no matching block can continue from removed line index-1 to removed line index.
+
+        Blocks grow only when the next removed line directly follows the last one (also through empty lines), so
+        they cannot cross a place where file changes or line numbers jump and the line after previous one is not
+        a removed line.
+        """
+        if self.removed_lines[index - 1].is_line_before(self.removed_lines[index]):
+            return False
+        return self.removed_lines.next_line_index(index - 1) == -1
+
+    def split_removed_lines(self, chunks_count):
+        """Split removed lines to at most chunks_count contiguous (start, stop) ranges at independent split points."""
+        chunk_size = max(math.ceil(len(self.removed_lines) / chunks_count), 1)
+        chunks = []
+        start = 0
+        index = chunk_size
+        while index < len(self.removed_lines):
+            if self.is_independent_split_point(index):
+                chunks.append((start, index))
+                start = index
+                index += chunk_size
+            else:
+                index += 1
+        chunks.append((start, len(self.removed_lines)))
+        return chunks
+
+    @measure_fun_time()
+    def grow_blocks_in_parallel(self, processes):
+        """Run fuzzy matching and grow_blocks on chunks of removed lines in forked worker processes.
+
+        Workers share the added lines index (the similarity backend prepares it before fork) and fuzzy
+        matching pairs if they were already found in incremental mode. Chunks are split where no block can cross,
+        so stitching only has to put blocks in the order the serial loop would have ended them - and apply the
+        empty added lines extension the serial loop does to blocks still matching at the end of a chunk when the
+        next removed line is not empty.
+        """
+        global _worker_detector
+        chunks = self.split_removed_lines(processes)
+        logger.info(f'Detecting moved blocks in {len(chunks)} chunks with {processes} processes')
+        if self.fuzzy_matching_pairs_by_text is None and self.fuzzy_matching:
+            self.similarity.prepare()
+        _worker_detector = self
+        try:
+            with multiprocessing.get_context('fork').Pool(min(processes, len(chunks))) as pool:
+                chunks_blocks = pool.map(_grow_blocks_of_chunk, chunks, chunksize=1)
+        finally:
+            _worker_detector = None
+
+        detected_blocks: List[MatchingBlock] = []
+        for (_, stop), (chunk_detected_blocks, chunk_matching_blocks, chunk_counts, chunk_steps_count) in zip(
+                chunks, chunks_blocks):
+            self.counts.update(chunk_counts)
+            if self.budget is not None:
+                # budgets are checked by the forked copies of it
+                self.budget.steps_count = max(self.budget.steps_count, chunk_steps_count)
+            for block in chunk_detected_blocks + chunk_matching_blocks:
+                block.removed_table = self.removed_lines
+                block.added_table = self.added_lines
+            detected_blocks.extend(chunk_detected_blocks)
+            if self.anchored_removed_indexes is not None:
+                while stop < len(self.removed_lines) and self.anchored_removed_indexes[stop]:
+                    stop += 1
+            if stop < len(self.removed_lines) and self.removed_lines[stop].trim_text:
+                self.extend_matching_blocks_with_empty_added_lines_if_possible(chunk_matching_blocks)
+            detected_blocks.extend(chunk_matching_blocks)
+        return detected_blocks
 
-        detected_blocks = self.join_nearby_blocks(detected_blocks)
+    @measure_fun_time()
+    def detect_moved_blocks(self, min_lines_count=None, processes=None, progress=None) -> List[MatchingBlock]:
+        """Return detected blocks, progress(processed removed lines, all removed lines) is called as lines are fuzzy
+        matched (see find_fuzzy_matching_pairs) in serial detection and once detection of all of them is done."""
+        if self.file_groups is not None:
+            filtered_blocks = self.detect_blocks_of_file_groups(min_lines_count, processes, progress)
+        else:
+            filtered_blocks = self.detect_blocks(min_lines_count, processes, progress)
+        if self.gram_index is not None:
+            self.store_gram_vectors()
+        metrics.observe_counts(self.counts)
+        if self.budget is not None:
+            metrics.observe_degradations(self.budget.degradations)
+        if progress is not None:
+            progress(len(self.removed_lines), len(self.removed_lines))
+        return filtered_blocks
+
+    @measure_fun_time()
+    def detect_blocks_of_file_groups(self, min_lines_count, processes, progress):
+        """Return blocks detected in every group of files (see file_groups) by a detector of its lines, in the
+        order detect_blocks returns them - blocks inside larger blocks of other groups are filtered out as well."""
+        removed_tables = self.removed_lines.split_files([removed_file_ids for removed_file_ids, _ in self.file_groups])
+        added_tables = self.added_lines.split_files([added_file_ids for _, added_file_ids in self.file_groups])
+        # lines of removed files without candidate pairs count as processed
+        processed_lines = len(self.removed_lines) - sum(len(table) for table in removed_tables)
+        self.counts['file_groups'] = len(self.file_groups)
+        self.counts['not_paired_lines'] = processed_lines
+        gram_vectors = self.added_lines_fuzzy_set.gram_vectors if self.added_lines_fuzzy_set is not None else None
+        blocks = []
+        for removed_lines, added_lines in zip(removed_tables, added_tables):
+            detector = MovedBlocksDetector(removed_lines, added_lines, gram_vectors=gram_vectors,
+                                           **self.group_detector_options)
+            group_progress = None
+            if progress is not None:
+                def group_progress(processed, _, processed_before=processed_lines):
+                    progress(processed_before + processed, len(self.removed_lines))
+            blocks.extend(detector.detect_blocks(min_lines_count, processes, group_progress))
+            self.counts.update({name: count for name, count in detector.counts.items()
+                                if name not in ('removed_lines', 'added_lines')})
+            processed_lines += len(removed_lines)
+        filtered_blocks = self.filter_out_block_inside_other_blocks(blocks)
+        self.counts['filtered_blocks'] += len(blocks) - len(filtered_blocks)
+        self.counts['detected_blocks'] = len(filtered_blocks)
+        return filtered_blocks
+
+    def detect_blocks(self, min_lines_count=None, processes=None, progress=None):
+        """Return blocks detected by detect_moved_blocks, which also stores gram vectors and observes metrics."""
+        if self.keep_state:
+            # Only fuzzy matching is incremental. Blocks are grown, joined and filtered from scratch: blocks of every
+            # file depend on added lines of all files with the same text (think of `}`), so a change of any file
+            # would affect nearly all of them anyway.
+            self.fuzzy_matching_pairs_by_text = self.find_fuzzy_matching_pairs_incrementally()
+        anchor_blocks = self.find_exact_runs() if self.exact_anchors else []
+        processes = min(processes or 1, len(self.removed_lines) // MIN_REMOVED_LINES_PER_PROCESS)
+        if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            detected_blocks = self.grow_blocks_in_parallel(processes)
+        else:
+            removed_indexes = self.not_anchored(range(len(self.removed_lines)))
+            fuzzy_matching_pairs_by_text = self.fuzzy_matching_pairs_by_text
+            if fuzzy_matching_pairs_by_text is None:
+                matching_progress = None
+                if progress is not None:
+                    def matching_progress(processed, _):
+                        # lines of exact runs are not fuzzy matched, they count as processed
+                        progress(len(self.removed_lines) - len(removed_indexes) + processed, len(self.removed_lines))
+                fuzzy_matching_pairs_by_text = self.find_fuzzy_matching_pairs(removed_indexes, matching_progress)
+            detected_blocks, currently_matching_blocks = self.grow_blocks(removed_indexes,
+                                                                          fuzzy_matching_pairs_by_text)
+            detected_blocks.extend(currently_matching_blocks)
+
+        self.counts['created_blocks'] += len(anchor_blocks) + len(detected_blocks)
+        detected_blocks = self.join_nearby_blocks(anchor_blocks + detected_blocks)
         filtered_blocks = self.filter_blocks(detected_blocks, min_lines_count)
         logger.info(f'Detected {len(filtered_blocks)} blocks ({len(detected_blocks) - len(filtered_blocks)} filtered)')
+        self.counts['filtered_blocks'] += len(detected_blocks) - len(filtered_blocks)
+        self.counts['detected_blocks'] += len(filtered_blocks)
         return filtered_blocks
+
+
+def _grow_blocks_of_chunk(chunk):
+    # counts of the forked copy of the detector (it may grow blocks of more chunks) are returned with blocks
+    _worker_detector.counts.clear()
+    removed_indexes = _worker_detector.not_anchored(range(*chunk))
+    fuzzy_matching_pairs_by_text = _worker_detector.fuzzy_matching_pairs_by_text
+    if fuzzy_matching_pairs_by_text is None:
+        fuzzy_matching_pairs_by_text = _worker_detector.find_fuzzy_matching_pairs(removed_indexes)
+    budget = _worker_detector.budget
+    return _worker_detector.grow_blocks(removed_indexes, fuzzy_matching_pairs_by_text) + (
+        _worker_detector.counts, budget.steps_count if budget is not None else 0)
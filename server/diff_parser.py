@@ -0,0 +1,205 @@
+"""Single pass parser of unified diffs which keeps only added and removed lines.
+
+It follows the rules unidiff.PatchSet uses to find files and hunks, but does not build objects for files, hunks or
+context lines, so memory used is proportional to the number of changed lines - not to the size of the diff.
+"""
+import contextlib
+import gzip
+import mmap
+import re
+
+DEV_NULL = '/dev/null'
+
+RE_DIFF_GIT_HEADERS = [
+    re.compile(r'^diff --git (?P<source>"?a/[^\t\n]+"?) (?P<target>"?b/[^\t\n]+"?)'),
+    re.compile(r'^diff --git (?P<source>.*://[^\t\n]+) (?P<target>.*://[^\t\n]+)'),
+    re.compile(r'^diff --git (?P<source>[^\t\n]+) (?P<target>[^\t\n]+)'),
+]
+RE_DIFF_GIT_NEW_FILE = re.compile(r'^new file mode \d+$')
+RE_DIFF_GIT_DELETED_FILE = re.compile(r'^deleted file mode \d+$')
+RE_SOURCE_FILENAME = re.compile(r'^--- (?P<filename>"?[^\t\n]*"?)')
+RE_TARGET_FILENAME = re.compile(r'^\+\+\+ (?P<filename>"?[^\t\n]*"?)')
+RE_HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+RE_BINARY_DIFF = re.compile(r'^Binary files? [^\t]+?(?:\t[\s0-9:+-]+)?(?: and [^\t]+?(?:\t[\s0-9:+-]+)?)? '
+                            r'(differ|has changed)')
+
+ADDED = '+'
+REMOVED = '-'
+CONTEXT = ' '
+NO_NEWLINE = '\\'
+
+
+class DiffParseError(Exception):
+    pass
+
+
+def filepath(source_file, target_file):
+    """Return target path as this is convinient to use in GitHub"""
+    if source_file.startswith('a/') and target_file.startswith('b/'):
+        return target_file[2:]
+    elif source_file.startswith('a/') and target_file == DEV_NULL:
+        return source_file[2:]
+    elif target_file.startswith('b/') and source_file == DEV_NULL:
+        return target_file[2:]
+    return source_file
+
+
+def iterate_lines(diff):
+    """Return iterator over lines (with line ends) of diff given as text or iterable of lines (e.g. a file)."""
+    if not isinstance(diff, str):
+        return iter(diff)
+    return _iterate_text_lines(diff)
+
+
+def iterate_binary_lines(stream):
+    """Return iterator over lines (with line ends) of UTF-8 diff read from binary stream with readline(), e.g. a
+    memory-mapped file.
+
+    Lines are decoded one by one, so the text of the whole diff is never built. Text of context lines is not decoded
+    at all - parse_changed_lines looks only at their first character.
+    """
+    for line in iter(stream.readline, b''):
+        if line[:1] == b' ':
+            yield ' \n'
+        else:
+            yield line.decode('utf-8', errors='replace')
+
+
+@contextlib.contextmanager
+def open_diff_file(path):
+    """Return binary stream of diff file at path (see iterate_binary_lines) - memory-mapped if it can be, read through
+    gzip if path ends with .gz."""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as diff_file:
+            yield diff_file
+        return
+    with open(path, 'rb') as diff_file:
+        try:
+            mapped_diff = mmap.mmap(diff_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # empty file or one which can not be mapped, like a pipe
+            yield diff_file
+            return
+        with mapped_diff:
+            if hasattr(mapped_diff, 'madvise'):
+                mapped_diff.madvise(mmap.MADV_SEQUENTIAL)
+            yield mapped_diff
+
+
+def _iterate_text_lines(text):
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            end = len(text) - 1
+        yield text[start:end + 1]
+        start = end + 1
+
+
+def parse_changed_lines(diff):
+    """Yield (line type, file, line number, text without line end) of added (ADDED) and removed (REMOVED) lines.
+
+    Line number is the target line number of added and the source line number of removed lines, file is given by
+    filepath() of the file's source and target names.
+    """
+    lines = iterate_lines(diff)
+    source_file = None
+    file = None  # [source name, target name] of current file
+    file_has_hunks = False
+    in_header = False  # between `diff --git` line and first hunk of the file
+    for line in lines:
+        git_header = None
+        for regex in RE_DIFF_GIT_HEADERS:
+            git_header = regex.match(line)
+            if git_header:
+                break
+        if git_header:
+            file = [git_header.group('source'), git_header.group('target')]
+            file_has_hunks = False
+            in_header = True
+            continue
+
+        if RE_DIFF_GIT_NEW_FILE.match(line) or RE_DIFF_GIT_DELETED_FILE.match(line):
+            if file is None or not in_header:
+                raise DiffParseError(f'Unexpected file mode found: {line}')
+            file[0 if line.startswith('new') else 1] = DEV_NULL
+            continue
+
+        source_filename = RE_SOURCE_FILENAME.match(line)
+        if source_filename:
+            source_file = source_filename.group('filename')
+            if file is not None and not in_header:
+                file = None
+            continue
+
+        target_filename = RE_TARGET_FILENAME.match(line)
+        if target_filename:
+            target_file = target_filename.group('filename')
+            if file is not None and file[1] != target_file:
+                raise DiffParseError(f'Target without source: {line}')
+            if file is None:
+                if source_file is None:
+                    raise DiffParseError(f'Target without source: {line}')
+                file = [source_file, target_file]
+                file_has_hunks = False
+                in_header = False
+                source_file = None
+            continue
+
+        hunk_header = RE_HUNK_HEADER.match(line)
+        if hunk_header:
+            in_header = False
+            if file is None:
+                raise DiffParseError(f'Unexpected hunk found: {line}')
+            yield from _parse_hunk(hunk_header, lines, filepath(*file))
+            file_has_hunks = True
+            continue
+
+        if line.startswith('\\ No newline at end of file'):
+            if file is None or not file_has_hunks:
+                raise DiffParseError(f'Unexpected marker: {line}')
+            continue
+
+        if line == '\n' and file is not None and file_has_hunks:
+            continue
+
+        # any other line is information about the next file (or about a binary file, which has no hunks)
+        if not in_header:
+            file = None
+            in_header = True
+        if RE_BINARY_DIFF.match(line) or line == 'GIT binary patch\n':
+            if file is None and not RE_BINARY_DIFF.match(line):
+                raise DiffParseError(f'Unexpected binary patch marker: {line}')
+            file = None
+            in_header = False
+
+
+def _parse_hunk(hunk_header, lines, file):
+    source_start, source_length, target_start, target_length = hunk_header.group(1, 2, 3, 4)
+    source_line_no = int(source_start)
+    target_line_no = int(target_start)
+    expected_source_end = source_line_no + (int(source_length) if source_length is not None else 1)
+    expected_target_end = target_line_no + (int(target_length) if target_length is not None else 1)
+
+    for line in lines:
+        line_type = line[:1]
+        if line_type in ('', '\n', '\r'):
+            line_type = CONTEXT
+        elif line_type not in (ADDED, REMOVED, CONTEXT, NO_NEWLINE):
+            raise DiffParseError(f'Hunk diff line expected: {line}')
+
+        if line_type == ADDED:
+            yield ADDED, file, target_line_no, line[1:].rstrip('\n')
+            target_line_no += 1
+        elif line_type == REMOVED:
+            yield REMOVED, file, source_line_no, line[1:].rstrip('\n')
+            source_line_no += 1
+        elif line_type == CONTEXT:
+            target_line_no += 1
+            source_line_no += 1
+
+        if source_line_no > expected_source_end or target_line_no > expected_target_end:
+            raise DiffParseError('Hunk is longer than expected')
+        if source_line_no == expected_source_end and target_line_no == expected_target_end:
+            return
+    if source_line_no < expected_source_end or target_line_no < expected_target_end:
+        raise DiffParseError('Hunk is shorter than expected')
@@ -0,0 +1,103 @@
+"""Candidate (removed file, added file) pairs of a diff - files which can share a moved block - found with small
+sketches of files, so removed lines of a diff touching hundreds of files are matched only with added lines of a few
+files (see MovedBlocksDetector file_pair_filter).
+
+A sketch of a file is the set of features of its lines with at least MIN_FEATURE_TEXT_LENGTH characters: hashes
+of lowercase trim text of a line and of its first and last AFFIX_LENGTH characters, so equal lines share all 3 of
+them and a line edited in one place (but its start or end) still shares one. Features of more than
+MAX_FEATURE_FILES added files (think of `return None`) are left out. A removed and an added file are a candidate pair
+if they share at least MIN_SHARED_FEATURES features - one equal line or a few edited ones.
+
+Pairs are found with an index of added files by feature, so it takes time linear in the number of features, not in
+the number of file pairs. Removed files with the same candidates are a group and consecutive groups are merged
+until their added files have MIN_GROUP_ADDED_LINES lines, as every group gets an index of lines of its added files
+and a group of a few lines is not worth one. An added file is indexed once per group it is in - if added lines of
+all groups are more than MAX_INDEXED_LINES_RATIO times the added lines of the diff, pairs are too dense (e.g. in a
+small diff) for groups to pay off and there are none.
+"""
+import zlib
+from collections import Counter, defaultdict
+
+MIN_FEATURE_TEXT_LENGTH = 3
+AFFIX_LENGTH = 12
+MAX_FEATURE_FILES = 16
+MIN_SHARED_FEATURES = 3
+MIN_GROUP_ADDED_LINES = 1000
+MAX_INDEXED_LINES_RATIO = 4
+
+
+def line_features(lvalue):
+    """Return hashes of lowercase text lvalue and of its prefix and suffix (hashed with other initial values)."""
+    return (zlib.crc32(lvalue.encode('utf-8', 'surrogatepass')),
+            zlib.crc32(lvalue[:AFFIX_LENGTH].encode('utf-8', 'surrogatepass'), 1),
+            zlib.crc32(lvalue[-AFFIX_LENGTH:].encode('utf-8', 'surrogatepass'), 2))
+
+
+def file_sketches(table):
+    """Return sketches (sets of features) of files of LineTable by file id."""
+    sketches = [set() for _ in table.files]
+    features_by_text = {}
+    file_ids = table.file_ids
+    for index in range(len(table)):
+        if table.trim_text_len(index) < MIN_FEATURE_TEXT_LENGTH:
+            continue
+        trim_text = table.trim_text(index)
+        features = features_by_text.get(trim_text)
+        if features is None:
+            features = features_by_text[trim_text] = line_features(trim_text.lower())
+        sketches[file_ids[index]].update(features)
+    return sketches
+
+
+def candidate_file_pairs(removed_lines, added_lines):
+    """Return removed file id -> ids of added files it is a candidate pair with (sorted) for LineTables of removed
+    and added lines, removed files without any candidate are left out."""
+    added_file_ids_by_feature = defaultdict(list)
+    for added_file_id, sketch in enumerate(file_sketches(added_lines)):
+        for feature in sketch:
+            added_file_ids_by_feature[feature].append(added_file_id)
+    pairs = {}
+    for removed_file_id, sketch in enumerate(file_sketches(removed_lines)):
+        shared_features = Counter()
+        for feature in sketch:
+            added_file_ids = added_file_ids_by_feature.get(feature)
+            if added_file_ids is not None and len(added_file_ids) <= MAX_FEATURE_FILES:
+                shared_features.update(added_file_ids)
+        added_file_ids = sorted(added_file_id for added_file_id, count in shared_features.items()
+                                if count >= MIN_SHARED_FEATURES)
+        if added_file_ids:
+            pairs[removed_file_id] = added_file_ids
+    return pairs
+
+
+def file_groups(removed_lines, added_lines):
+    """Return (removed file ids, added file ids) groups of removed files with candidate added files (both sorted), in
+    order of their first removed file, or None if pairs are too dense. An added file can be in more groups."""
+    removed_file_ids_by_added_file_ids = {}
+    for removed_file_id, added_file_ids in candidate_file_pairs(removed_lines, added_lines).items():
+        removed_file_ids_by_added_file_ids.setdefault(tuple(added_file_ids), []).append(removed_file_id)
+    added_lines_counts = Counter(added_lines.file_ids)
+    groups = []
+    group_removed_file_ids = []
+    group_added_file_ids = set()
+    group_added_lines_count = 0
+    candidate_groups = sorted((removed_file_ids, added_file_ids)
+                              for added_file_ids, removed_file_ids in removed_file_ids_by_added_file_ids.items())
+    for removed_file_ids, added_file_ids in candidate_groups:
+        group_removed_file_ids.extend(removed_file_ids)
+        for added_file_id in added_file_ids:
+            if added_file_id not in group_added_file_ids:
+                group_added_file_ids.add(added_file_id)
+                group_added_lines_count += added_lines_counts[added_file_id]
+        if group_added_lines_count >= MIN_GROUP_ADDED_LINES:
+            groups.append((sorted(group_removed_file_ids), sorted(group_added_file_ids)))
+            group_removed_file_ids = []
+            group_added_file_ids = set()
+            group_added_lines_count = 0
+    if group_removed_file_ids:
+        groups.append((sorted(group_removed_file_ids), sorted(group_added_file_ids)))
+    indexed_lines_count = sum(added_lines_counts[added_file_id] for _, added_file_ids in groups
+                              for added_file_id in added_file_ids)
+    if indexed_lines_count > MAX_INDEXED_LINES_RATIO * len(added_lines):
+        return None
+    return groups
@@ -1,25 +1,45 @@
 import re
 import math
-import operator
 import collections
+import random
 import unittest
 
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # get_many falls back to scoring values one by one
+    numpy = None
+    sparse = None
+
 __version__ = (0, 0, 11)
 
 _non_word_re = re.compile(r'[^\w, ]+')
 
+# Pruning bounds are compared with a tiny slack, so floating point rounding never drops a match which passes.
+_PRUNE_SLACK = 1 - 1e-9
+
+# Number of values scored by a single sparse matrix product in get_many - bounds memory used by the product.
+_BATCH_ROWS = 256
+
 __all__ = ('FuzzySet',)
 
 
 class FuzzySet(object):
-    def __init__(self, iterable=(), gram_size_lower=2, gram_size_upper=3):
+    def __init__(self, iterable=(), gram_size_lower=2, gram_size_upper=3, gram_vectors=None):
         self.exact_set = {}
         self.match_dict = collections.defaultdict(list)
         self.items = {}
+        self.item_grams = {}
+        self.item_indexes = {}
+        self.max_weights = {}
+        self.item_matrices = {}
+        # (lvalue, gram size) -> (grams, norm) - vectors found there are not computed again, computed ones are added
+        self.gram_vectors = gram_vectors
         self.gram_size_lower = gram_size_lower
         self.gram_size_upper = gram_size_upper
         for i in range(gram_size_lower, gram_size_upper + 1):
             self.items[i] = []
+            self.item_grams[i] = []
         for value in iterable:
             self.add(value)
 
@@ -27,6 +47,8 @@ class FuzzySet(object):
         lvalue = value.lower()
         if lvalue in self.exact_set:
             return False
+        self.item_matrices.clear()
+        self.item_indexes[lvalue] = len(self.exact_set)
         for i in range(self.gram_size_lower, self.gram_size_upper + 1):
             self.__add(value, i)
 
@@ -35,13 +57,34 @@ class FuzzySet(object):
         items = self.items[gram_size]
         idx = len(items)
         items.append(0)
-        grams = _gram_counter(lvalue, gram_size)
-        norm = math.sqrt(sum(x**2 for x in grams.values()))
+        grams, norm = self.__gram_vector(lvalue, gram_size)
         for gram, occ in grams.items():
             self.match_dict[gram].append((idx, occ))
+            weight = occ / norm
+            if weight > self.max_weights.get(gram, 0.0):
+                self.max_weights[gram] = weight
         items[idx] = (norm, lvalue)
+        max_weight = max(grams.values()) / norm if grams else 0.0
+        self.item_grams[gram_size].append((grams, len(grams), max_weight))
         self.exact_set[lvalue] = value
 
+    def __query_grams(self, value, gram_size):
+        """Return gram counts of value searched in the set - taken from (and added to) gram_vectors if given."""
+        if self.gram_vectors is None:
+            return _gram_counter(value.lower(), gram_size)
+        return self.__gram_vector(value.lower(), gram_size)[0]
+
+    def __gram_vector(self, lvalue, gram_size):
+        if self.gram_vectors is not None:
+            vector = self.gram_vectors.get((lvalue, gram_size))
+            if vector is not None:
+                return vector
+        grams = dict(_gram_counter(lvalue, gram_size))
+        vector = (grams, math.sqrt(sum(x**2 for x in grams.values())))
+        if self.gram_vectors is not None:
+            self.gram_vectors[(lvalue, gram_size)] = vector
+        return vector
+
     def __getitem__(self, value):
         return self._getitem(value, exact_match_only=True, min_match_score=0.5)
 
@@ -58,26 +101,130 @@ class FuzzySet(object):
                 return results
         raise KeyError(value)
     def __get(self, value, gram_size, min_match_score=0.5):
-        lvalue = value.lower()
-        matches = collections.defaultdict(float)
-        grams = _gram_counter(lvalue, gram_size)
-        items = self.items[gram_size]
-        norm = math.sqrt(sum(x**2 for x in grams.values()))
+        grams = self.__query_grams(value, gram_size)
+        matches = self.__search(grams, gram_size, min_match_score)
+        if matches is None:
+            return None
+        return self.__rank(grams, matches, gram_size)
 
-        for gram, occ in grams.items():
-            for idx, other_occ in self.match_dict.get(gram, ()):
-                matches[idx] += occ * other_occ
+    def __search(self, grams, gram_size, min_match_score):
+        """Return {item index: cosine similarity} of items matching with at least min_match_score.
 
-        if not matches:
+        None is returned when no item can match at all.
+        """
+        items = self.items[gram_size]
+        norm = math.sqrt(sum(x**2 for x in grams.values()))
+        candidates = self.__match_candidates(grams, norm, gram_size, min_match_score)
+        if not candidates:
             return None
 
         # cosine similarity
-        results = [(match_score / (norm * items[idx][0]), items[idx][1])
-                   for idx, match_score in matches.items()]
-        results.sort(reverse=True, key=operator.itemgetter(0))
+        matches = {}
+        for idx, match_score in candidates.items():
+            score = match_score / (norm * items[idx][0])
+            if score >= min_match_score:
+                matches[idx] = score
+        return matches
+
+    def __rank(self, grams, matches, gram_size):
+        """Return [(score, value)] of {item index: score} matches sorted by score.
+
+        Ties are kept in the order a full scan of match_dict meets items (position of the first shared query gram,
+        then insertion index), so results do not depend on how candidates were found.
+        """
+        items = self.items[gram_size]
+        item_grams = self.item_grams[gram_size]
+        ordered = sorted(matches.items(), key=lambda match: (-match[1], match[0]))
+        ranked = []
+        start = 0
+        while start < len(ordered):
+            stop = start + 1
+            while stop < len(ordered) and ordered[stop][1] == ordered[start][1]:
+                stop += 1
+            tied = ordered[start:stop]
+            if len(tied) > 1:
+                tied.sort(key=lambda match: (_first_shared_gram_position(grams, item_grams[match[0]][0]), match[0]))
+            ranked.extend((score, self.exact_set[items[idx][1]]) for idx, score in tied)
+            start = stop
+        return ranked
+
+    def __match_candidates(self, grams, norm, gram_size, min_match_score):
+        """Return {item index: dot product} for items which can reach min_match_score.
+
+        On L2-normalized gram vectors cosine similarity is a plain dot product, which gives cheap upper bounds:
+        * length filtering - dot(q, x) <= max(q) * sqrt(size(x)) and dot(q, x) <= max(x) * sum(q), so items with too
+          few distinct grams or too light heaviest gram are never scored,
+        * prefix filtering - query grams are visited from the rarest one and once the best possible contribution of
+          the remaining grams (query weight * max weight of gram in the index, or the norm of the remaining part of
+          the query by Cauchy-Schwarz) falls below the threshold, items not seen so far cannot match, so no new
+          candidates are admitted and long posting lists of common grams are not walked,
+        * candidates whose partial score plus the remaining bound falls below the threshold are dropped before the
+          remaining grams are scored.
+        """
+        match_dict = self.match_dict
+        items = self.items[gram_size]
+        item_grams = self.item_grams[gram_size]
+
+        if min_match_score <= 0 or not grams:
+            matches = collections.defaultdict(int)
+            for gram, occ in grams.items():
+                for idx, other_occ in match_dict.get(gram, ()):
+                    matches[idx] += occ * other_occ
+            return matches
+
+        matches = {}
+
+        threshold = min_match_score * norm * _PRUNE_SLACK
+        min_size = (threshold / max(grams.values())) ** 2
+        min_max_weight = threshold / sum(grams.values())
+
+        ordered_grams = sorted(grams, key=lambda gram: len(match_dict.get(gram, ())))
+        suffix_bounds = [0.0] * (len(ordered_grams) + 1)
+        weights_bound = 0.0
+        squares_sum = 0
+        for i in range(len(ordered_grams) - 1, -1, -1):
+            gram = ordered_grams[i]
+            occ = grams[gram]
+            weights_bound += occ * self.max_weights.get(gram, 0.0)
+            squares_sum += occ ** 2
+            suffix_bounds[i] = min(weights_bound, math.sqrt(squares_sum))
 
-        return [(score, self.exact_set[lval]) for score, lval in results
-                if score >= min_match_score]
+        rejected = set()
+        i = 0
+        while i < len(ordered_grams) and suffix_bounds[i] >= threshold:
+            gram = ordered_grams[i]
+            occ = grams[gram]
+            for idx, other_occ in match_dict.get(gram, ()):
+                if idx in matches:
+                    matches[idx] += occ * other_occ
+                elif idx not in rejected:
+                    _, size, max_weight = item_grams[idx]
+                    if size >= min_size and max_weight >= min_max_weight:
+                        matches[idx] = occ * other_occ
+                    else:
+                        rejected.add(idx)
+            i += 1
+
+        if i < len(ordered_grams):
+            bound = threshold - suffix_bounds[i]
+            matches = {idx: match_score for idx, match_score in matches.items()
+                       if match_score / items[idx][0] >= bound}
+
+        for gram in ordered_grams[i:]:
+            if not matches:
+                break
+            occ = grams[gram]
+            postings = match_dict.get(gram, ())
+            if len(postings) <= len(matches):
+                for idx, other_occ in postings:
+                    if idx in matches:
+                        matches[idx] += occ * other_occ
+            else:
+                for idx in matches:
+                    other_occ = item_grams[idx][0].get(gram)
+                    if other_occ:
+                        matches[idx] += occ * other_occ
+        return matches
 
     def get(self, key, default=None, exact_match_only=True, min_match_score=0.5):
         try:
@@ -85,6 +232,121 @@ class FuzzySet(object):
         except KeyError:
             return default
 
+    def get_many(self, values, default=None, exact_match_only=True, min_match_score=0.5):
+        """Return list with result of get(value, ...) for each of values.
+
+        With numpy and scipy installed gram counts of all values and of all items are put in sparse matrices, so
+        dot products of every (value, item) pair come from a single sparse matrix product per gram size instead of
+        walking posting lists value by value. Without them values are looked up one by one.
+        """
+        values = list(values)
+        if sparse is None:
+            return [self.get(value, default, exact_match_only, min_match_score) for value in values]
+
+        results = [default] * len(values)
+        pending = []
+        for i, value in enumerate(values):
+            exact_match = self.exact_set.get(value.lower())
+            if exact_match_only and exact_match:
+                results[i] = [(1, exact_match)]
+            else:
+                pending.append(i)
+
+        for gram_size in range(self.gram_size_upper, self.gram_size_lower - 1, -1):
+            if not pending:
+                break
+            still_pending = []
+            searched = self.__search_many([values[i] for i in pending], gram_size, min_match_score)
+            for i, (grams, matches) in zip(pending, searched):
+                if matches:
+                    results[i] = self.__rank(grams, matches, gram_size)
+                else:
+                    still_pending.append(i)
+            pending = still_pending
+        return results
+
+    def match_many(self, values, gram_size, min_match_score=0.5):
+        """Return {lvalue: score} of items matching each of values with at least min_match_score on grams of
+        gram_size (without falling back to other gram sizes)."""
+        values = list(values)
+        items = self.items[gram_size]
+        # building the item matrix does not pay off for a few values
+        if sparse is None or (len(values) < _BATCH_ROWS and gram_size not in self.item_matrices):
+            searched = [self.__search(self.__query_grams(value, gram_size), gram_size, min_match_score)
+                        for value in values]
+        else:
+            searched = [matches for _, matches in self.__search_many(values, gram_size, min_match_score)]
+        return [{items[idx][1]: score for idx, score in matches.items()} if matches else {} for matches in searched]
+
+    def rank(self, value, gram_size, matches):
+        """Return [(score, value)] of {lvalue: score} matches ordered the same way get() orders them."""
+        grams = self.__query_grams(value, gram_size)
+        return self.__rank(grams, {self.item_indexes[lvalue]: score for lvalue, score in matches.items()},
+                           gram_size)
+
+    def prepare_get_many(self):
+        """Build sparse matrices used by get_many up front, e.g. before forking workers which should share them."""
+        if sparse is not None:
+            for gram_size in range(self.gram_size_lower, self.gram_size_upper + 1):
+                self.__item_matrix(gram_size)
+
+    def __search_many(self, values, gram_size, min_match_score):
+        """Return (grams, {item index: cosine similarity} or None) for each of values - like __search, but all
+        values are scored with one sparse matrix product."""
+        query_grams = [self.__query_grams(value, gram_size) for value in values]
+        if not self.items[gram_size]:
+            return [(grams, None) for grams in query_grams]
+        gram_ids, item_matrix, item_norms = self.__item_matrix(gram_size)
+
+        query_norms = numpy.array([math.sqrt(sum(x**2 for x in grams.values())) for grams in query_grams])
+        indptr = [0]
+        indices = []
+        data = []
+        for grams in query_grams:
+            for gram, occ in grams.items():
+                gram_id = gram_ids.get(gram)
+                if gram_id is not None:
+                    indices.append(gram_id)
+                    data.append(occ)
+            indptr.append(len(indices))
+        query_matrix = sparse.csr_matrix((numpy.array(data, dtype=numpy.int64), indices, indptr),
+                                         shape=(len(values), len(gram_ids)))
+
+        results = []
+        for start in range(0, len(values), _BATCH_ROWS):
+            products = (query_matrix[start:start + _BATCH_ROWS] @ item_matrix).tocsr()
+            rows = numpy.repeat(numpy.arange(products.shape[0]), numpy.diff(products.indptr))
+            # cosine similarity - the same float operations as in __search, so scores are bit for bit equal
+            scores = products.data / (query_norms[start + rows] * item_norms[products.indices])
+            passed = scores >= min_match_score
+            for row in range(products.shape[0]):
+                row_start, row_stop = products.indptr[row], products.indptr[row + 1]
+                matches = None
+                if row_start != row_stop:
+                    row_passed = passed[row_start:row_stop]
+                    matches = dict(zip(products.indices[row_start:row_stop][row_passed].tolist(),
+                                       scores[row_start:row_stop][row_passed].tolist()))
+                results.append((query_grams[start + row], matches))
+        return results
+
+    def __item_matrix(self, gram_size):
+        """Return (gram -> column, transposed sparse matrix of item gram counts, item norms) for gram_size."""
+        if gram_size not in self.item_matrices:
+            gram_ids = {}
+            indptr = [0]
+            indices = []
+            data = []
+            for grams, _, _ in self.item_grams[gram_size]:
+                for gram, occ in grams.items():
+                    indices.append(gram_ids.setdefault(gram, len(gram_ids)))
+                    data.append(occ)
+                indptr.append(len(indices))
+            item_matrix = sparse.csr_matrix((numpy.array(data, dtype=numpy.int64), indices, indptr),
+                                            shape=(len(indptr) - 1, len(gram_ids)))
+            item_norms = numpy.array([norm for norm, _ in self.items[gram_size]])
+            self.item_matrices[gram_size] = (gram_ids, item_matrix.T.tocsr(), item_norms)
+        return self.item_matrices[gram_size]
+
     def __nonzero__(self):
         return bool(self.exact_set)
 
@@ -92,6 +354,13 @@ class FuzzySet(object):
         return len(self.exact_set)
 
 
+def _first_shared_gram_position(grams, other_grams):
+    for position, gram in enumerate(grams):
+        if gram in other_grams:
+            return position
+    return len(grams)
+
+
 def _gram_counter(value, gram_size=2):
     result = collections.defaultdict(int)
     for value in _iterate_grams(value, gram_size):
@@ -154,3 +423,36 @@ class FuzzySetTest(unittest.TestCase):
         self.get_from_set(fuzzy_set, "ab", ["a", "b"], min_match_score=0.35)
         self.get_from_set(fuzzy_set, "xy", ["xyz"], min_match_score=0.35)
         # TODO conclusion - use 0.35 for 1 or 2 sign words and 0.5 or more for rest
+
+    def test_pruned_lookup_returns_the_same_rows_as_full_scan(self):
+        rng = random.Random(0)
+        words = ["self", "return", "None", "value", "items", "x", "=", "(", ")", "}", "Foo", "foo", "bar"]
+
+        def random_row():
+            return " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+
+        fuzzy_set = FuzzySet(random_row() for _ in range(500))
+        for _ in range(200):
+            query = random_row()
+            for min_match_score in (0.35, 0.5, 0.8):
+                for gram_size in (2, 3):
+                    full_scan = fuzzy_set._FuzzySet__get(query, gram_size, min_match_score=0) or []
+                    expected = [(score, row) for score, row in full_scan if score >= min_match_score]
+                    pruned = fuzzy_set._FuzzySet__get(query, gram_size, min_match_score=min_match_score) or []
+                    self.assertEqual(expected, pruned)
+
+    def test_get_many_returns_the_same_rows_as_get(self):
+        rng = random.Random(1)
+        words = ["self", "return", "None", "value", "items", "x", "=", "(", ")", "}", "Foo", "foo", "bar"]
+
+        def random_row():
+            return " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+
+        fuzzy_set = FuzzySet(random_row() for _ in range(500))
+        queries = [random_row() for _ in range(300)] + ["}", "{", "", "zzz"]
+        for exact_match_only in (True, False):
+            for min_match_score in (0.35, 0.5):
+                expected = [fuzzy_set.get(query, exact_match_only=exact_match_only, min_match_score=min_match_score)
+                            for query in queries]
+                self.assertEqual(expected, fuzzy_set.get_many(queries, exact_match_only=exact_match_only,
+                                                              min_match_score=min_match_score))
@@ -0,0 +1,161 @@
+"""Persistent index of FuzzySet gram vectors of line texts shared by detections of all pull requests.
+
+Lines of files changed often (e.g. big files of a monorepo) recur in diffs of many pull requests, so gram vectors
+of their texts are computed once and loaded by later detections (see MovedBlocksDetector gram_index argument)
+instead of being computed again by FuzzySet. A vector depends only on the lowercase text and the gram size, so
+entries are keyed by hash of both and the index serves every repository.
+"""
+import hashlib
+import logging
+import functools
+import marshal
+import sqlite3
+import threading
+import time
+
+from sqlite_connection import ProcessConnection
+
+logger = logging.getLogger(__name__)
+
+# Number of keys looked up by one query - sqlite limits number of parameters of a statement.
+_QUERY_KEYS = 500
+
+# Number of least recently used entries deleted at once when the index is over its size limit.
+_EVICTED_ROWS = 1000
+
+# Last access of an entry is updated when it is older than that, so loading recently used vectors does not write.
+_ACCESS_RESOLUTION_SECONDS = 60 * 60
+
+
+class GramIndex(object):
+    """Sqlite file of (lowercase text, gram size) -> (grams, norm) FuzzySet gram vectors shared by all gunicorn
+    workers on the host.
+
+    Reads go through a memory map of the file (mmap_bytes of it), so lookups of vectors do not copy pages through
+    read calls. Least recently used entries are evicted when total size of encoded vectors exceeds max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, mmap_bytes=None, time_function=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mmap_bytes = mmap_bytes if mmap_bytes is not None else 2 * max_bytes
+        self._time = time_function
+        self._lock = threading.Lock()
+        self._connection = ProcessConnection(path, functools.partial(_create_tables, mmap_bytes=self.mmap_bytes))
+
+    def __getstate__(self):
+        # the index is passed to detection worker processes, which open their own connection
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(lvalue, gram_size):
+        return hashlib.sha1(f'{gram_size}\0{lvalue}'.encode('utf-8', 'surrogatepass')).digest()
+
+    def load(self, lvalues, gram_sizes):
+        """Return {(lvalue, gram size): (grams, norm)} of vectors of lvalues found in the index."""
+        keys = {self.make_key(lvalue, gram_size): (lvalue, gram_size)
+                for lvalue in lvalues for gram_size in gram_sizes}
+        digests = list(keys)
+        vectors = {}
+        try:
+            with self._lock:
+                connection = self._db()
+                now = self._time()
+                connection.execute('BEGIN')
+                try:
+                    for start in range(0, len(digests), _QUERY_KEYS):
+                        chunk = digests[start:start + _QUERY_KEYS]
+                        placeholders = ', '.join('?' * len(chunk))
+                        rows = connection.execute(f'SELECT key, value, last_access FROM vectors '
+                                                  f'WHERE key IN ({placeholders})', chunk).fetchall()
+                        for key, value, _ in rows:
+                            vectors[keys[key]] = marshal.loads(value)
+                        connection.executemany('UPDATE vectors SET last_access = ? WHERE key = ?',
+                                               ((now, key) for key, _, last_access in rows
+                                                if last_access < now - _ACCESS_RESOLUTION_SECONDS))
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+        except (sqlite3.Error, ValueError, EOFError, TypeError):
+            logger.exception('Reading gram index failed')
+            return {}
+        return vectors
+
+    def store(self, vectors):
+        """Add {(lvalue, gram size): (grams, norm)} vectors to the index (vectors already in it are kept)."""
+        rows = []
+        for (lvalue, gram_size), (grams, norm) in vectors.items():
+            value = marshal.dumps((dict(grams), norm))
+            rows.append((self.make_key(lvalue, gram_size), value, len(value)))
+        if not rows:
+            return
+        try:
+            with self._lock:
+                connection = self._db()
+                now = self._time()
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    added_bytes = 0
+                    for key, value, size in rows:
+                        cursor = connection.execute('INSERT OR IGNORE INTO vectors VALUES (?, ?, ?, ?)',
+                                                    (key, value, size, now))
+                        added_bytes += size * cursor.rowcount
+                    connection.execute('UPDATE totals SET size = size + ?', (added_bytes,))
+                    self._evict(connection)
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error:
+            logger.exception('Writing gram index failed')
+
+    def stats(self):
+        with self._lock:
+            connection = self._db()
+            entries = connection.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+            size = connection.execute('SELECT size FROM totals').fetchone()[0]
+        return {'entries': entries, 'bytes': size}
+
+    def _db(self):
+        return self._connection.get()
+
+    def _evict(self, connection):
+        total_size = connection.execute('SELECT size FROM totals').fetchone()[0]
+        while total_size > self.max_bytes:
+            rows = connection.execute('SELECT key, size FROM vectors ORDER BY last_access LIMIT ?',
+                                      (_EVICTED_ROWS,)).fetchall()
+            if not rows:
+                total_size = 0
+                break
+            evicted_keys = []
+            for key, size in rows:
+                if total_size <= self.max_bytes:
+                    break
+                evicted_keys.append((key,))
+                total_size -= size
+            connection.executemany('DELETE FROM vectors WHERE key = ?', evicted_keys)
+        connection.execute('UPDATE totals SET size = ?', (total_size,))
+
+
+def _create_tables(connection, mmap_bytes):
+    connection.execute(f'PRAGMA mmap_size={int(mmap_bytes)}')
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.execute('CREATE TABLE IF NOT EXISTS vectors ('
+                           'key BLOB PRIMARY KEY, value BLOB, size INTEGER, last_access REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS vectors_last_access ON vectors(last_access)')
+        # total size of values, so it is not summed over the whole table by every store
+        connection.execute('CREATE TABLE IF NOT EXISTS totals (size INTEGER)')
+        if connection.execute('SELECT COUNT(*) FROM totals').fetchone()[0] == 0:
+            connection.execute('INSERT INTO totals VALUES (0)')
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
@@ -0,0 +1,94 @@
+"""Reuse of detection work between consecutive versions of a diff (e.g. after a new commit is pushed to a PR)."""
+import logging
+import threading
+from collections import OrderedDict
+
+from fuzzyset import FuzzySet
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionState(object):
+    """What is needed to repeat detection cheaply for the next version of a diff.
+
+    * added_texts - lowercase texts of added lines (FuzzySet items),
+    * matches - removed line text -> {gram size: {added lowercase text: score}} for every gram size searched,
+    * gram_vectors - FuzzySet gram vectors of added texts.
+    """
+
+    def __init__(self, added_texts, matches, gram_vectors):
+        self.added_texts = added_texts
+        self.matches = matches
+        self.gram_vectors = gram_vectors
+
+
+def find_fuzzy_matching_pairs(fuzzy_set: FuzzySet, texts_by_min_match_score, previous_state=None):
+    """Return (text -> fuzzy matching pairs, text -> {gram size: {added lowercase text: score}}).
+
+    Pairs are the same as fuzzy_set.get_many(texts, exact_match_only=False, ...) would return. Score of two texts
+    does not depend on other items of the set, so for texts searched with the same gram size in previous_state
+    only added texts which were not in the previous diff are searched - the rest of matches is taken from the
+    previous state (without added texts which are gone).
+    """
+    previous_matches = previous_state.matches if previous_state is not None else {}
+    new_texts_fuzzy_set = None
+    if previous_state is not None:
+        new_texts_fuzzy_set = FuzzySet(gram_vectors=fuzzy_set.gram_vectors)
+        for lvalue in fuzzy_set.item_indexes:
+            if lvalue not in previous_state.added_texts:
+                new_texts_fuzzy_set.add(lvalue)
+
+    fuzzy_matching_pairs = {}
+    matches = {}
+    for min_match_score, texts in texts_by_min_match_score.items():
+        pending = list(texts)
+        for gram_size in range(fuzzy_set.gram_size_upper, fuzzy_set.gram_size_lower - 1, -1):
+            if not pending:
+                break
+            reused = [text for text in pending if gram_size in previous_matches.get(text, {})]
+            searched = [text for text in pending if gram_size not in previous_matches.get(text, {})]
+
+            texts_matches = list(zip(searched, fuzzy_set.match_many(searched, gram_size, min_match_score)))
+            new_texts_matches = [{}] * len(reused)
+            if reused and new_texts_fuzzy_set is not None and new_texts_fuzzy_set.item_indexes:
+                new_texts_matches = new_texts_fuzzy_set.match_many(reused, gram_size, min_match_score)
+            for text, text_new_matches in zip(reused, new_texts_matches):
+                text_matches = {lvalue: score for lvalue, score in previous_matches[text][gram_size].items()
+                                if lvalue in fuzzy_set.item_indexes}
+                text_matches.update(text_new_matches)
+                texts_matches.append((text, text_matches))
+
+            pending = []
+            for text, text_matches in texts_matches:
+                matches.setdefault(text, {})[gram_size] = text_matches
+                if text_matches:
+                    fuzzy_matching_pairs[text] = fuzzy_set.rank(text, gram_size, text_matches)
+                else:
+                    pending.append(text)
+        fuzzy_matching_pairs.update((text, None) for text in pending)
+    logger.info(f'Reused fuzzy matches of {sum(text in previous_matches for text in matches)} of {len(matches)} '
+                f'removed texts')
+    return fuzzy_matching_pairs, matches
+
+
+class DetectionStateStore(object):
+    """In-process LRU of DetectionState by result token (each gunicorn worker has its own)."""
+
+    def __init__(self, max_count=8):
+        self.max_count = max_count
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            state = self._states.get(token)
+            if state is not None:
+                self._states.move_to_end(token)
+            return state
+
+    def set(self, token, state):
+        with self._lock:
+            self._states[token] = state
+            self._states.move_to_end(token)
+            while len(self._states) > self.max_count:
+                self._states.popitem(last=False)
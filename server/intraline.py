@@ -0,0 +1,112 @@
+"""Character level differences of texts of fuzzy matched lines, so the extension does not have to diff them.
+
+Edit spans of a removed and an added text are [start, stop) offsets of characters removed from the removed text and
+of characters added to the added text - what the extension highlights. Offsets are in UTF-16 code units, as in
+JavaScript strings. Like diff_cleanupSemantic of diff-match-patch, equal parts too short to be meaningful between
+edits are made part of the edits.
+"""
+import functools
+from difflib import SequenceMatcher
+
+from time_utils import measure_fun_time
+
+# Number of (removed text, added text) pairs whose edit spans are cached - texts of moved lines recur within and
+# between requests (e.g. for every version of a pull request).
+CACHE_SIZE = 64 * 1024
+
+
+def _common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    i = 0
+    while i < length and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix_length(a, b, max_length):
+    i = 0
+    while i < max_length and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+
+def _edits(removed_text, added_text):
+    """Return (removed start, removed stop, added start, added stop) of edits of removed_text into added_text."""
+    # common prefix and suffix are cut off first, as SequenceMatcher is much slower than this on long texts
+    prefix = _common_prefix_length(removed_text, added_text)
+    suffix = _common_suffix_length(removed_text, added_text, min(len(removed_text), len(added_text)) - prefix)
+    removed_middle = removed_text[prefix:len(removed_text) - suffix]
+    added_middle = added_text[prefix:len(added_text) - suffix]
+    edits = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, removed_middle, added_middle, autojunk=False).get_opcodes():
+        if tag != 'equal':
+            edits.append([prefix + i1, prefix + i2, prefix + j1, prefix + j2])
+    return _merge_short_equalities(edits)
+
+
+def _merge_short_equalities(edits):
+    """Join edits separated by equal text not longer than the edits on both sides of it."""
+    merged = []
+    for edit in edits:
+        if merged:
+            previous = merged[-1]
+            equality_length = edit[0] - previous[1]
+            if (equality_length <= max(previous[1] - previous[0], previous[3] - previous[2])
+                    and equality_length <= max(edit[1] - edit[0], edit[3] - edit[2])):
+                previous[1] = edit[1]
+                previous[3] = edit[3]
+                continue
+        merged.append(edit)
+    return merged
+
+
+def _utf16_offsets(text):
+    """Return function mapping offsets in text to offsets in its UTF-16 encoding."""
+    if text.isascii() or max(text) <= '\uffff':
+        return lambda offset: offset
+    offsets = [0]
+    for char in text:
+        offsets.append(offsets[-1] + (2 if char > '\uffff' else 1))
+    return offsets.__getitem__
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def edit_spans(removed_text, added_text):
+    """Return {'removed': spans of removed_text, 'added': spans of added_text} of edits between them."""
+    removed_offset = _utf16_offsets(removed_text)
+    added_offset = _utf16_offsets(added_text)
+    spans = {'removed': [], 'added': []}
+    for removed_start, removed_stop, added_start, added_stop in _edits(removed_text, added_text):
+        if removed_start != removed_stop:
+            spans['removed'].append([removed_offset(removed_start), removed_offset(removed_stop)])
+        if added_start != added_stop:
+            spans['added'].append([added_offset(added_start), added_offset(added_stop)])
+    return spans
+
+
+def _text(table, index):
+    return table.text[table.text_offsets[index]:table.text_offsets[index + 1]]
+
+
+@measure_fun_time()
+def edit_spans_of_blocks(blocks):
+    """Return for every block a list of edit spans of its lines (None for lines matched exactly or with one side).
+
+    Spans of all blocks are computed together, once for every distinct pair of texts.
+    """
+    spans_by_texts = {}
+    result = []
+    for block in blocks:
+        block_spans = []
+        for removed_index, added_index, match_probability in zip(block.removed_indexes, block.added_indexes,
+                                                                 block.match_probabilities):
+            if removed_index == -1 or added_index == -1 or match_probability >= 1:
+                block_spans.append(None)
+                continue
+            texts = (_text(block.removed_table, removed_index), _text(block.added_table, added_index))
+            spans = spans_by_texts.get(texts)
+            if spans is None:
+                spans = spans_by_texts[texts] = edit_spans(*texts)
+            block_spans.append(spans)
+        result.append(block_spans)
+    return result
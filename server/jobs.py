@@ -0,0 +1,241 @@
+"""Detection jobs for diffs too large to be detected within a request, queued in a local sqlite file.
+
+Jobs are detected by worker processes started by JobWorkers, which claim queued jobs one at a time. A job stays
+in the file until it expires, so jobs survive a restart of the server: a running job whose worker did not report
+progress for stale_seconds (e.g. because it was killed) is claimed again, at most max_attempts times. Detection
+reports progress only while it fuzzy matches lines, so a worker also reports a heartbeat every heartbeat_seconds
+while it detects a job, and a job of a live worker does not turn stale. Every claim of a job is an attempt
+and progress and result of a job are stored only by its last attempt, not by a worker which lost the job.
+Jobs are not limited by a DetectionBudget, as they are meant for diffs over the budget of a request.
+Id of a job is the hash of its diff, options and encoding, so identical diffs submitted at the same time share one job.
+"""
+import json
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+import serialization
+from detector import MovedBlocksDetector
+from result_cache import ResultCache
+from sqlite_connection import ProcessConnection
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job(object):
+    def __init__(self, job_id, status, processed_lines, total_lines, error=None):
+        self.job_id = job_id
+        self.status = status
+        self.processed_lines = processed_lines
+        self.total_lines = total_lines
+        self.error = error
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'processed_lines': self.processed_lines,
+            'total_lines': self.total_lines,
+            'error': self.error,
+        }
+
+
+class JobQueue(object):
+    def __init__(self, path, ttl_seconds=24 * 60 * 60, stale_seconds=5 * 60, max_attempts=3, heartbeat_seconds=None,
+                 time_function=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.heartbeat_seconds = heartbeat_seconds if heartbeat_seconds is not None else stale_seconds / 4
+        self._time = time_function
+        self._lock = threading.Lock()
+        self._connection = ProcessConnection(path, _create_tables)
+
+    def _db(self):
+        return self._connection.get()
+
+    def _transaction(self, fun, *args):
+        with self._lock:
+            connection = self._db()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = fun(connection, *args)
+                connection.execute('COMMIT')
+                return result
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def submit(self, diff_text, min_lines_count=None, options=None, encoding=None):
+        """Queue a job unless there is one for the same diff, options and encoding which did not fail, return its Job.
+
+        options are MovedBlocksDetector keyword arguments, encoding are serialization.blocks_to_json ones.
+        """
+        options = options or {}
+        encoding = encoding or {}
+        job_id = ResultCache.make_key(diff_text, min_lines_count, sorted(options.items()), sorted(encoding.items()))
+        return self._transaction(self._submit, job_id, diff_text, min_lines_count, options, encoding)
+
+    def _submit(self, connection, job_id, diff_text, min_lines_count, options, encoding):
+        now = self._time()
+        connection.execute('DELETE FROM jobs WHERE status IN (?, ?) AND updated_at <= ?',
+                           (DONE, FAILED, now - self.ttl_seconds))
+        row = connection.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row[0] == FAILED:
+            connection.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, 0, NULL, NULL, NULL, 0, ?, ?)',
+                               (job_id, QUEUED, diff_text, min_lines_count, json.dumps(options), json.dumps(encoding),
+                                now, now))
+            logger.info(f'Queued job {job_id}')
+        else:
+            logger.info(f'Job {job_id} is already {row[0]}')
+        return self._get(connection, job_id)
+
+    def get(self, job_id):
+        """Return Job of job_id or None if there is no such job."""
+        with self._lock:
+            return self._get(self._db(), job_id)
+
+    @staticmethod
+    def _get(connection, job_id):
+        row = connection.execute('SELECT id, status, processed_lines, total_lines, error FROM jobs WHERE id = ?',
+                                 (job_id,)).fetchone()
+        return Job(*row) if row is not None else None
+
+    def result(self, job_id):
+        """Return JSON of blocks detected by job_id or None if it is not done."""
+        with self._lock:
+            row = self._db().execute('SELECT result FROM jobs WHERE id = ? AND status = ?', (job_id, DONE)).fetchone()
+        return row[0] if row is not None else None
+
+    def has_unfinished_jobs(self):
+        with self._lock:
+            return self._db().execute('SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1',
+                                      (QUEUED, RUNNING)).fetchone() is not None
+
+    def claim(self):
+        """Mark the oldest queued (or stale running) job as running and return (job_id, attempt, diff_text,
+        min_lines_count, options, encoding) of it or None if there is no such job. Attempt is the token of this claim
+        for set_progress, heartbeat and finish."""
+        return self._transaction(self._claim)
+
+    def _claim(self, connection):
+        now = self._time()
+        while True:
+            row = connection.execute('SELECT id, diff_text, min_lines_count, options, encoding, attempts FROM jobs '
+                                     'WHERE status = ? OR (status = ? AND updated_at <= ?) ORDER BY created_at LIMIT 1',
+                                     (QUEUED, RUNNING, now - self.stale_seconds)).fetchone()
+            if row is None:
+                return None
+            job_id, diff_text, min_lines_count, options, encoding, attempts = row
+            if attempts >= self.max_attempts:
+                connection.execute('UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                                   (FAILED, f'Detection did not finish in {attempts} attempts', now, job_id))
+                continue
+            connection.execute('UPDATE jobs SET status = ?, attempts = ?, updated_at = ? WHERE id = ?',
+                               (RUNNING, attempts + 1, now, job_id))
+            return job_id, attempts + 1, diff_text, min_lines_count, json.loads(options), json.loads(encoding)
+
+    def _update_running(self, job_id, attempt, **columns):
+        """Set columns (and updated_at) of the job if attempt is still running it, return whether it was."""
+        assignments = ''.join(f'{name} = ?, ' for name in columns)
+        with self._lock:
+            cursor = self._db().execute(f'UPDATE jobs SET {assignments}updated_at = ? '
+                                        'WHERE id = ? AND attempts = ? AND status = ?',
+                                        (*columns.values(), self._time(), job_id, attempt, RUNNING))
+        return cursor.rowcount > 0
+
+    def set_progress(self, job_id, attempt, processed_lines, total_lines):
+        self._update_running(job_id, attempt, processed_lines=processed_lines, total_lines=total_lines)
+
+    def heartbeat(self, job_id, attempt):
+        """Keep the job of attempt from turning stale, return whether attempt is still running it."""
+        return self._update_running(job_id, attempt)
+
+    def finish(self, job_id, attempt, result=None, error=None):
+        """Store the result (or the error) of the job if attempt is still running it."""
+        if not self._update_running(job_id, attempt, status=DONE if error is None else FAILED, result=result,
+                                    error=error, diff_text=None):
+            logger.warning(f'Job {job_id} was claimed again or failed, result of attempt {attempt} is dropped')
+
+    def run(self, job_id, attempt, diff_text, min_lines_count, options, encoding):
+        """Detect moved blocks of a claimed job and store the result (or the error) in the queue, reporting
+        a heartbeat every heartbeat_seconds meanwhile."""
+        logger.info(f'Running job {job_id} (attempt {attempt})')
+        stop_heartbeat = threading.Event()
+        heartbeat_thread = threading.Thread(target=self._send_heartbeats, args=(job_id, attempt, stop_heartbeat),
+                                            daemon=True)
+        heartbeat_thread.start()
+        try:
+            detector = MovedBlocksDetector.from_diff(diff_text, **options)
+            blocks = detector.detect_moved_blocks(
+                min_lines_count,
+                progress=lambda processed, total: self.set_progress(job_id, attempt, processed, total))
+            result = serialization.blocks_to_json(blocks, **encoding)
+        except Exception as e:
+            logger.exception(f'Job {job_id} failed')
+            self.finish(job_id, attempt, error=repr(e))
+        else:
+            self.finish(job_id, attempt, result=result)
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+
+    def _send_heartbeats(self, job_id, attempt, stop):
+        while not stop.wait(self.heartbeat_seconds):
+            try:
+                if not self.heartbeat(job_id, attempt):
+                    return
+            except sqlite3.Error:
+                logger.exception(f'Heartbeat of job {job_id} failed')
+
+    def run_worker(self, poll_seconds=1.0):
+        """Run claimed jobs forever, wait poll_seconds when the queue is empty."""
+        self._lock = threading.Lock()  # the lock could be held by another thread of the process this one forked from
+        while True:
+            job = self.claim()
+            if job is None:
+                time.sleep(poll_seconds)
+            else:
+                self.run(*job)
+
+
+class JobWorkers(object):
+    """Processes running jobs of a JobQueue, started with the first job (or on start if there are unfinished jobs).
+
+    Workers are daemon processes, so they end with the process which started them.
+    """
+
+    def __init__(self, queue: JobQueue, count=1, poll_seconds=1.0):
+        self.queue = queue
+        self.count = count
+        self.poll_seconds = poll_seconds
+        self.processes = []
+        self._lock = threading.Lock()
+        if queue.has_unfinished_jobs():
+            self.ensure_started()
+
+    def ensure_started(self):
+        with self._lock:
+            self.processes = [process for process in self.processes if process.is_alive()]
+            while len(self.processes) < self.count:
+                process = multiprocessing.get_context('fork').Process(target=self.queue.run_worker,
+                                                                      args=(self.poll_seconds,), daemon=True)
+                process.start()
+                logger.info(f'Started job worker pid={process.pid}')
+                self.processes.append(process)
+
+
+def _create_tables(connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                       'id TEXT PRIMARY KEY, status TEXT, diff_text TEXT, min_lines_count INTEGER, options TEXT, '
+                       'encoding TEXT, processed_lines INTEGER, total_lines INTEGER, result BLOB, error TEXT, '
+                       'attempts INTEGER, created_at REAL, updated_at REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)')
@@ -1,16 +1,52 @@
 import json
 import logging
+import os
+import tempfile
 from textwrap import dedent
 
 import falcon
 
-from detector import MovedBlocksDetector
+import metrics
+import serialization
+import similarity
+import transport
+from budget import DetectionBudget
+from detector import MovedBlocksDetector, diff_to_lines
+from diff_parser import DiffParseError
+from gram_index import GramIndex
+from incremental import DetectionStateStore
+from jobs import DONE, JobQueue, JobWorkers
+from result_cache import ResultCache
 from setup_logging import setup_logging
+from time_utils import MeasureTime, collect_durations
 
 setup_logging()
 
 logger = logging.getLogger(__name__)
 
+DETECTION_PROCESSES = 'DETECTION_PROCESSES'
+RESULT_CACHE_MEMORY_BYTES = 'RESULT_CACHE_MEMORY_BYTES'
+RESULT_CACHE_PATH = 'RESULT_CACHE_PATH'
+RESULT_CACHE_DISK_BYTES = 'RESULT_CACHE_DISK_BYTES'
+RESULT_CACHE_TTL_SECONDS = 'RESULT_CACHE_TTL_SECONDS'
+DETECTION_STATES_COUNT = 'DETECTION_STATES_COUNT'
+SIMILARITY_BACKEND = 'SIMILARITY_BACKEND'
+EXACT_ANCHORS = 'EXACT_ANCHORS'
+MAX_NEW_BLOCKS_PER_LINE = 'MAX_NEW_BLOCKS_PER_LINE'
+IDF_WEIGHTING = 'IDF_WEIGHTING'
+FILE_PAIR_FILTER = 'FILE_PAIR_FILTER'
+JOBS_PATH = 'JOBS_PATH'
+JOB_WORKERS = 'JOB_WORKERS'
+JOBS_TTL_SECONDS = 'JOBS_TTL_SECONDS'
+GRAM_INDEX_PATH = 'GRAM_INDEX_PATH'
+GRAM_INDEX_BYTES = 'GRAM_INDEX_BYTES'
+MAX_REQUEST_BYTES = 'MAX_REQUEST_BYTES'
+MAX_DIFF_BYTES = 'MAX_DIFF_BYTES'
+MAX_CHANGED_LINES = 'MAX_CHANGED_LINES'
+MAX_FUZZY_CANDIDATES = 'MAX_FUZZY_CANDIDATES'
+MAX_DETECTION_SECONDS = 'MAX_DETECTION_SECONDS'
+MAX_FILE_CHANGED_LINES = 'MAX_FILE_CHANGED_LINES'
+
 
 class CustomJsonEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -19,6 +55,45 @@ class CustomJsonEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def profiled_body(profile, body):
+    """Return JSON of profile and of result body - the response of a request with profile=1."""
+    return b'{"profile": ' + json.dumps(profile).encode('utf-8') + b', "result": ' + body + b'}'
+
+
+def set_degradations_header(resp, degradations):
+    """Set header listing steps the detection was degraded with because of its budget (see budget.py), if any."""
+    if degradations:
+        resp.set_header('X-Detection-Degraded', ', '.join(degradations))
+
+
+class CachedDetection(object):
+    """Result cache and profile handling of a detection request, shared by MovedBlocksResource of both servers.
+
+    body is the cached JSON of blocks or None if detection has to be done. With profile detection is done even if
+    the result is cached and the result is not cached. Steps detection was degraded with because of its budget are
+    listed in X-Detection-Degraded header, such a result is not cached.
+    """
+
+    def __init__(self, result_cache, cache_key, profile=False, pull_url=None):
+        self.result_cache = result_cache if not profile else None
+        self.cache_key = cache_key
+        self.profile = profile
+        self.body = self.result_cache.get(cache_key) if self.result_cache is not None else None
+        if self.body is not None:
+            logger.info(f"Returning cached result for PR: {pull_url}")
+
+    def set_detected(self, resp, body, degradations):
+        """Set JSON of blocks detected with degradations as body of the response and cache it if it can be."""
+        set_degradations_header(resp, degradations)
+        if self.result_cache is not None and not degradations:
+            self.result_cache.set(self.cache_key, body)
+        self.body = body
+
+    def response_body(self, detection_profile=None):
+        """Return body, with profile profiled_body of it and of detection_profile (see metrics.detection_profile)."""
+        return profiled_body(detection_profile, self.body) if self.profile else self.body
+
+
 class MainPageResource(object):
     def on_get(self, req, resp):
         resp.content_type = 'text/html'
@@ -38,25 +113,316 @@ class MainPageResource(object):
 
 
 class MovedBlocksResource(object):
+    def __init__(self, detection_processes=None, result_cache=None, detection_states=None,
+                 similarity_backend=similarity.DEFAULT_BACKEND, exact_anchors=False, detector_options=None,
+                 gram_index=None, budget_options=None, max_request_bytes=None):
+        """detector_options are other keyword arguments of MovedBlocksDetector used for every request.
+
+        budget_options are keyword arguments of DetectionBudget of every request (none if empty). Requests longer
+        than max_request_bytes are rejected before they are read."""
+        self.detection_processes = detection_processes
+        self.result_cache = result_cache
+        self.detection_states = detection_states
+        self.gram_index = gram_index
+        self.similarity_backend = similarity_backend
+        self.exact_anchors = exact_anchors
+        self.detector_options = detector_options or {}
+        self.budget_options = budget_options or {}
+        self.max_request_bytes = max_request_bytes
+
     def on_get(self, req, resp):
         resp.body = json.dumps({"message": "Hello world!"})
 
+    def create_budget(self):
+        return DetectionBudget(**self.budget_options) if self.budget_options else None
+
+    def check_request_size(self, req):
+        if self.max_request_bytes is not None and (req.content_length or 0) > self.max_request_bytes:
+            raise falcon.HTTPPayloadTooLarge(description=f'Request is longer than {self.max_request_bytes} bytes')
+
+    def detection_options(self, media):
+        """Return MovedBlocksDetector keyword arguments for request media."""
+        similarity_backend = media.get('similarity_backend') or self.similarity_backend
+        if similarity_backend not in similarity.BACKENDS:
+            raise falcon.HTTPBadRequest(title='Unknown similarity backend',
+                                        description=f'similarity_backend should be one of: '
+                                                    f'{", ".join(similarity.BACKENDS)}')
+        exact_anchors = bool(media.get('exact_anchors', self.exact_anchors))
+        return dict(similarity_backend=similarity_backend, exact_anchors=exact_anchors, **self.detector_options)
+
+    @staticmethod
+    def encoding_options(media):
+        """Return serialization.encode_blocks keyword arguments for request media."""
+        schema = media.get('schema') or serialization.FULL
+        if schema not in serialization.SCHEMAS:
+            raise falcon.HTTPBadRequest(title='Unknown schema',
+                                        description=f'schema should be one of: {", ".join(serialization.SCHEMAS)}')
+        return dict(schema=schema, edit_spans=bool(media.get('edit_spans', False)))
+
+    @staticmethod
+    def read_request(req):
+        """Return (fields of request, diff) of req, diff is text or iterator of lines (see transport.read_request)."""
+        if req.get_header('Content-Encoding') is None and not transport.is_diff_content_type(req.content_type):
+            return req.media, req.media.get('diff_text') or ''
+        try:
+            return transport.read_request(req.bounded_stream, req.content_type, req.get_header('Content-Encoding'),
+                                          req.params)
+        except transport.UnsupportedEncoding as e:
+            raise falcon.HTTPUnsupportedMediaType(description=str(e))
+        except transport.InvalidBody as e:
+            raise falcon.HTTPBadRequest(title='Invalid request body', description=str(e))
+
     def on_post(self, req, resp):
-        diff_text = req.media.get('diff_text')
-        pull_url = req.media.get('pull_request_url')
-        user_name = req.media.get('user_name')
-        min_lines_count = req.media.get('min_lines_count')
+        """With profile=1 query param detection is done even if the result is cached, the result is not cached and
+        the response is profiled_body of the request profile (see CachedDetection).
+
+        Steps detection was degraded with because of its budget are listed in X-Detection-Degraded header, such a
+        result is not cached."""
+        profile = req.get_param_as_bool('profile', default=False)
+        with collect_durations() as durations:
+            with MeasureTime('post_moved_blocks'):
+                detector, cached_detection = self.detect(req, resp, profile)
+        if cached_detection is None:
+            return  # streamed
+        detection_profile = None
+        if profile:
+            degradations = detector.budget.degradations if detector.budget is not None else ()
+            detection_profile = metrics.detection_profile(durations, detector.counts, degradations)
+        transport.set_data(req, resp, cached_detection.response_body(detection_profile))
+
+    @staticmethod
+    def cache_key_params(min_lines_count, options, encoding):
+        """Return params of ResultCache.make_key of a request, besides its diff."""
+        return min_lines_count, sorted(options.items()), sorted(encoding.items())
+
+    def detect(self, req, resp, profile=False):
+        """Return (detector or None if the result was cached, CachedDetection) of req or (None, None) if the body was
+        streamed to resp."""
+        self.check_request_size(req)
+        budget = self.create_budget()
+        media, diff = self.read_request(req)
+        pull_url = media.get('pull_request_url')
+        user_name = media.get('user_name')
+        min_lines_count = media.get('min_lines_count')
+        previous_result_token = media.get('previous_result_token')
+        options = self.detection_options(media)
+        encoding = self.encoding_options(media)
         logger.info(f"Received request for PR: {pull_url} for user: {user_name} with min_lines_count: {min_lines_count}")
-        detector = MovedBlocksDetector.from_diff(diff_text)
-        detected_blocks = detector.detect_moved_blocks(min_lines_count)
-        resp.body = json.dumps(detected_blocks, cls=CustomJsonEncoder)
+        key_params = self.cache_key_params(min_lines_count, options, encoding)
+        lines = None
+        if isinstance(diff, str):
+            cache_key = ResultCache.make_key(diff, *key_params)
+            result_token = ResultCache.make_key(diff)
+        else:
+            # keys of a raw diff are known only when all of it is read, so it is parsed before the cache is checked
+            digests = [ResultCache.key_digest(*key_params), ResultCache.key_digest()]
+            lines = self.parse_diff(transport.hashed_lines(diff, digests), budget)
+            cache_key, result_token = (digest.hexdigest() for digest in digests)
+        # only the default backend supports incremental detection
+        detection_states = (self.detection_states
+                            if options['similarity_backend'] == similarity.FuzzySetBackend.name else None)
+        cached_detection = CachedDetection(self.result_cache, cache_key, profile, pull_url)
+        detector = None
+        if cached_detection.body is None:
+            previous_state = None
+            if detection_states is not None and previous_result_token:
+                previous_state = detection_states.get(previous_result_token)
+                if previous_state is None:
+                    logger.info(f"No detection state for previous result token of PR: {pull_url}")
+            removed_lines, added_lines = lines if lines is not None else self.parse_diff(diff, budget)
+            detector = MovedBlocksDetector(removed_lines, added_lines, previous_state=previous_state,
+                                           keep_state=detection_states is not None, gram_index=self.gram_index,
+                                           budget=budget, **options)
+            detected_blocks = detector.detect_moved_blocks(min_lines_count, processes=self.detection_processes)
+            if detector.keep_state:
+                detection_states.set(result_token, detector.detection_state())
+            degradations = budget.degradations if budget is not None else []
+            if self.result_cache is None and not profile:
+                # nothing keeps the body, so it is streamed as it is encoded
+                set_degradations_header(resp, degradations)
+                resp.set_header('X-Result-Token', result_token)
+                transport.set_stream(req, resp, serialization.encode_blocks(detected_blocks, **encoding))
+                return None, None
+            cached_detection.set_detected(resp, serialization.blocks_to_json(detected_blocks, **encoding),
+                                          degradations)
+        # pass it as previous_result_token with the next version of the diff to reuse detection state
+        resp.set_header('X-Result-Token', result_token)
+        return detector, cached_detection
+
+    @staticmethod
+    def parse_diff(diff, budget=None):
+        try:
+            return diff_to_lines(diff, budget)
+        except transport.InvalidBody as e:
+            raise falcon.HTTPBadRequest(title='Invalid request body', description=str(e))
+        except DiffParseError as e:
+            raise falcon.HTTPBadRequest(title='Invalid diff', description=str(e))
+
+
+class JobsResource(object):
+    """Detection of large diffs as jobs: POST returns job to poll with JobResource and get result of from
+    JobResultResource. Options of detection and schema of the result are read from media as by moved_blocks_resource.
+
+    Requests longer than max_request_bytes of moved_blocks_resource are rejected, but jobs are deliberately not
+    limited by its budget_options: jobs are meant for diffs too large to be detected within the budget of a request.
+    """
+
+    def __init__(self, job_workers, moved_blocks_resource):
+        self.job_workers = job_workers
+        self.moved_blocks_resource = moved_blocks_resource
+
+    def on_post(self, req, resp):
+        self.moved_blocks_resource.check_request_size(req)
+        media, diff = self.moved_blocks_resource.read_request(req)
+        options = self.moved_blocks_resource.detection_options(media)
+        encoding = self.moved_blocks_resource.encoding_options(media)
+        logger.info(f"Received job for PR: {media.get('pull_request_url')} for user: {media.get('user_name')}")
+        try:
+            diff_text = diff if isinstance(diff, str) else ''.join(diff)
+        except transport.InvalidBody as e:
+            raise falcon.HTTPBadRequest(title='Invalid request body', description=str(e))
+        self.moved_blocks_resource.parse_diff(diff_text)  # an invalid diff is rejected now, not by its job
+        job = self.job_workers.queue.submit(diff_text, media.get('min_lines_count'), options, encoding)
+        self.job_workers.ensure_started()
+        resp.status = falcon.HTTP_202
+        resp.location = f'/moved-blocks/jobs/{job.job_id}'
+        resp.body = json.dumps(job.to_dict())
+
+
+class JobResource(object):
+    def __init__(self, job_queue):
+        self.job_queue = job_queue
+
+    def on_get(self, req, resp, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            raise falcon.HTTPNotFound(description=f'No job {job_id}')
+        resp.body = json.dumps(job.to_dict())
+
+
+class JobResultResource(object):
+    def __init__(self, job_queue):
+        self.job_queue = job_queue
+
+    def on_get(self, req, resp, job_id):
+        result = self.job_queue.result(job_id)
+        if result is None:
+            job = self.job_queue.get(job_id)
+            if job is None:
+                raise falcon.HTTPNotFound(description=f'No job {job_id}')
+            raise falcon.HTTPConflict(title=f'Job is {job.status}', description=job.error or f'Job is not {DONE}')
+        transport.set_data(req, resp, result)
+
+
+class MetricsResource(object):
+    def on_get(self, req, resp):
+        resp.content_type = metrics.CONTENT_TYPE
+        resp.body = metrics.render()
+
+
+class CacheStatsResource(object):
+    def __init__(self, result_cache):
+        self.result_cache = result_cache
+
+    def on_get(self, req, resp):
+        resp.body = json.dumps(self.result_cache.stats())
+
+
+def create_result_cache():
+    return ResultCache(
+        max_memory_bytes=int(os.getenv(RESULT_CACHE_MEMORY_BYTES, 64 * 1024 * 1024)),
+        disk_path=os.getenv(RESULT_CACHE_PATH),
+        max_disk_bytes=int(os.getenv(RESULT_CACHE_DISK_BYTES, 1024 * 1024 * 1024)),
+        ttl_seconds=int(os.getenv(RESULT_CACHE_TTL_SECONDS, 24 * 60 * 60)),
+    )
+
+
+def create_detection_states():
+    """Return store of detection states for incremental detection or None if it is disabled (count is 0, by
+    default).
+
+    States are kept in memory of each gunicorn worker, so they are reused only by requests hitting the same one.
+    """
+    max_count = int(os.getenv(DETECTION_STATES_COUNT, 0))
+    return DetectionStateStore(max_count) if max_count > 0 else None
+
+
+def create_detector_options():
+    max_new_blocks_per_line = os.getenv(MAX_NEW_BLOCKS_PER_LINE)
+    return {
+        'max_new_blocks_per_line': int(max_new_blocks_per_line) if max_new_blocks_per_line else None,
+        'idf_weighting': os.getenv(IDF_WEIGHTING, '0') == '1',
+        'file_pair_filter': os.getenv(FILE_PAIR_FILTER, '0') == '1',
+    }
+
+
+def create_budget_options():
+    """Return DetectionBudget keyword arguments of budgets which are set (see budget.py), by default there are none."""
+    options = {}
+    for env_name, name, value_type in ((MAX_DIFF_BYTES, 'max_diff_bytes', int),
+                                       (MAX_CHANGED_LINES, 'max_changed_lines', int),
+                                       (MAX_FUZZY_CANDIDATES, 'max_fuzzy_candidates', int),
+                                       (MAX_DETECTION_SECONDS, 'max_seconds', float),
+                                       (MAX_FILE_CHANGED_LINES, 'max_file_changed_lines', int)):
+        value = os.getenv(env_name)
+        if value:
+            options[name] = value_type(value)
+    return options
+
+
+def create_max_request_bytes():
+    max_request_bytes = os.getenv(MAX_REQUEST_BYTES)
+    return int(max_request_bytes) if max_request_bytes else None
+
+
+def create_gram_index():
+    """Return GramIndex shared by all workers or None if it is disabled (no path is set)."""
+    path = os.getenv(GRAM_INDEX_PATH)
+    if not path:
+        return None
+    return GramIndex(path, max_bytes=int(os.getenv(GRAM_INDEX_BYTES, 256 * 1024 * 1024)))
+
+
+def create_job_workers():
+    """Return JobWorkers of the jobs file or None if jobs are disabled (workers count is 0, the default)."""
+    count = int(os.getenv(JOB_WORKERS, 0))
+    if count <= 0:
+        return None
+    queue = JobQueue(os.getenv(JOBS_PATH, os.path.join(tempfile.gettempdir(), 'reviewraccoon-jobs.sqlite')),
+                     ttl_seconds=int(os.getenv(JOBS_TTL_SECONDS, 24 * 60 * 60)))
+    return JobWorkers(queue, count)
 
 
 def create_api():
+    result_cache = create_result_cache()
     api = falcon.API()
     api.add_route('/', MainPageResource())
-    api.add_route('/moved-blocks', MovedBlocksResource())
+    moved_blocks_resource = MovedBlocksResource(detection_processes=int(os.getenv(DETECTION_PROCESSES, 1)),
+                                                result_cache=result_cache,
+                                                detection_states=create_detection_states(),
+                                                similarity_backend=os.getenv(SIMILARITY_BACKEND,
+                                                                             similarity.DEFAULT_BACKEND),
+                                                exact_anchors=os.getenv(EXACT_ANCHORS, '0') == '1',
+                                                detector_options=create_detector_options(),
+                                                gram_index=create_gram_index(),
+                                                budget_options=create_budget_options(),
+                                                max_request_bytes=create_max_request_bytes())
+    api.add_route('/moved-blocks', moved_blocks_resource)
+    job_workers = create_job_workers()
+    if job_workers is not None:
+        api.add_route('/moved-blocks/jobs', JobsResource(job_workers, moved_blocks_resource))
+        api.add_route('/moved-blocks/jobs/{job_id}', JobResource(job_workers.queue))
+        api.add_route('/moved-blocks/jobs/{job_id}/result', JobResultResource(job_workers.queue))
+    api.add_route('/cache-stats', CacheStatsResource(result_cache))
+    api.add_route('/metrics', MetricsResource())
     return api
 
 
-app = create_api()
+def __getattr__(name):
+    """Create app on the first access of main.app (as gunicorn main:app does), so modules importing main for its
+    resources and helpers (like main_asgi) do not create the WSGI app with its caches and job workers."""
+    global app
+    if name == 'app':
+        app = create_api()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,202 @@
+"""ASGI variant of the API in main.py, run it with an ASGI server, e.g.:
+    gunicorn main_asgi:app --worker-class uvicorn.workers.UvicornWorker --workers 1
+
+Requests are read on the event loop and detection runs in pools of worker processes, so a long detection does not
+hold the server. Diffs smaller than ASGI_SMALL_DIFF_BYTES have a pool of their own and never wait behind large ones.
+A request is rejected with 429 when all workers of its pool are busy and ASGI_MAX_QUEUED_DETECTIONS detections are
+already waiting for them, and with 503 when its detection does not finish in ASGI_DETECTION_TIMEOUT_SECONDS.
+
+Detection states are not kept, as they would live in memory of the worker which did the detection, so every
+detection is a full one (see main.create_detection_states). The gram index (see main.create_gram_index) is a file,
+so it is shared by the workers. Profiles of detections are returned by the workers and observed in metrics of the
+app process. Budgets of detections (see main.create_budget_options) start when a worker takes the detection.
+"""
+import asyncio
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import falcon
+import falcon.asgi
+
+import main
+import metrics
+import serialization
+import similarity
+import transport
+from budget import DetectionBudget
+from detector import MovedBlocksDetector
+from diff_parser import DiffParseError
+from result_cache import ResultCache
+from time_utils import collect_durations
+
+logger = logging.getLogger(__name__)
+
+ASGI_DETECTION_WORKERS = 'ASGI_DETECTION_WORKERS'
+ASGI_SMALL_DIFF_WORKERS = 'ASGI_SMALL_DIFF_WORKERS'
+ASGI_SMALL_DIFF_BYTES = 'ASGI_SMALL_DIFF_BYTES'
+ASGI_MAX_QUEUED_DETECTIONS = 'ASGI_MAX_QUEUED_DETECTIONS'
+ASGI_DETECTION_TIMEOUT_SECONDS = 'ASGI_DETECTION_TIMEOUT_SECONDS'
+
+
+def detect_moved_blocks_json(diff_text, min_lines_count, options, encoding=None, gram_index=None,
+                             budget_options=None):
+    """Return (JSON of blocks detected in diff_text, profile of detection - see metrics.detection_profile), blocks are
+    serialized in the worker, not pickled back.
+
+    encoding are keyword arguments of serialization.blocks_to_json, budget_options of DetectionBudget.
+    """
+    budget = DetectionBudget(**budget_options) if budget_options else None
+    with collect_durations() as durations:
+        detector = MovedBlocksDetector.from_diff(diff_text, gram_index=gram_index, budget=budget, **options)
+        body = serialization.blocks_to_json(detector.detect_moved_blocks(min_lines_count), **(encoding or {}))
+    return body, metrics.detection_profile(durations, detector.counts, budget.degradations if budget else ())
+
+
+class PoolFull(Exception):
+    pass
+
+
+class DetectionPool(object):
+    """Pool of workers processes running at most max_queued more tasks than workers at once (the rest wait)."""
+
+    def __init__(self, workers, max_queued, timeout_seconds):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.timeout_seconds = timeout_seconds
+        self.executor = ProcessPoolExecutor(workers)
+        # running and waiting tasks, a task which timed out counts until its worker finishes it
+        self.pending = 0
+        self._pending_lock = threading.Lock()  # tasks are done in a thread of the executor
+
+    async def run(self, fun, *args):
+        """Return fun(*args) run in a worker, raise PoolFull if too many tasks are pending or asyncio.TimeoutError.
+
+        A task which timed out before a worker took it is cancelled.
+        """
+        with self._pending_lock:
+            if self.pending >= self.workers + self.max_queued:
+                raise PoolFull()
+            self.pending += 1
+        future = self.executor.submit(fun, *args)
+        future.add_done_callback(self._task_done)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout_seconds)
+
+    def _task_done(self, _future):
+        with self._pending_lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class MainPageResource(main.MainPageResource):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class CacheStatsResource(main.CacheStatsResource):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class MetricsResource(main.MetricsResource):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class MovedBlocksResource(main.MovedBlocksResource):
+    def __init__(self, small_diff_pool, large_diff_pool, small_diff_bytes, **kwargs):
+        super().__init__(**kwargs)
+        self.small_diff_pool = small_diff_pool
+        self.large_diff_pool = large_diff_pool
+        self.small_diff_bytes = small_diff_bytes
+
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+    async def read_request(self, req):
+        """Return (fields of request, diff text) of req, a compressed or raw diff is read whole first."""
+        if req.get_header('Content-Encoding') is None and not transport.is_diff_content_type(req.content_type):
+            media = await req.get_media()
+            return media, media.get('diff_text') or ''
+        body = io.BytesIO(await req.stream.read())
+        try:
+            media, diff = transport.read_request(body, req.content_type, req.get_header('Content-Encoding'),
+                                                 req.params)
+            return media, diff if isinstance(diff, str) else ''.join(diff)
+        except transport.UnsupportedEncoding as e:
+            raise falcon.HTTPUnsupportedMediaType(description=str(e))
+        except transport.InvalidBody as e:
+            raise falcon.HTTPBadRequest(title='Invalid request body', description=str(e))
+
+    async def on_post(self, req, resp):
+        """profile=1 query param works as in main.MovedBlocksResource.on_post."""
+        profile = req.get_param_as_bool('profile', default=False)
+        self.check_request_size(req)
+        media, diff_text = await self.read_request(req)
+        pull_url = media.get('pull_request_url')
+        min_lines_count = media.get('min_lines_count')
+        options = self.detection_options(media)
+        encoding = self.encoding_options(media)
+        logger.info(f"Received request for PR: {pull_url} for user: {media.get('user_name')} "
+                    f"with min_lines_count: {min_lines_count}")
+        cache_key = ResultCache.make_key(diff_text, *self.cache_key_params(min_lines_count, options, encoding))
+        cached_detection = main.CachedDetection(self.result_cache, cache_key, profile, pull_url)
+        detection_profile = None
+        if cached_detection.body is None:
+            pool = self.small_diff_pool if len(diff_text) < self.small_diff_bytes else self.large_diff_pool
+            try:
+                body, detection_profile = await pool.run(detect_moved_blocks_json, diff_text, min_lines_count, options,
+                                                         encoding, self.gram_index, self.budget_options)
+            except PoolFull:
+                logger.info(f"Too many detections pending, rejected PR: {pull_url}")
+                raise falcon.HTTPTooManyRequests(description='Too many detections are pending, try again later',
+                                                 retry_after=1)
+            except asyncio.TimeoutError:
+                logger.info(f"Detection timed out for PR: {pull_url}")
+                raise falcon.HTTPServiceUnavailable(title='Detection timed out',
+                                                    description=f'Detection took more than {pool.timeout_seconds} s')
+            except DiffParseError as e:
+                raise falcon.HTTPBadRequest(title='Invalid diff', description=str(e))
+            metrics.observe_profile(detection_profile)
+            cached_detection.set_detected(resp, body, detection_profile['degradations'])
+        transport.set_data(req, resp, cached_detection.response_body(detection_profile))
+
+
+class DetectionPoolsShutdown(object):
+    def __init__(self, pools):
+        self.pools = pools
+
+    async def process_shutdown(self, scope, event):
+        for pool in self.pools:
+            pool.shutdown()
+
+
+def create_api():
+    result_cache = main.create_result_cache()
+    timeout_seconds = float(os.getenv(ASGI_DETECTION_TIMEOUT_SECONDS, 60))
+    max_queued = int(os.getenv(ASGI_MAX_QUEUED_DETECTIONS, 8))
+    small_diff_pool = DetectionPool(int(os.getenv(ASGI_SMALL_DIFF_WORKERS, 1)), max_queued, timeout_seconds)
+    large_diff_pool = DetectionPool(int(os.getenv(ASGI_DETECTION_WORKERS, os.cpu_count() or 1)), max_queued,
+                                    timeout_seconds)
+    api = falcon.asgi.App(middleware=[DetectionPoolsShutdown([small_diff_pool, large_diff_pool])])
+    api.add_route('/', MainPageResource())
+    api.add_route('/moved-blocks', MovedBlocksResource(small_diff_pool, large_diff_pool,
+                                                       int(os.getenv(ASGI_SMALL_DIFF_BYTES, 64 * 1024)),
+                                                       result_cache=result_cache,
+                                                       similarity_backend=os.getenv(main.SIMILARITY_BACKEND,
+                                                                                    similarity.DEFAULT_BACKEND),
+                                                       exact_anchors=os.getenv(main.EXACT_ANCHORS, '0') == '1',
+                                                       detector_options=main.create_detector_options(),
+                                                       gram_index=main.create_gram_index(),
+                                                       budget_options=main.create_budget_options(),
+                                                       max_request_bytes=main.create_max_request_bytes()))
+    api.add_route('/cache-stats', CacheStatsResource(result_cache))
+    api.add_route('/metrics', MetricsResource())
+    return api
+
+
+app = create_api()
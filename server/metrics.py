@@ -0,0 +1,136 @@
+"""Metrics of request handling and detection, rendered in Prometheus text format by the /metrics endpoint.
+
+* reviewraccoon_stage_seconds - histogram of durations of stages measured by time_utils (measure_fun_time and
+  MeasureTime), by stage,
+* reviewraccoon_stage_errors_total - stages which raised an exception, by stage,
+* reviewraccoon_detection_count - histogram of counts of one detection (lines, fuzzy matches, blocks created,
+  merged and filtered, join loops - see MovedBlocksDetector.counts), by count,
+* reviewraccoon_degraded_detections_total - detections degraded because of a budget, by step (see budget.py).
+
+Metrics are kept in memory of each process, i.e. every gunicorn worker exposes its own ones. Stages run in forked
+processes (parallel detection, jobs) are not observed, the ASGI app observes stages of its detection workers
+with observe_profile.
+"""
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+
+
+def _label_values(label_name, value):
+    escaped_value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return f'{label_name}="{escaped_value}"'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name, documentation, label_name):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label, amount=1):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def value(self, label):
+        return self._values.get(label, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{_label_values(self.label_name, label)}}} {_number(value)}')
+        return lines
+
+
+class Histogram(object):
+    """Histogram with cumulative buckets of upper bounds (+Inf is added) by value of one label."""
+
+    def __init__(self, name, documentation, label_name, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}  # label -> [counts of buckets (not cumulative), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            values = self._values.get(label)
+            if values is None:
+                values = self._values[label] = [[0] * len(self.buckets), 0]
+            values[0][next(i for i, bound in enumerate(self.buckets) if value <= bound)] += 1
+            values[1] += value
+
+    def count(self, label):
+        values = self._values.get(label)
+        return sum(values[0]) if values is not None else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label, (bucket_counts, total) in sorted(self._values.items()):
+                label_values = _label_values(self.label_name, label)
+                cumulative_count = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(f'{self.name}_bucket{{{label_values},le="{_number(bound)}"}} {cumulative_count}')
+                lines.append(f'{self.name}_sum{{{label_values}}} {_number(total)}')
+                lines.append(f'{self.name}_count{{{label_values}}} {cumulative_count}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('reviewraccoon_stage_seconds', 'Duration of stages of request handling and detection.',
+                          'stage', SECONDS_BUCKETS)
+STAGE_ERRORS = Counter('reviewraccoon_stage_errors_total', 'Stages which raised an exception.', 'stage')
+DETECTION_COUNT = Histogram('reviewraccoon_detection_count', 'Counts of lines, matches and blocks of one detection.',
+                            'count', COUNT_BUCKETS)
+DEGRADED_DETECTIONS = Counter('reviewraccoon_degraded_detections_total', 'Detections degraded because of a budget.',
+                              'step')
+METRICS = [STAGE_SECONDS, STAGE_ERRORS, DETECTION_COUNT, DEGRADED_DETECTIONS]
+
+
+def observe_stage(stage, seconds, failed=False):
+    STAGE_SECONDS.observe(stage, seconds)
+    if failed:
+        STAGE_ERRORS.inc(stage)
+
+
+def observe_counts(counts):
+    for name, value in counts.items():
+        DETECTION_COUNT.observe(name, value)
+
+
+def observe_degradations(degradations):
+    for step in degradations:
+        DEGRADED_DETECTIONS.inc(step)
+
+
+def detection_profile(durations, counts, degradations=()):
+    """Return profile of a detection: total seconds of its stages (see time_utils.collect_durations), counts of
+    the detector (see MovedBlocksDetector.counts) and steps it was degraded with (see budget.py)."""
+    return {'seconds': {stage: round(seconds, 6) for stage, seconds in sorted(durations.items())},
+            'counts': dict(counts), 'degradations': list(degradations)}
+
+
+def observe_profile(profile):
+    """Observe profile (see detection_profile) of a detection run in another process."""
+    for stage, seconds in profile['seconds'].items():
+        observe_stage(stage, seconds)
+    observe_counts(profile['counts'])
+    observe_degradations(profile['degradations'])
+
+
+def render():
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
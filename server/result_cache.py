@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_connection import ProcessConnection
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache(object):
+    """Cache of serialized detection results keyed by hash of the request (diff text and parameters).
+
+    It has two tiers:
+    * in-process LRU limited by total size of cached values (max_memory_bytes),
+    * optional sqlite file (disk_path) shared by all gunicorn workers on the host, limited by max_disk_bytes -
+      least recently used entries are evicted when the limit is exceeded.
+    Entries of both tiers expire after ttl_seconds.
+    """
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, disk_path=None, max_disk_bytes=1024 * 1024 * 1024,
+                 ttl_seconds=24 * 60 * 60, time_function=time.time):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._time = time_function
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._connection = ProcessConnection(disk_path, _create_tables) if disk_path is not None else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(diff_text, *params):
+        digest = ResultCache.key_digest(*params)
+        digest.update(diff_text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def key_digest(*params):
+        """Return hash of params to update with the diff text encoded as make_key does, e.g. line by line."""
+        digest = hashlib.sha256()
+        digest.update(repr(params).encode('utf-8'))
+        digest.update(b'\0')
+        return digest
+
+    def get(self, key):
+        now = self._time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                self._remove_from_memory(key)
+
+        entry = self._get_from_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        expires_at, value = entry
+        self._set_in_memory(key, value, expires_at)
+        return value
+
+    def set(self, key, value: bytes):
+        expires_at = self._time() + self.ttl_seconds
+        self._set_in_memory(key, value, expires_at)
+        self._set_on_disk(key, value, expires_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+            }
+
+    def _remove_from_memory(self, key):
+        _, value = self._memory.pop(key)
+        self._memory_bytes -= len(value)
+
+    def _set_in_memory(self, key, value, expires_at):
+        if len(value) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._remove_from_memory(key)
+            self._memory[key] = (expires_at, value)
+            self._memory_bytes += len(value)
+            while self._memory_bytes > self.max_memory_bytes:
+                self._remove_from_memory(next(iter(self._memory)))
+
+    def _disk(self):
+        """Return sqlite connection of this process or None without disk_path."""
+        return self._connection.get() if self._connection is not None else None
+
+    def _get_from_disk(self, key, now):
+        """Return (expires_at, value) of not expired entry of key or None."""
+        try:
+            with self._lock:
+                connection = self._disk()
+                if connection is None:
+                    return None
+                row = connection.execute('SELECT expires_at, value FROM results WHERE key = ? AND expires_at > ?',
+                                         (key, now)).fetchone()
+                if row is None:
+                    return None
+                connection.execute('UPDATE results SET last_access = ? WHERE key = ?', (now, key))
+                return row
+        except sqlite3.Error:
+            logger.exception('Reading result cache from disk failed')
+            return None
+
+    def _set_on_disk(self, key, value, expires_at):
+        if self.disk_path is None or len(value) > self.max_disk_bytes:
+            return
+        now = self._time()
+        try:
+            with self._lock:
+                connection = self._disk()
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                       (key, value, len(value), expires_at, now))
+                    self._evict_from_disk(connection, now)
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error:
+            logger.exception('Writing result cache to disk failed')
+
+    def _evict_from_disk(self, connection, now):
+        connection.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+        total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total_size <= self.max_disk_bytes:
+            return
+        evicted_keys = []
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY last_access'):
+            if total_size <= self.max_disk_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        connection.executemany('DELETE FROM results WHERE key = ?', evicted_keys)
+
+
+def _create_tables(connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                       'key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires_at REAL, last_access REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS results_last_access ON results(last_access)')
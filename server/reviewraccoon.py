@@ -0,0 +1,120 @@
+"""Command line interface of detection for batch and CI use, run it from the server directory:
+    python -m reviewraccoon detect path.diff --output blocks.json
+    python -m reviewraccoon batch path/of/diffs --output results.jsonl
+
+detect writes blocks as JSON in the format of responses of the /moved-blocks endpoint (to stdout by default).
+The diff file is memory-mapped and parsed line by line (see diff_parser.iterate_binary_lines), so neither the file
+nor the text of the whole diff is read into memory. Path - reads the diff from stdin.
+
+batch detects every diff of a directory or a tar archive in a pool of processes and writes a line of JSON with
+blocks and profile of each of them (see batch.py).
+"""
+import argparse
+import contextlib
+import logging
+import sys
+
+import batch
+import serialization
+import similarity
+from detector import MovedBlocksDetector, diff_to_lines
+from diff_parser import DiffParseError, iterate_binary_lines, open_diff_file
+from gram_index import GramIndex
+from setup_logging import LOG_DATE_FORMAT, LOG_FORMAT
+
+STDIN_PATH = '-'
+
+
+def open_diff(path):
+    """Return context manager of binary stream of the diff file at path (see diff_parser.open_diff_file)."""
+    if path == STDIN_PATH:
+        return contextlib.nullcontext(sys.stdin.buffer)
+    return open_diff_file(path)
+
+
+def detector_options(args):
+    """Return MovedBlocksDetector keyword arguments (but gram_index) of parsed arguments."""
+    return dict(similarity_backend=args.similarity_backend, exact_anchors=args.exact_anchors,
+                max_new_blocks_per_line=args.max_new_blocks_per_line, idf_weighting=args.idf_weighting,
+                file_pair_filter=args.file_pair_filter)
+
+
+def encoding_options(args):
+    """Return serialization.encode_blocks keyword arguments of parsed arguments."""
+    return dict(schema=args.schema, edit_spans=args.edit_spans)
+
+
+def detect(args):
+    with open_diff(args.diff) as stream:
+        removed_lines, added_lines = diff_to_lines(iterate_binary_lines(stream))
+    gram_index = GramIndex(args.gram_index) if args.gram_index else None
+    detector = MovedBlocksDetector(removed_lines, added_lines, gram_index=gram_index, **detector_options(args))
+    detected_blocks = detector.detect_moved_blocks(args.min_lines_count, processes=args.processes)
+    chunks = serialization.encode_blocks(detected_blocks, **encoding_options(args))
+    with contextlib.ExitStack() as stack:
+        output = stack.enter_context(open(args.output, 'wb')) if args.output else sys.stdout.buffer
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
+
+
+def detect_batch(args):
+    done_count, failed_count = batch.run_batch(args.corpus, args.output, options=detector_options(args),
+                                               min_lines_count=args.min_lines_count, encoding=encoding_options(args),
+                                               processes=args.processes, resume=args.resume,
+                                               gram_index_path=args.gram_index, with_blocks=not args.no_blocks)
+    print(f'Detected {done_count} diffs, {failed_count} failed', file=sys.stderr)
+
+
+def add_detection_arguments(parser):
+    parser.add_argument('--min-lines-count', type=int)
+    parser.add_argument('--similarity-backend', choices=similarity.BACKENDS, default=similarity.DEFAULT_BACKEND)
+    parser.add_argument('--exact-anchors', action='store_true')
+    parser.add_argument('--max-new-blocks-per-line', type=int)
+    parser.add_argument('--idf-weighting', action='store_true')
+    parser.add_argument('--file-pair-filter', action='store_true',
+                        help='match lines only of files which can share moved blocks (see file_pairs.py)')
+    parser.add_argument('--schema', choices=serialization.SCHEMAS, default=serialization.FULL)
+    parser.add_argument('--edit-spans', action='store_true')
+    parser.add_argument('--gram-index', help='path of the gram index file (see gram_index.py)')
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='reviewraccoon', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--verbose', action='store_true', help='log progress of detection to stderr')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    detect_parser = commands.add_parser('detect', help='detect moved blocks of a diff file')
+    detect_parser.set_defaults(command_function=detect)
+    detect_parser.add_argument('diff', help=f'path of the diff file, {STDIN_PATH} for stdin')
+    detect_parser.add_argument('--output', help='path of the JSON file to write (stdout by default)')
+    detect_parser.add_argument('--processes', type=int, default=1, help='processes of parallel detection')
+    add_detection_arguments(detect_parser)
+
+    batch_parser = commands.add_parser('batch', help='detect moved blocks of every diff of a directory or tar archive')
+    batch_parser.set_defaults(command_function=detect_batch)
+    batch_parser.add_argument('corpus', help='path of the directory or tar archive of diffs')
+    batch_parser.add_argument('--output', required=True, help='path of the JSON lines file to write')
+    batch_parser.add_argument('--processes', type=int, help='worker processes (number of CPUs by default)')
+    batch_parser.add_argument('--resume', action='store_true',
+                              help='skip diffs which are in the output file and append to it')
+    batch_parser.add_argument('--no-blocks', action='store_true', help='write only profiles of detections')
+    add_detection_arguments(batch_parser)
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format=LOG_FORMAT,
+                        datefmt=LOG_DATE_FORMAT, stream=sys.stderr)
+    try:
+        args.command_function(args)
+    except (DiffParseError, OSError) as e:
+        print(f'reviewraccoon: error: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Serialization of detected blocks to JSON chunks, written straight from line tables of blocks.
+
+Two schemas are supported:
+* full - the same bytes as json.dumps(blocks, cls=main.CustomJsonEncoder), every line with its file and text,
+* compact - a table of files and for every block runs of line numbers, texts are left out (the extension has them
+  on the page already):
+    {"files": [file, ...],
+     "blocks": [{"removed_file": index in files, "added_file": index in files,
+                 "runs": [[first removed line_no, first added line_no, lines count], ...],
+                 "match_probabilities": [probability of each line of the runs, ...]}, ...]}
+  Line numbers of a run grow by one on each line, a side without lines in a run (the block was extended with an
+  empty line on the other one) has null instead of the first line_no. Probabilities are rounded to 3 digits.
+
+With edit_spans, lines matched with probability lower than 1 have edit spans of their texts (see intraline.py) -
+in "edit_spans" of lines in full schema and in "edit_spans" of blocks (null for other lines) in compact one.
+
+Compact schema is encoded with orjson if it is installed.
+"""
+import json
+from json.encoder import encode_basestring_ascii
+
+import intraline
+from time_utils import measure_fun_time
+
+try:
+    import orjson
+except ImportError:  # json module is used instead
+    orjson = None
+
+FULL = 'full'
+COMPACT = 'compact'
+SCHEMAS = (FULL, COMPACT)
+
+# Encoded blocks are yielded in chunks of about this size.
+CHUNK_BYTES = 64 * 1024
+
+
+def encode_blocks(blocks, schema=FULL, edit_spans=False):
+    """Return iterator of bytes chunks of JSON of blocks in schema."""
+    if schema not in SCHEMAS:
+        raise ValueError(f'Unknown schema: {schema}, available ones are: {", ".join(SCHEMAS)}')
+    spans = intraline.edit_spans_of_blocks(blocks) if edit_spans else None
+    if schema == FULL:
+        return _chunks(_full_parts(blocks, spans))
+    return _chunks(_compact_parts(blocks, spans))
+
+
+@measure_fun_time()
+def blocks_to_json(blocks, schema=FULL, edit_spans=False):
+    """Return JSON of blocks in schema as bytes."""
+    return b''.join(encode_blocks(blocks, schema, edit_spans))
+
+
+def _chunks(parts):
+    chunk = []
+    size = 0
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+        if size >= CHUNK_BYTES:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+def _number(value):
+    # like json module, which does not call repr of float subclasses (e.g. numpy.float64)
+    return float.__repr__(value) if isinstance(value, float) else int.__repr__(value)
+
+
+class _LineEncoder(object):
+    """Encodes lines of a table as Line.to_dict does, with JSON of files encoded once."""
+
+    def __init__(self, table):
+        self.table = table
+        self.files = [encode_basestring_ascii(file) for file in table.files]
+        self.text = table.text
+
+    def encode(self, index):
+        table = self.table
+        start = table.text_offsets[index]
+        trim_text_start = start + table.leading_whitespaces_lengths[index]
+        return (f'{{"file": {self.files[table.file_ids[index]]}, "line_no": {table.line_nos[index]}, '
+                f'"leading_whitespaces": {encode_basestring_ascii(self.text[start:trim_text_start])}, '
+                f'"trim_text": {encode_basestring_ascii(self.text[trim_text_start:table.text_offsets[index + 1]])}}}')
+
+
+def _full_parts(blocks, spans):
+    line_encoders = {}
+
+    def line_encoder(table):
+        encoder = line_encoders.get(id(table))
+        if encoder is None:
+            encoder = line_encoders[id(table)] = _LineEncoder(table)
+        return encoder
+
+    yield '['
+    for block_number, block in enumerate(blocks):
+        removed_encoder = line_encoder(block.removed_table)
+        added_encoder = line_encoder(block.added_table)
+        lines = []
+        for line_number, (removed_index, added_index, match_probability) in enumerate(
+                zip(block.removed_indexes, block.added_indexes, block.match_probabilities)):
+            added_line = added_encoder.encode(added_index) if added_index != -1 else 'null'
+            removed_line = removed_encoder.encode(removed_index) if removed_index != -1 else 'null'
+            line_spans = spans[block_number][line_number] if spans is not None else None
+            spans_json = f', "edit_spans": {json.dumps(line_spans)}' if line_spans is not None else ''
+            lines.append(f'{{"added_line": {added_line}, "removed_line": {removed_line}, '
+                         f'"match_probability": {_number(match_probability)}{spans_json}}}')
+        yield f'{", " if block_number else ""}{{"lines": [{", ".join(lines)}]}}'
+    yield ']'
+
+
+def compact_block(block, file_indexes):
+    """Return dict of block in compact schema, files missing in file_indexes (file -> index) are added to it."""
+    runs = []
+    removed_line_nos = block.removed_table.line_nos
+    added_line_nos = block.added_table.line_nos
+    previous = None
+    for removed_index, added_index in zip(block.removed_indexes, block.added_indexes):
+        removed_line_no = removed_line_nos[removed_index] if removed_index != -1 else None
+        added_line_no = added_line_nos[added_index] if added_index != -1 else None
+        if (previous is not None
+                and (removed_line_no is None) == (previous[0] is None)
+                and (added_line_no is None) == (previous[1] is None)
+                and (removed_line_no is None or removed_line_no == previous[0] + previous[2])
+                and (added_line_no is None or added_line_no == previous[1] + previous[2])):
+            previous[2] += 1
+        else:
+            previous = [removed_line_no, added_line_no, 1]
+            runs.append(previous)
+    return {
+        'removed_file': file_indexes.setdefault(block.file_removed, len(file_indexes)),
+        'added_file': file_indexes.setdefault(block.file_added, len(file_indexes)),
+        'runs': runs,
+        'match_probabilities': [round(match_probability, 3) for match_probability in block.match_probabilities],
+    }
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _compact_parts(blocks, spans):
+    file_indexes = {}
+    compact_blocks = [compact_block(block, file_indexes) for block in blocks]
+    if spans is not None:
+        for block, block_spans in zip(compact_blocks, spans):
+            block['edit_spans'] = block_spans
+    yield f'{{"files":{_dumps(list(file_indexes))},"blocks":['
+    for block_number, block in enumerate(compact_blocks):
+        yield f'{"," if block_number else ""}{_dumps(block)}'
+    yield ']}'
@@ -0,0 +1,202 @@
+"""Backends finding texts of added lines similar to texts of removed lines, selected by name (see create_backend).
+
+Every backend keeps an index of added texts and its get_many(texts, min_match_score) returns for each text a list of
+(score, added text) pairs, best first, or None if nothing matched - the format of FuzzySet.get_many:
+* fuzzyset - cosine similarity of 2-3 character grams, every match is found (the default),
+* minhash - cosine similarity of 3-grams scored only for added texts sharing a MinHash LSH bucket with the text, so
+  lookup does not depend on the number of added texts but some matches are missed,
+* exact - only texts equal after normalization of whitespaces match, for detection of pure moves.
+"""
+import re
+import zlib
+
+from fuzzyset import FuzzySet, _gram_counter
+
+try:
+    import numpy
+except ImportError:  # minhash backend is not available
+    numpy = None
+
+DEFAULT_BACKEND = 'fuzzyset'
+
+# Number of texts whose MinHash signatures are computed together - bounds memory of the (permutations x grams) array.
+_BATCH_SIZE = 1024
+
+
+class SimilarityBackend(object):
+    name = None
+
+    def add(self, text):
+        raise NotImplementedError
+
+    def prepare(self):
+        """Build index used by get_many up front, e.g. before forking workers which should share it."""
+
+    def get_many(self, texts, min_match_score):
+        raise NotImplementedError
+
+
+class FuzzySetBackend(SimilarityBackend):
+    name = 'fuzzyset'
+
+    def __init__(self, gram_vectors=None):
+        self.fuzzy_set = FuzzySet(gram_vectors=gram_vectors)
+
+    def add(self, text):
+        self.fuzzy_set.add(text)
+
+    def prepare(self):
+        self.fuzzy_set.prepare_get_many()
+
+    def get_many(self, texts, min_match_score):
+        return self.fuzzy_set.get_many(texts, default=None, exact_match_only=False, min_match_score=min_match_score)
+
+
+class MinHashBackend(SimilarityBackend):
+    """Locality sensitive hashing of sets of grams with bands of MinHash signatures (needs numpy).
+
+    Texts whose gram sets have Jaccard similarity s share a bucket of at least one band with probability
+    1 - (1 - s ** rows) ** bands, only those candidates are scored (exactly, like FuzzySet does with gram_size).
+    Buckets of each band are a sorted array of band keys, so candidates of all texts are found with a few binary
+    searches. Like in FuzzySet texts are compared lowercase and the first added text of each lowercase text is
+    returned.
+    """
+    name = 'minhash'
+
+    def __init__(self, bands=24, rows=3, gram_size=3, seed=1):
+        if numpy is None:
+            raise ImportError('minhash similarity backend needs numpy')
+        self.bands = bands
+        self.rows = rows
+        self.gram_size = gram_size
+        # (a * hash + b) modulo 2 ** 32 with odd a permutes 32-bit hashes, seeded so results are reproducible
+        random_state = numpy.random.RandomState(seed)
+        self._a = random_state.randint(0, 2 ** 32, size=(bands * rows, 1), dtype=numpy.uint64).astype(numpy.uint32) | 1
+        self._b = random_state.randint(0, 2 ** 32, size=(bands * rows, 1), dtype=numpy.uint64).astype(numpy.uint32)
+        self._gram_hashes = {}
+        self.values = {}  # lowercase text -> first added text
+        self.item_vectors = []  # (lowercase text, grams, norm) by item index
+        self._band_buckets = None  # per band (sorted band keys of items, item indexes in the same order)
+
+    def add(self, text):
+        lvalue = text.lower()
+        if lvalue in self.values:
+            return
+        self.values[lvalue] = text
+        self.item_vectors.append(self._gram_vector(lvalue))
+        self._band_buckets = None
+
+    def prepare(self):
+        if self._band_buckets is None:
+            indexes = numpy.array([idx for idx, (_, grams, _) in enumerate(self.item_vectors) if grams],
+                                  dtype=numpy.int64)
+            keys = self._band_keys([self.item_vectors[idx][1] for idx in indexes])
+            self._band_buckets = []
+            for band in range(self.bands):
+                order = numpy.argsort(keys[:, band], kind='stable')
+                self._band_buckets.append((keys[order, band], indexes[order]))
+
+    def get_many(self, texts, min_match_score):
+        self.prepare()
+        vectors = [self._gram_vector(text.lower()) for text in texts]
+        positions = [position for position, (_, grams, _) in enumerate(vectors) if grams]
+        matches = [[] for _ in vectors]
+        for position, idx in self._candidates(positions, self._band_keys([vectors[i][1] for i in positions])):
+            _, grams, norm = vectors[position]
+            _, item_grams, item_norm = self.item_vectors[idx]
+            dot_product = sum(grams[gram] * item_grams[gram] for gram in grams.keys() & item_grams.keys())
+            score = dot_product / (norm * item_norm)
+            if score >= min_match_score:
+                matches[position].append((-score, idx))
+        results = []
+        for text_matches in matches:
+            text_matches.sort()
+            results.append([(-score, self.values[self.item_vectors[idx][0]]) for score, idx in text_matches] or None)
+        return results
+
+    def _candidates(self, positions, keys):
+        """Return distinct (position, item index) pairs of items sharing a bucket with keys of text at position."""
+        if not positions:
+            return []
+        query_positions = []
+        item_indexes = []
+        for band, (band_keys, band_items) in enumerate(self._band_buckets):
+            starts = numpy.searchsorted(band_keys, keys[:, band], side='left')
+            counts = numpy.searchsorted(band_keys, keys[:, band], side='right') - starts
+            total = int(counts.sum())
+            if total:
+                offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+                query_positions.append(numpy.repeat(numpy.array(positions), counts))
+                item_indexes.append(band_items[numpy.repeat(starts, counts) + offsets])
+        if not query_positions:
+            return []
+        items_count = len(self.item_vectors)
+        pairs = numpy.unique(numpy.concatenate(query_positions) * items_count + numpy.concatenate(item_indexes))
+        return zip(*(array.tolist() for array in numpy.divmod(pairs, items_count)))
+
+    def _gram_vector(self, lvalue):
+        grams = dict(_gram_counter(lvalue, self.gram_size))
+        return lvalue, grams, sum(occ ** 2 for occ in grams.values()) ** 0.5
+
+    def _hashes(self, grams):
+        hashes = []
+        for gram in grams:
+            gram_hash = self._gram_hashes.get(gram)
+            if gram_hash is None:
+                gram_hash = self._gram_hashes[gram] = zlib.crc32(gram.encode('utf-8', 'surrogatepass'))
+            hashes.append(gram_hash)
+        return hashes
+
+    def _band_keys(self, grams_list):
+        """Return (len(grams_list), bands) array of keys of bands of MinHash signatures of (non empty) gram sets.
+
+        Signature is the min of permuted hashes of grams for every permutation, it is computed for batches of gram
+        sets in a few vectorized steps. Key of a band mixes its rows into one 64-bit number.
+        """
+        keys = numpy.zeros((len(grams_list), self.bands), dtype=numpy.uint64)
+        for start in range(0, len(grams_list), _BATCH_SIZE):
+            hashes_list = [self._hashes(grams) for grams in grams_list[start:start + _BATCH_SIZE]]
+            lengths = numpy.array([len(hashes) for hashes in hashes_list])
+            offsets = numpy.cumsum(lengths) - lengths
+            hashes = numpy.fromiter((gram_hash for hashes in hashes_list for gram_hash in hashes),
+                                    dtype=numpy.uint32, count=int(lengths.sum()))
+            signatures = numpy.minimum.reduceat(self._a * hashes[None, :] + self._b, offsets, axis=1)
+            signatures = signatures.T.reshape(len(hashes_list), self.bands, self.rows).astype(numpy.uint64)
+            batch_keys = signatures[:, :, 0]
+            for row in range(1, self.rows):
+                batch_keys = batch_keys * numpy.uint64(0x9E3779B97F4A7C15) + signatures[:, :, row]
+            keys[start:start + len(hashes_list)] = batch_keys
+        return keys
+
+
+_whitespaces_re = re.compile(r'\s+')
+
+
+def normalize_whitespaces(text):
+    return _whitespaces_re.sub(' ', text.strip())
+
+
+class ExactBackend(SimilarityBackend):
+    """Texts match (with score 1) only if they are equal after runs of whitespaces are replaced with a space."""
+    name = 'exact'
+
+    def __init__(self):
+        self.texts = {}  # normalized text -> {added text: None}
+
+    def add(self, text):
+        self.texts.setdefault(normalize_whitespaces(text), {})[text] = None
+
+    def get_many(self, texts, min_match_score):
+        return [[(1, added_text) for added_text in self.texts.get(normalize_whitespaces(text), ())] or None
+                for text in texts]
+
+
+BACKENDS = {backend.name: backend for backend in (FuzzySetBackend, MinHashBackend, ExactBackend)}
+
+
+def create_backend(name=None, **kwargs):
+    """Return backend of name (DEFAULT_BACKEND if it is None), kwargs are passed to its constructor."""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown similarity backend: {name}, available ones are: {", ".join(BACKENDS)}')
+    return BACKENDS[name](**kwargs)
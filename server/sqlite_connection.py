@@ -0,0 +1,37 @@
+"""Connections to sqlite files shared by all processes on the host (the result cache, the gram index and jobs)."""
+import os
+import sqlite3
+
+
+class ProcessConnection(object):
+    """Sqlite connection to the file at path, opened by every process on its first use of it, as connections must
+    not be shared with forked processes.
+
+    Connections are in WAL mode, so readers do not wait for writers, and they wait up to 10 seconds for a lock held
+    by another process. set_up(connection) is called with every new connection, e.g. to create tables - it is
+    pickled with the connection, so it should be a function of a module. A pickled ProcessConnection (e.g. passed
+    to a worker process) opens a connection of its own.
+    """
+
+    def __init__(self, path, set_up=None):
+        self.path = path
+        self.set_up = set_up
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    def get(self):
+        """Return the connection of this process."""
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            if self.set_up is not None:
+                self.set_up(connection)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
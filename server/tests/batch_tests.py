@@ -0,0 +1,96 @@
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+
+import serialization
+from batch import find_diffs, read_checkpoint, run_batch
+from detector import MovedBlocksDetector
+from tests.synthetic_diff import generate_diff
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.corpus_path = os.path.join(self.temp_dir.name, 'corpus')
+        os.makedirs(os.path.join(self.corpus_path, 'older'))
+        self.diff_texts = {
+            'small.diff': generate_diff(files_count=2, lines_per_file=50, seed=1),
+            'older/big.patch': generate_diff(files_count=6, lines_per_file=150, seed=2),
+            'compressed.diff.gz': generate_diff(files_count=3, lines_per_file=100, seed=3),
+            'invalid.diff': '@@ -1 +1 @@\n-a\n+b\n',
+        }
+        for name, diff_text in self.diff_texts.items():
+            open_file = gzip.open if name.endswith('.gz') else open
+            with open_file(os.path.join(self.corpus_path, name), 'wt', encoding='utf-8') as diff_file:
+                diff_file.write(diff_text)
+        with open(os.path.join(self.corpus_path, 'notes.txt'), 'w') as notes_file:
+            notes_file.write('not a diff')
+        self.output_path = os.path.join(self.temp_dir.name, 'results.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_records(self):
+        with open(self.output_path, 'rb') as output:
+            return {record['diff']: record for record in map(json.loads, output)}
+
+    def assert_records_of_corpus(self, records):
+        self.assertEqual(set(records), set(self.diff_texts))
+        self.assertTrue(records['invalid.diff']['error'].startswith('DiffParseError'))
+        for name, diff_text in self.diff_texts.items():
+            if name == 'invalid.diff':
+                continue
+            self.assertIsNone(records[name]['error'])
+            blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks(3)
+            self.assertEqual(records[name]['result'], json.loads(serialization.blocks_to_json(blocks)))
+            self.assertEqual(records[name]['counts']['detected_blocks'], len(blocks))
+            self.assertIn('detect_moved_blocks', records[name]['seconds'])
+
+    def test_directory_in_worker_processes(self):
+        self.assertEqual(run_batch(self.corpus_path, self.output_path, min_lines_count=3, processes=2), (4, 1))
+        self.assert_records_of_corpus(self.read_records())
+
+    def test_tar_archives(self):
+        for mode, file_name in (('w', 'corpus.tar'), ('w:gz', 'corpus.tar.gz')):
+            archive_path = os.path.join(self.temp_dir.name, file_name)
+            with tarfile.open(archive_path, mode) as archive:
+                for name in self.diff_texts:
+                    archive.add(os.path.join(self.corpus_path, name), arcname=name)
+            self.assertEqual(run_batch(archive_path, self.output_path, min_lines_count=3, processes=1), (4, 1))
+            self.assert_records_of_corpus(self.read_records())
+
+    def test_tar_members_are_read_up_to_their_end(self):
+        archive_path = os.path.join(self.temp_dir.name, 'corpus.tar')
+        with tarfile.open(archive_path, 'w') as archive:
+            for name in ('small.diff', 'older/big.patch', 'invalid.diff'):
+                archive.add(os.path.join(self.corpus_path, name), arcname=name)
+            archive.addfile(tarfile.TarInfo('empty.diff'), io.BytesIO())
+        sources = find_diffs(archive_path, self.temp_dir.name)
+        self.assertEqual([source.name for source in sources], ['small.diff', 'older/big.patch', 'invalid.diff',
+                                                               'empty.diff'])
+        for source in sources:
+            with source.open() as stream:
+                self.assertEqual(b''.join(iter(stream.readline, b'')).decode('utf-8'),
+                                 self.diff_texts.get(source.name, ''))
+
+    def test_resume_skips_diffs_of_checkpoint_and_drops_cut_line(self):
+        run_batch(self.corpus_path, self.output_path, processes=1, with_blocks=False)
+        with open(self.output_path, 'rb') as output:
+            lines = output.readlines()
+        self.assertNotIn('result', json.loads(lines[0]))
+        with open(self.output_path, 'wb') as output:
+            output.writelines(lines[:2])
+            output.write(lines[2][:20])
+        self.assertEqual(len(read_checkpoint(self.output_path)), 2)
+        self.assertEqual(run_batch(self.corpus_path, self.output_path, processes=1, resume=True, with_blocks=False),
+                         (2, sum(b'invalid.diff' in line for line in lines[2:])))
+        with open(self.output_path, 'rb') as output:
+            self.assertEqual(sorted(json.loads(line)['diff'] for line in output), sorted(self.diff_texts))
+
+
+if __name__ == '__main__':
+    unittest.main()
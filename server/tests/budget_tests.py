@@ -0,0 +1,140 @@
+import unittest
+
+import falcon
+from falcon import testing
+
+import main
+from budget import EXACT_ONLY, PARTIAL, SKIPPED_FILES, DetectionBudget
+from detector import MovedBlocksDetector, diff_to_lines
+from result_cache import ResultCache
+from tests.synthetic_diff import generate_diff
+
+
+class SteppingClock(object):
+    """Clock which moves step seconds every time it is read."""
+
+    def __init__(self, step):
+        self.step = step
+        self.now = 0
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def moved_file_diff(source, target, lines):
+    return ''.join([
+        f'diff --git a/{source} b/{source}\ndeleted file mode 100644\n--- a/{source}\n+++ /dev/null\n',
+        f'@@ -1,{len(lines)} +0,0 @@\n', ''.join(f'-{line}\n' for line in lines),
+        f'diff --git a/{target} b/{target}\nnew file mode 100644\n--- /dev/null\n+++ b/{target}\n',
+        f'@@ -0,0 +1,{len(lines)} @@\n', ''.join(f'+{line}\n' for line in lines),
+    ])
+
+
+def edited_lines(lines):
+    return [f'{line} + 1' for line in lines]
+
+
+LINES = [f'value_{i} = compute_total(items_{i}, rate={i})' for i in range(8)]
+
+
+class DetectionBudgetTest(unittest.TestCase):
+    def test_time_moves_detection_step_by_step(self):
+        clock = SteppingClock(1)
+        budget = DetectionBudget(max_seconds=3, time_function=clock)
+        for degradations in ([EXACT_ONLY], [EXACT_ONLY, SKIPPED_FILES], [EXACT_ONLY, SKIPPED_FILES, PARTIAL]):
+            budget.check()
+            self.assertEqual(budget.degradations, degradations)
+        budget.check()
+        self.assertTrue(budget.partial)
+
+    def test_diff_is_parsed_up_to_max_bytes(self):
+        diff_text = moved_file_diff('a.py', 'b.py', LINES)
+        # cuts the last two added lines
+        budget = DetectionBudget(max_diff_bytes=len(diff_text) - len(LINES[-1]) * 3 // 2)
+        removed_lines, added_lines = diff_to_lines(diff_text, budget)
+        self.assertEqual(len(removed_lines), len(LINES))
+        self.assertEqual(len(added_lines), len(LINES) - 2)
+        self.assertEqual(budget.degradations, [EXACT_ONLY, PARTIAL])
+
+    def test_diff_bytes_are_counted_in_utf_8(self):
+        lines = [f'zażółć_{i} = "gęślą jaźń"' for i in range(8)]
+        diff_text = moved_file_diff('a.py', 'b.py', lines)
+        budget = DetectionBudget(max_diff_bytes=len(diff_text))
+        removed_lines, added_lines = diff_to_lines(diff_text, budget)
+        self.assertLess(len(added_lines), len(lines))
+        self.assertEqual(budget.degradations, [EXACT_ONLY, PARTIAL])
+        budget = DetectionBudget(max_diff_bytes=len(diff_text.encode('utf-8')))
+        removed_lines, added_lines = diff_to_lines(diff_text, budget)
+        self.assertEqual((len(removed_lines), len(added_lines)), (len(lines), len(lines)))
+        self.assertEqual(budget.degradations, [])
+
+
+class DegradedDetectionTest(unittest.TestCase):
+    def detect(self, diff_text, budget=None, **kwargs):
+        detector = MovedBlocksDetector.from_diff(diff_text, budget=budget)
+        return [block.to_dict() for block in detector.detect_moved_blocks(min_lines_count=2, **kwargs)], detector
+
+    def test_changed_lines_over_budget_match_only_equal_texts(self):
+        diff_text = moved_file_diff('a.py', 'b.py', LINES[:4]) + moved_file_diff('c.py', 'd.py', LINES[4:])
+        for line, edited_line in zip(LINES[4:], edited_lines(LINES[4:])):
+            diff_text = diff_text.replace('\n+' + line, '\n+' + edited_line)
+        blocks, _ = self.detect(diff_text)
+        self.assertEqual(len(blocks), 2)
+
+        budget = DetectionBudget(max_changed_lines=len(LINES))
+        blocks, detector = self.detect(diff_text, budget)
+        self.assertEqual(budget.degradations, [EXACT_ONLY])
+        self.assertEqual([block['lines'][0]['removed_line']['file'] for block in blocks], ['a.py'])
+        self.assertEqual(len(detector.added_lines_fuzzy_set.item_indexes), 0)
+
+    def test_removed_lines_of_big_files_are_skipped(self):
+        big_lines = [f'row_{i} = [{i}, {i * 2}, {i * 3}]' for i in range(30)]
+        diff_text = moved_file_diff('a.py', 'b.py', LINES) + moved_file_diff('big.lock', 'new.lock', big_lines)
+        budget = DetectionBudget(max_file_changed_lines=len(big_lines) - 1)
+        budget.degrade_to(SKIPPED_FILES, 'test')
+        blocks, _ = self.detect(diff_text, budget)
+        self.assertEqual([block['lines'][0]['removed_line']['file'] for block in blocks], ['a.py'])
+
+    def test_partial_result_has_blocks_of_lines_matched_in_time(self):
+        diff_text = generate_diff(files_count=40, lines_per_file=300, seed=4)
+        budget = DetectionBudget(max_seconds=1, time_function=SteppingClock(1))
+        blocks, detector = self.detect(diff_text, budget)
+        self.assertEqual(budget.degradations, [EXACT_ONLY, SKIPPED_FILES, PARTIAL])
+        self.assertGreater(detector.counts['not_matched_lines'], 0)
+        self.assertGreater(len(blocks), 0)
+
+    def test_budgets_checked_by_workers_degrade_parallel_detection(self):
+        diff_text = generate_diff(files_count=40, lines_per_file=300, seed=2)
+        budget = DetectionBudget(max_fuzzy_candidates=1)
+        self.detect(diff_text, budget, processes=2)
+        self.assertEqual(budget.degradations, [EXACT_ONLY])
+
+
+class BudgetOfRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.result_cache = ResultCache()
+        self.diff_text = moved_file_diff('a.py', 'b.py', LINES)
+
+    def post(self, **kwargs):
+        app = falcon.App()
+        app.add_route('/moved-blocks', main.MovedBlocksResource(result_cache=self.result_cache, **kwargs))
+        return testing.TestClient(app).simulate_post('/moved-blocks', json={'diff_text': self.diff_text})
+
+    def test_degraded_result_is_flagged_and_not_cached(self):
+        result = self.post(budget_options={'max_changed_lines': 1})
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(result.headers['X-Detection-Degraded'], EXACT_ONLY)
+        self.assertEqual(len(result.json), 1)
+        self.assertEqual(self.result_cache.stats()['memory_entries'], 0)
+        result = self.post(budget_options={'max_changed_lines': 100})
+        self.assertNotIn('X-Detection-Degraded', result.headers)
+        self.assertEqual(self.result_cache.stats()['memory_entries'], 1)
+
+    def test_too_long_request_is_rejected(self):
+        result = self.post(max_request_bytes=len(self.diff_text) // 2)
+        self.assertEqual(result.status, falcon.HTTP_413)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
+import pickle
 import unittest
 
-from detector import Line, MatchingBlock, MovedBlocksDetector, \
-    split_to_leading_whitespace_and_trim_text
+import detector
+from detector import Line, LineTable, MatchingBlock, MovedBlocksDetector, diff_to_lines, intervals_contain, \
+    line_intervals, split_to_leading_whitespace_and_trim_text
+from tests.reference_detector import braces_diff, fragments, linear_scan_grow_blocks, pairwise_join
+from tests.synthetic_diff import generate_diff
 
 
 class LineTest(unittest.TestCase):
@@ -73,6 +77,165 @@ def no_op(x):
     return x
 
 
+class LineTableTest(unittest.TestCase):
+    def test_lines_are_views_of_rows(self):
+        table = LineTable()
+        table.append("file", 3, "    some_text")
+        table.append("other_file", 7, "")
+        self.assertEqual([line.to_dict() for line in table], [
+            {"file": "file", "line_no": 3, "leading_whitespaces": "    ", "trim_text": "some_text"},
+            {"file": "other_file", "line_no": 7, "leading_whitespaces": "", "trim_text": ""},
+        ])
+        self.assertEqual(table[0].trim_text_len, 9)
+        self.assertEqual(table.files, ["file", "other_file"])
+
+    def test_next_line_index(self):
+        for line_nos in ([1, 2, 4, 5], [4, 5, 1, 2]):
+            table = LineTable()
+            for line_no in line_nos:
+                table.append("file", line_no, "text")
+            table.append("other_file", line_nos[-1] + 1, "text")
+            self.assertEqual(table.ordered, line_nos == sorted(line_nos))
+            next_indexes = [table.next_line_index(index) for index in range(len(line_nos))]
+            next_line_nos = [table.line_nos[index] if index != -1 else None for index in next_indexes]
+            self.assertEqual(next_line_nos, [line_no + 1 if line_no + 1 in line_nos else None for line_no in line_nos])
+
+    def test_block_is_pickled_without_tables(self):
+        removed_lines, added_lines = diff_to_lines(generate_diff(files_count=3, lines_per_file=50, seed=1))
+        block = MatchingBlock.from_indexes(removed_lines, added_lines, 0, 0)
+        unpickled_block = pickle.loads(pickle.dumps(block))
+        self.assertIsNone(unpickled_block.removed_table)
+        self.assertEqual(list(unpickled_block.removed_indexes), [0])
+        self.assertEqual(unpickled_block.char_count, block.char_count)
+
+
+class LineIntervalsTest(unittest.TestCase):
+    def test_line_intervals(self):
+        line_nos = [1, 2, 3, 5, 6, 9]
+        indexes = [0, 1, 2, -1, 3, 4, 5]
+        other_indexes = [0, 1, -1, 7, 3, 4, 5]
+        self.assertEqual(line_intervals(line_nos, indexes, other_indexes), [[1, 3], [5, 7], [9, 10]])
+
+    def test_intervals_contain(self):
+        intervals = [[1, 3], [5, 7], [9, 10]]
+        self.assertTrue(intervals_contain(intervals, []))
+        self.assertTrue(intervals_contain(intervals, [[1, 2], [5, 7]]))
+        self.assertTrue(intervals_contain(intervals, intervals))
+        self.assertFalse(intervals_contain(intervals, [[2, 4]]))
+        self.assertFalse(intervals_contain(intervals, [[5, 6], [8, 10]]))
+        self.assertFalse(intervals_contain(intervals, [[9, 11]]))
+
+
+class JoinNearbyBlocksTest(unittest.TestCase):
+    def test_chains_of_fragments_are_joined_in_one_sweep(self):
+        blocks = fragments(20, chain_length=5)
+        moved_blocks_detector = MovedBlocksDetector([], [])
+        joined_blocks = moved_blocks_detector.join_nearby_blocks(list(blocks))
+        self.assertEqual([block.to_dict() for block in joined_blocks],
+                         [block.to_dict() for block in pairwise_join(moved_blocks_detector, list(blocks))])
+        self.assertEqual([len(block.lines) for block in joined_blocks[:5]], [10, 8, 6, 4, 2])
+        self.assertEqual(moved_blocks_detector.join_loops_made, 19)
+
+
+class ExactRunsTest(unittest.TestCase):
+    def test_runs_of_identical_lines_are_anchored(self):
+        removed_lines = ChangedLines("removed_file", {
+            1: "def first():", 2: "    return 1", 3: "", 4: "def second():", 5: "    return 2", 6: "",
+            10: "x = 1", 11: "y = 2",
+        })
+        added_lines = ChangedLines("added_file", {
+            20: "def first():", 21: "    return 1", 22: "", 23: "def second():", 24: "    return 2", 25: "",
+            30: "x = 1", 31: "y = 2", 32: "def third():",
+        })
+        moved_blocks_detector = MovedBlocksDetector(removed_lines.to_lines_dicts(), added_lines.to_lines_dicts())
+        blocks = moved_blocks_detector.find_exact_runs()
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual((blocks[0].first_removed_line_no, blocks[0].last_removed_line_no), (1, 5))
+        self.assertEqual((blocks[0].first_added_line_no, blocks[0].last_added_line_no), (20, 24))
+        self.assertEqual(blocks[0].match_probabilities, [1] * 5)
+        self.assertEqual(list(moved_blocks_detector.anchored_removed_indexes), [1, 1, 1, 1, 1, 0, 0, 0])
+        self.assertEqual(moved_blocks_detector.not_anchored(range(8)), [5, 6, 7])
+
+    def test_runs_with_repeated_lines_are_not_anchored(self):
+        removed_lines = ChangedLines("removed_file", {
+            1: "def first():", 2: "    return 1", 3: "", 4: "def second():", 5: "    return 2",
+        })
+        added_lines = ChangedLines("added_file", {
+            20: "def first():", 21: "    return 1", 22: "", 23: "def second():", 24: "    return 2",
+            30: "def second():",
+        })
+        moved_blocks_detector = MovedBlocksDetector(removed_lines.to_lines_dicts(), added_lines.to_lines_dicts())
+        self.assertEqual(moved_blocks_detector.find_exact_runs(), [])
+        self.assertEqual(moved_blocks_detector.not_anchored(range(5)), [0, 1, 2, 3, 4])
+
+    def test_exact_anchors_match_the_same_lines_of_repetitive_diff(self):
+        for seed in (0, 3):
+            with self.subTest(seed=seed):
+                diff_text = generate_diff(files_count=6, lines_per_file=200, vocabulary_size=20, repetition=0.3,
+                                          seed=seed)
+                blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+                anchored_blocks = MovedBlocksDetector.from_diff(diff_text, exact_anchors=True).detect_moved_blocks()
+                self.assertEqual(self.matched_line_pairs(anchored_blocks), self.matched_line_pairs(blocks))
+
+    def test_exact_anchors_find_the_same_moved_lines(self):
+        diff_text = generate_diff(files_count=6, lines_per_file=120, edit_noise=0.1, seed=1)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        anchored_blocks = MovedBlocksDetector.from_diff(diff_text, exact_anchors=True).detect_moved_blocks()
+        self.assertEqual(self.matched_removed_lines(anchored_blocks), self.matched_removed_lines(blocks))
+
+    @staticmethod
+    def matched_removed_lines(blocks):
+        return {(line.removed_line.file, line.removed_line.line_no)
+                for block in blocks for line in block.lines if line.removed_line and line.added_line}
+
+    @staticmethod
+    def matched_line_pairs(blocks):
+        return {(line.removed_line.file, line.removed_line.line_no, line.added_line.file, line.added_line.line_no)
+                for block in blocks for line in block.lines if line.removed_line and line.added_line}
+
+
+class GrowBlocksTest(unittest.TestCase):
+    def test_indexed_blocks_grow_like_with_linear_scan(self):
+        for seed in range(3):
+            diff_text = generate_diff(files_count=6, lines_per_file=200, repetition=0.4, seed=seed)
+            moved_blocks_detector = MovedBlocksDetector.from_diff(diff_text)
+            removed_indexes = range(len(moved_blocks_detector.removed_lines))
+            pairs = moved_blocks_detector.find_fuzzy_matching_pairs(removed_indexes)
+            blocks = moved_blocks_detector.grow_blocks(removed_indexes, pairs)
+            linear_scan_blocks = linear_scan_grow_blocks(moved_blocks_detector, removed_indexes, pairs)
+            for indexed, linear_scan in zip(blocks, linear_scan_blocks):
+                self.assertTrue(indexed)
+                self.assertEqual([block.to_dict() for block in indexed], [block.to_dict() for block in linear_scan])
+
+
+class LowInformationLinesTest(unittest.TestCase):
+    def test_run_of_low_information_lines_starts_one_block(self):
+        moved_blocks_detector = MovedBlocksDetector.from_diff(braces_diff(300), max_new_blocks_per_line=1)
+        blocks = moved_blocks_detector.detect_moved_blocks()
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual((blocks[0].first_removed_line_no, blocks[0].last_removed_line_no), (1, 300))
+        self.assertEqual((blocks[0].first_added_line_no, blocks[0].last_added_line_no), (1, 300))
+
+    def test_idf_weighting_filters_out_blocks_of_low_information_lines(self):
+        moved_blocks_detector = MovedBlocksDetector.from_diff(braces_diff(300), max_new_blocks_per_line=1,
+                                                              idf_weighting=True)
+        self.assertEqual(moved_blocks_detector.low_information_weights, {'}': 0.0})
+        self.assertEqual(moved_blocks_detector.detect_moved_blocks(), [])
+
+    def test_uncapped_blocks_are_the_same(self):
+        diff_text = generate_diff(files_count=6, lines_per_file=300, repetition=0.4, seed=2)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        self.assertTrue(blocks)
+        capped_blocks = MovedBlocksDetector.from_diff(diff_text, max_new_blocks_per_line=10 ** 6).detect_moved_blocks()
+        self.assertEqual(sorted(block.to_json() for block in capped_blocks), sorted(block.to_json() for block in blocks))
+
+    def test_cap_of_at_least_fan_out_gives_the_same_blocks_of_repetitive_diff(self):
+        diff_text = generate_diff(files_count=10, lines_per_file=300, vocabulary_size=20, repetition=0.3, seed=0)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        capped_blocks = MovedBlocksDetector.from_diff(diff_text, max_new_blocks_per_line=10 ** 6).detect_moved_blocks()
+        self.assertEqual([block.to_json() for block in capped_blocks], [block.to_json() for block in blocks])
+
+
 class MovedBlocksDetectorTest(unittest.TestCase):
     def test_simple_1_moved_block(self):
 
@@ -719,4 +882,38 @@ class MovedBlocksDetectorTest(unittest.TestCase):
         # self.assertEqual(detected_blocks[0].first_removed_line.line_no, 1)
         # self.assertEqual(detected_blocks[0].last_removed_line.line_no, 12)
         # self.assertEqual(detected_blocks[0].first_added_line.line_no, 1)
-        # self.assertEqual(detected_blocks[0].last_added_line.line_no, 10)
\ No newline at end of file
+        # self.assertEqual(detected_blocks[0].last_added_line.line_no, 10)
+
+
+class ParallelDetectionTest(unittest.TestCase):
+    def setUp(self):
+        self.min_removed_lines_per_process = detector.MIN_REMOVED_LINES_PER_PROCESS
+        detector.MIN_REMOVED_LINES_PER_PROCESS = 10
+
+    def tearDown(self):
+        detector.MIN_REMOVED_LINES_PER_PROCESS = self.min_removed_lines_per_process
+
+    def detect(self, diff_text, processes, exact_anchors=False):
+        moved_blocks_detector = MovedBlocksDetector.from_diff(diff_text, exact_anchors=exact_anchors)
+        return [block.to_dict() for block in moved_blocks_detector.detect_moved_blocks(processes=processes)]
+
+    def test_parallel_detection_gives_the_same_blocks_as_serial(self):
+        for seed in range(3):
+            diff_text = generate_diff(files_count=8, lines_per_file=150, repetition=0.3, seed=seed)
+            serial_blocks = self.detect(diff_text, processes=None)
+            self.assertTrue(serial_blocks)
+            for processes in (2, 5):
+                self.assertEqual(serial_blocks, self.detect(diff_text, processes=processes))
+
+    def test_parallel_detection_with_exact_anchors_gives_the_same_blocks_as_serial(self):
+        for seed in range(3):
+            diff_text = generate_diff(files_count=8, lines_per_file=150, repetition=0.3, edit_noise=0.2, seed=seed)
+            serial_blocks = self.detect(diff_text, processes=None, exact_anchors=True)
+            self.assertTrue(serial_blocks)
+            for processes in (2, 5):
+                self.assertEqual(serial_blocks, self.detect(diff_text, processes=processes, exact_anchors=True))
+
+    def test_removed_lines_are_split_where_blocks_cannot_cross(self):
+        removed_lines = ChangedLines("file", {1: "a", 2: "", 3: "b", 7: "c", 8: "d", 20: "e"}).to_lines_dicts()
+        moved_blocks_detector = MovedBlocksDetector(removed_lines, [])
+        self.assertEqual(moved_blocks_detector.split_removed_lines(6), [(0, 3), (3, 5), (5, 6)])
@@ -0,0 +1,118 @@
+import io
+import unittest
+from textwrap import dedent
+
+from unidiff import PatchSet
+
+from detector import filepath
+from diff_parser import ADDED, REMOVED, DiffParseError, iterate_binary_lines, parse_changed_lines
+from tests.synthetic_diff import generate_diff
+
+GIT_DIFF = dedent("""\
+    diff --git a/moved.py b/renamed.py
+    similarity index 90%
+    rename from moved.py
+    rename to renamed.py
+    index 1111111..2222222 100644
+    --- a/moved.py
+    +++ b/renamed.py
+    @@ -1,3 +1,3 @@
+     def fun():
+    -    return 1
+    +    return 2
+
+    \\ No newline at end of file
+    diff --git a/new.py b/new.py
+    new file mode 100644
+    index 0000000..3333333
+    --- /dev/null
+    +++ b/new.py
+    @@ -0,0 +1,2 @@
+    +import os
+    +
+
+    diff --git a/deleted.py b/deleted.py
+    deleted file mode 100644
+    index 4444444..0000000
+    --- a/deleted.py
+    +++ /dev/null
+    @@ -1 +0,0 @@
+    -print("bye")
+    diff --git a/image.png b/image.png
+    index 5555555..6666666 100644
+    Binary files a/image.png and b/image.png differ
+    diff --git a/changed.py b/changed.py
+    index 7777777..8888888 100644
+    --- a/changed.py
+    +++ b/changed.py
+    @@ -10,3 +10,2 @@ class A:
+         x = 1
+    -    y = 2\r
+         z = 3
+    @@ -20 +19,2 @@
+    -a
+    +b
+    +c
+    """)
+
+PLAIN_DIFF = dedent("""\
+    --- old/file.txt\t2020-01-01 10:00:00
+    +++ new/file.txt\t2020-01-02 10:00:00
+    @@ -1,2 +1,2 @@
+    -first
+    +First
+     second
+    """)
+
+
+def unidiff_changed_lines(diff_text):
+    lines = []
+    for patched_file in PatchSet(diff_text):
+        for hunk in patched_file:
+            for line in hunk:
+                if line.is_added:
+                    lines.append((ADDED, filepath(patched_file), line.target_line_no, line.value.rstrip('\n')))
+                elif line.is_removed:
+                    lines.append((REMOVED, filepath(patched_file), line.source_line_no, line.value.rstrip('\n')))
+    return lines
+
+
+class DiffParserTest(unittest.TestCase):
+    def assert_same_as_unidiff(self, diff_text):
+        self.assertEqual(list(parse_changed_lines(diff_text)), unidiff_changed_lines(diff_text))
+
+    def test_git_diff(self):
+        self.assert_same_as_unidiff(GIT_DIFF)
+        lines = list(parse_changed_lines(GIT_DIFF))
+        self.assertEqual(lines[0], (REMOVED, 'renamed.py', 2, '    return 1'))
+        self.assertEqual(lines[2], (ADDED, 'new.py', 1, 'import os'))
+        self.assertEqual(lines[4], (REMOVED, 'deleted.py', 1, 'print("bye")'))
+        self.assertEqual(lines[5], (REMOVED, 'changed.py', 11, '    y = 2\r'))
+        self.assertEqual(lines[-1], (ADDED, 'changed.py', 20, 'c'))
+
+    def test_plain_diff(self):
+        self.assert_same_as_unidiff(PLAIN_DIFF)
+        self.assertEqual(list(parse_changed_lines(PLAIN_DIFF))[0], (REMOVED, 'old/file.txt', 1, 'first'))
+
+    def test_synthetic_diffs(self):
+        for seed in range(5):
+            self.assert_same_as_unidiff(generate_diff(files_count=5, lines_per_file=100, seed=seed))
+
+    def test_diff_without_trailing_newline(self):
+        self.assert_same_as_unidiff(PLAIN_DIFF.rstrip('\n'))
+
+    def test_file_object(self):
+        self.assertEqual(list(parse_changed_lines(io.StringIO(GIT_DIFF))), list(parse_changed_lines(GIT_DIFF)))
+
+    def test_binary_stream(self):
+        for diff_text in (GIT_DIFF, PLAIN_DIFF, PLAIN_DIFF.rstrip('\n'), generate_diff(files_count=5, seed=1)):
+            lines = iterate_binary_lines(io.BytesIO(diff_text.encode('utf-8')))
+            self.assertEqual(list(parse_changed_lines(lines)), list(parse_changed_lines(diff_text)))
+
+    def test_invalid_hunks(self):
+        with self.assertRaises(DiffParseError):
+            list(parse_changed_lines(PLAIN_DIFF.replace('@@ -1,2 +1,2 @@', '@@ -1,3 +1,2 @@')))
+        with self.assertRaises(DiffParseError):
+            list(parse_changed_lines(PLAIN_DIFF.replace('@@ -1,2 +1,2 @@', '@@ -1,1 +1,2 @@')))
+        with self.assertRaises(DiffParseError):
+            list(parse_changed_lines('@@ -1 +1 @@\n-a\n+b\n'))
@@ -0,0 +1,8 @@
+class FakeClock(object):
+    """Time function of stores (see time_function arguments) which tests move by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+import file_pairs
+from detector import LineTable, MovedBlocksDetector, diff_to_lines
+from tests.synthetic_diff import generate_wide_diff
+
+
+def lines_table(lines_by_file):
+    table = LineTable()
+    for file, lines in lines_by_file.items():
+        for line_no, text in enumerate(lines, 1):
+            table.append(file, line_no, text)
+    table.join_texts()
+    return table
+
+
+def function_lines(name, count=6):
+    return [f'def {name}_{i}(argument):' if i % 3 == 0 else f'    {name}_{i} = compute({i}, "{name}")'
+            for i in range(count)]
+
+
+class FilePairsTest(unittest.TestCase):
+    def test_files_sharing_equal_or_edited_lines_are_candidate_pairs(self):
+        removed_lines = lines_table({'a.py': function_lines('alpha'), 'b.py': function_lines('beta'),
+                                     'c.py': function_lines('gamma')})
+        added_lines = lines_table({'x.py': function_lines('beta'),
+                                   'y.py': [f'{line} + 1' for line in function_lines('alpha')],
+                                   'z.py': function_lines('delta')})
+        self.assertEqual(file_pairs.candidate_file_pairs(removed_lines, added_lines), {0: [1], 1: [0]})
+        self.assertEqual(file_pairs.file_groups(removed_lines, added_lines), [([0, 1], [0, 1])])
+
+    def test_features_of_many_files_are_left_out(self):
+        common_lines = ['    return None', '    raise NotImplementedError()']
+        files_count = file_pairs.MAX_FEATURE_FILES + 1
+        removed_lines = lines_table({'a.py': common_lines})
+        added_lines = lines_table({f'{i}.py': common_lines for i in range(files_count)})
+        self.assertEqual(file_pairs.candidate_file_pairs(removed_lines, added_lines), {})
+
+    @mock.patch.object(file_pairs, 'MIN_GROUP_ADDED_LINES', 1)
+    @mock.patch.object(file_pairs, 'MAX_INDEXED_LINES_RATIO', 1)
+    def test_there_are_no_groups_when_added_files_are_in_many_of_them(self):
+        removed_lines = lines_table({'a.py': function_lines('alpha') + function_lines('beta'),
+                                     'b.py': function_lines('beta') + function_lines('gamma')})
+        added_lines = lines_table({'x.py': function_lines('alpha'), 'y.py': function_lines('beta'),
+                                   'z.py': function_lines('gamma')})
+        self.assertEqual(file_pairs.candidate_file_pairs(removed_lines, added_lines), {0: [0, 1], 1: [1, 2]})
+        self.assertIsNone(file_pairs.file_groups(removed_lines, added_lines))
+
+    def test_lines_are_split_to_tables_of_files(self):
+        table = lines_table({'a.py': ['  a = 1', 'b = 2'], 'b.py': ['c = 3'], 'c.py': ['d = 4']})
+        first, second = table.split_files([[0, 2], [2]])
+        self.assertEqual([(line.file, line.line_no, line.leading_whitespaces, line.trim_text) for line in first],
+                         [('a.py', 1, '  ', 'a = 1'), ('a.py', 2, '', 'b = 2'), ('c.py', 1, '', 'd = 4')])
+        self.assertEqual([line.trim_text for line in second], ['d = 4'])
+
+
+class FilePairFilterDetectionTest(unittest.TestCase):
+    def detect(self, removed_lines, added_lines, **kwargs):
+        detector = MovedBlocksDetector(removed_lines, added_lines, **kwargs)
+        return [block.to_dict() for block in detector.detect_moved_blocks()], detector
+
+    def test_blocks_of_wide_diff_are_detected_in_groups_of_files(self):
+        removed_lines, added_lines = diff_to_lines(generate_wide_diff(files_count=150, edited_lines=8, moves_count=6,
+                                                                      move_lines=10, seed=3))
+        expected_blocks, _ = self.detect(removed_lines, added_lines)
+        blocks, detector = self.detect(removed_lines, added_lines, file_pair_filter=True)
+        self.assertGreater(detector.counts['file_groups'], 1)
+        self.assertEqual(sorted(map(str, blocks)), sorted(map(str, expected_blocks)))
+
+    def test_files_without_candidates_are_not_matched(self):
+        removed_lines = lines_table({'a.py': function_lines('alpha'), 'b.py': ['x = 1', 'y = 2']})
+        added_lines = lines_table({'c.py': function_lines('alpha')})
+        blocks, detector = self.detect(removed_lines, added_lines, file_pair_filter=True, keep_state=True)
+        self.assertEqual([block['lines'][0]['removed_line']['file'] for block in blocks], ['a.py'])
+        self.assertEqual(detector.counts['not_paired_lines'], 2)
+        self.assertFalse(detector.keep_state)
+
+
+if __name__ == '__main__':
+    unittest.main()
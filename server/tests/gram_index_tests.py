@@ -0,0 +1,69 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from detector import MovedBlocksDetector
+from fuzzyset import FuzzySet
+from gram_index import GramIndex
+from tests.fake_clock import FakeClock
+from tests.synthetic_diff import generate_diff
+
+
+class GramIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'grams.sqlite')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_loaded_vectors_are_equal_to_stored_ones_with_order_of_grams(self):
+        gram_vectors = {}
+        FuzzySet(["def foo(self):", "return x", "zażółć"], gram_vectors=gram_vectors)
+        GramIndex(self.path).store(gram_vectors)
+        loaded = GramIndex(self.path).load(["def foo(self):", "return x", "zażółć", "missing"], (2, 3))
+        self.assertEqual(loaded, gram_vectors)
+        for key, (grams, _) in gram_vectors.items():
+            self.assertEqual(list(loaded[key][0]), list(grams))
+
+    def test_least_recently_used_vectors_are_evicted_over_byte_budget(self):
+        index = GramIndex(self.path, max_bytes=10 ** 6, time_function=self.clock)
+        vectors = {}
+        FuzzySet(["a" * 50, "b" * 50, "c" * 50], gram_size_lower=3, gram_vectors=vectors)
+        index.store({key: vector for key, vector in vectors.items() if key[0] == "a" * 50})
+        entry_bytes = index.stats()['bytes']
+        index.max_bytes = 2 * entry_bytes
+        self.clock.now += 1
+        index.store({key: vector for key, vector in vectors.items() if key[0] == "b" * 50})
+        self.clock.now += 2 * 60 * 60
+        index.load(["a" * 50], (3,))
+        self.clock.now += 1
+        index.store({key: vector for key, vector in vectors.items() if key[0] == "c" * 50})
+        self.assertEqual(set(index.load(["a" * 50, "b" * 50, "c" * 50], (3,))), {("a" * 50, 3), ("c" * 50, 3)})
+        self.assertEqual(index.stats(), {'entries': 2, 'bytes': 2 * entry_bytes})
+
+    def test_pickled_index_opens_its_own_connection(self):
+        index = GramIndex(self.path)
+        index.store({("x", 2): ({"-x": 1, "x-": 1}, 2 ** 0.5)})
+        self.assertEqual(pickle.loads(pickle.dumps(index)).load(["x"], (2,)),
+                         {("x", 2): ({"-x": 1, "x-": 1}, 2 ** 0.5)})
+
+    def test_detection_with_index_finds_the_same_blocks(self):
+        diff_text = generate_diff(files_count=10, lines_per_file=200, seed=3)
+        expected = [block.to_dict() for block in MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()]
+
+        first_detector = MovedBlocksDetector.from_diff(diff_text, gram_index=GramIndex(self.path))
+        self.assertEqual([block.to_dict() for block in first_detector.detect_moved_blocks()], expected)
+        self.assertEqual(first_detector.counts['loaded_gram_vectors'], 0)
+        self.assertGreater(first_detector.counts['stored_gram_vectors'], 0)
+
+        second_detector = MovedBlocksDetector.from_diff(diff_text, gram_index=GramIndex(self.path))
+        self.assertEqual([block.to_dict() for block in second_detector.detect_moved_blocks()], expected)
+        self.assertEqual(second_detector.counts['loaded_gram_vectors'], first_detector.counts['stored_gram_vectors'])
+        self.assertEqual(second_detector.counts['stored_gram_vectors'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import unittest
+
+from detector import MovedBlocksDetector
+from incremental import DetectionStateStore
+from tests.synthetic_diff import generate_diff
+
+
+def detect(diff_text, previous_state=None, keep_state=False):
+    detector = MovedBlocksDetector.from_diff(diff_text, previous_state=previous_state, keep_state=keep_state)
+    blocks = detector.detect_moved_blocks()
+    return json.dumps([block.to_dict() for block in blocks]), detector
+
+
+def change_file(diff_text, file_index, change_line):
+    """Return diff_text with change_line applied to added and removed lines of file_index-th file."""
+    files = diff_text.split('diff --git')
+    lines = files[file_index + 1].split('\n')
+    for i, line in enumerate(lines):
+        if line[:1] in ('+', '-') and not line.startswith(('+++', '---')):
+            lines[i] = line[0] + change_line(i, line[1:])
+    files[file_index + 1] = '\n'.join(lines)
+    return 'diff --git'.join(files)
+
+
+class IncrementalDetectionTest(unittest.TestCase):
+    def setUp(self):
+        self.diff_text = generate_diff(files_count=6, lines_per_file=150, vocabulary_size=50, seed=3)
+
+    def assert_incremental_result_is_the_same(self, new_diff_text):
+        _, detector = detect(self.diff_text, keep_state=True)
+        expected_result, _ = detect(new_diff_text)
+        result, _ = detect(new_diff_text, previous_state=detector.detection_state())
+        self.assertEqual(result, expected_result)
+
+    def test_keeping_state_does_not_change_result(self):
+        result, _ = detect(self.diff_text, keep_state=True)
+        self.assertEqual(result, detect(self.diff_text)[0])
+
+    def test_same_diff(self):
+        self.assert_incremental_result_is_the_same(self.diff_text)
+
+    def test_changed_lines_of_one_file(self):
+        self.assert_incremental_result_is_the_same(
+            change_file(self.diff_text, 2, lambda i, text: text.upper() if i % 3 == 0 else text)
+        )
+
+    def test_lines_of_one_file_replaced(self):
+        self.assert_incremental_result_is_the_same(
+            change_file(self.diff_text, 0, lambda i, text: f'new_value_{i} = compute({i})' if i % 2 else text)
+        )
+
+    def test_file_removed(self):
+        files = self.diff_text.split('diff --git')
+        del files[4]
+        self.assert_incremental_result_is_the_same('diff --git'.join(files))
+
+    def test_chain_of_changes(self):
+        state = None
+        diff_text = self.diff_text
+        for file_index in range(4):
+            diff_text = change_file(diff_text, file_index, lambda i, text: text[::-1] if i % 4 == 0 else text)
+            result, detector = detect(diff_text, previous_state=state, keep_state=True)
+            self.assertEqual(result, detect(diff_text)[0])
+            state = detector.detection_state()
+
+
+class DetectionStateStoreTest(unittest.TestCase):
+    def test_least_recently_used_states_are_evicted(self):
+        store = DetectionStateStore(max_count=2)
+        store.set('a', 1)
+        store.set('b', 2)
+        self.assertEqual(store.get('a'), 1)
+        store.set('c', 3)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), 1)
+        self.assertEqual(store.get('c'), 3)
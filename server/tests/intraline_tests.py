@@ -0,0 +1,57 @@
+import json
+import unittest
+
+import intraline
+import serialization
+from detector import LineTable, MatchingBlock
+
+
+class EditSpansTest(unittest.TestCase):
+    def test_edits_of_both_texts(self):
+        self.assertEqual(intraline.edit_spans('    return foo(bar)', '        return foo(baz)'),
+                         {'removed': [[17, 18]], 'added': [[4, 8], [21, 22]]})
+        self.assertEqual(intraline.edit_spans('same', 'same'), {'removed': [], 'added': []})
+        self.assertEqual(intraline.edit_spans('', 'new'), {'removed': [], 'added': [[0, 3]]})
+
+    def test_short_equalities_are_part_of_edits(self):
+        # "e" alone between edits is not worth showing as unchanged
+        self.assertEqual(intraline.edit_spans('self.value = 1', 'self.result = 1'),
+                         {'removed': [[5, 10]], 'added': [[5, 11]]})
+
+    def test_offsets_are_in_utf16_code_units(self):
+        self.assertEqual(intraline.edit_spans('a😀b', 'a😀c'), {'removed': [[3, 4]], 'added': [[3, 4]]})
+        self.assertEqual(intraline.edit_spans('zażółć x', 'zażółć y'), {'removed': [[7, 8]], 'added': [[7, 8]]})
+
+
+def block_of_texts(text_pairs, match_probabilities):
+    removed_lines = LineTable()
+    added_lines = LineTable()
+    for line_no, (removed_text, added_text) in enumerate(text_pairs, start=1):
+        removed_lines.append('removed.py', line_no, removed_text)
+        added_lines.append('added.py', line_no + 10, added_text)
+    block = MatchingBlock.from_indexes(removed_lines, added_lines, 0, 0, match_probabilities[0])
+    for index, match_probability in enumerate(match_probabilities[1:], start=1):
+        block.extend_with_indexes(index, index, match_probability)
+    return block
+
+
+class EditSpansOfBlocksTest(unittest.TestCase):
+    def setUp(self):
+        self.block = block_of_texts([('    a = 1', '        a = 1'), ('b = 2', 'b = 3'), ('c = 4', 'c = 4')],
+                                    [0.9, 0.8, 1])
+
+    def test_spans_of_not_exact_matches(self):
+        self.assertEqual(intraline.edit_spans_of_blocks([self.block]),
+                         [[{'removed': [], 'added': [[4, 8]]}, {'removed': [[4, 5]], 'added': [[4, 5]]}, None]])
+
+    def test_serialized_spans(self):
+        full = json.loads(serialization.blocks_to_json([self.block], edit_spans=True))
+        self.assertEqual([line.get('edit_spans') for line in full[0]['lines']],
+                         intraline.edit_spans_of_blocks([self.block])[0])
+        compact = json.loads(serialization.blocks_to_json([self.block], serialization.COMPACT, edit_spans=True))
+        self.assertEqual(compact['blocks'][0]['edit_spans'], intraline.edit_spans_of_blocks([self.block])[0])
+        self.assertNotIn(b'edit_spans', serialization.blocks_to_json([self.block]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import falcon
+from falcon import testing
+
+import main
+import serialization
+from detector import MovedBlocksDetector
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, JobWorkers
+from tests.fake_clock import FakeClock
+from tests.synthetic_diff import generate_diff
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.temp_dir.name, 'jobs.sqlite'), stale_seconds=60, max_attempts=2,
+                              time_function=self.clock)
+        self.diff_text = generate_diff(files_count=3, lines_per_file=100, seed=4)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_identical_diffs_share_a_job(self):
+        job = self.queue.submit(self.diff_text, 2)
+        self.assertEqual(job.status, QUEUED)
+        self.assertEqual(self.queue.submit(self.diff_text, 2).job_id, job.job_id)
+        self.assertNotEqual(self.queue.submit(self.diff_text, 3).job_id, job.job_id)
+        self.assertNotEqual(self.queue.submit(self.diff_text, 2, {'exact_anchors': True}).job_id, job.job_id)
+
+    def test_job_result_is_the_same_as_of_detection(self):
+        job = self.queue.submit(self.diff_text)
+        self.assertIsNone(self.queue.result(job.job_id))
+        self.queue.run(*self.queue.claim())
+        self.assertIsNone(self.queue.claim())
+
+        job = self.queue.get(job.job_id)
+        removed_lines_count = len(MovedBlocksDetector.from_diff(self.diff_text).removed_lines)
+        self.assertEqual((job.status, job.processed_lines, job.total_lines),
+                         (DONE, removed_lines_count, removed_lines_count))
+        expected = json.dumps(MovedBlocksDetector.from_diff(self.diff_text).detect_moved_blocks(),
+                              cls=main.CustomJsonEncoder)
+        self.assertEqual(self.queue.result(job.job_id), expected.encode('utf-8'))
+        self.assertEqual(self.queue.submit(self.diff_text).status, DONE)
+
+    def test_stale_running_job_is_claimed_again_until_max_attempts(self):
+        job = self.queue.submit(self.diff_text)
+        self.assertEqual(self.queue.claim()[0], job.job_id)
+        self.assertEqual(self.queue.get(job.job_id).status, RUNNING)
+        self.assertIsNone(self.queue.claim())
+        self.clock.now += 61
+        self.assertEqual(self.queue.claim()[0], job.job_id)
+        self.clock.now += 61
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.get(job.job_id).status, FAILED)
+        self.assertEqual(self.queue.submit(self.diff_text).status, QUEUED)
+
+    def test_heartbeat_keeps_running_job_from_turning_stale(self):
+        self.queue.submit(self.diff_text)
+        job_id, attempt, *_ = self.queue.claim()
+        self.clock.now += 40
+        self.assertTrue(self.queue.heartbeat(job_id, attempt))
+        self.clock.now += 40
+        self.assertIsNone(self.queue.claim())
+
+    def test_running_job_sends_heartbeats(self):
+        self.queue.heartbeat_seconds = 0.001
+        self.queue.submit(self.diff_text)
+        with mock.patch.object(self.queue, 'heartbeat', wraps=self.queue.heartbeat) as heartbeat:
+            self.queue.run(*self.queue.claim())
+        self.assertTrue(heartbeat.called)
+
+    def test_only_last_attempt_stores_progress_and_result(self):
+        job = self.queue.submit(self.diff_text)
+        _, first_attempt, *_ = self.queue.claim()
+        self.clock.now += 61
+        _, second_attempt, *_ = self.queue.claim()
+        self.queue.set_progress(job.job_id, first_attempt, 10, 20)
+        self.queue.finish(job.job_id, first_attempt, result=b'[]')
+        self.assertFalse(self.queue.heartbeat(job.job_id, first_attempt))
+        job = self.queue.get(job.job_id)
+        self.assertEqual((job.status, job.processed_lines), (RUNNING, 0))
+        self.queue.finish(job.job_id, second_attempt, result=b'[]')
+        self.assertEqual(self.queue.result(job.job_id), b'[]')
+
+    def test_failed_job_keeps_error(self):
+        job = self.queue.submit(self.diff_text, options={'similarity_backend': 'levenshtein'})
+        self.queue.run(*self.queue.claim())
+        job = self.queue.get(job.job_id)
+        self.assertEqual(job.status, FAILED)
+        self.assertIn('levenshtein', job.error)
+        self.assertIsNone(self.queue.result(job.job_id))
+
+    def test_workers_are_started_for_unfinished_jobs(self):
+        job = self.queue.submit(self.diff_text)
+        job_workers = JobWorkers(self.queue, count=1, poll_seconds=0.05)
+        try:
+            self.assertEqual(len(job_workers.processes), 1)
+            deadline = time.time() + 60
+            while self.queue.get(job.job_id).status != DONE and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(self.queue.get(job.job_id).status, DONE)
+        finally:
+            for process in job_workers.processes:
+                process.terminate()
+
+    def test_done_jobs_expire(self):
+        job = self.queue.submit(self.diff_text)
+        self.queue.run(*self.queue.claim())
+        self.clock.now += self.queue.ttl_seconds + 1
+        self.queue.submit('')
+        self.assertIsNone(self.queue.get(job.job_id))
+
+
+class JobsApiTest(testing.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.temp_dir.name, 'jobs.sqlite'))
+        job_workers = JobWorkers(self.queue, count=0)  # jobs are run by the test
+        self.app = falcon.API()
+        self.app.add_route('/moved-blocks/jobs', main.JobsResource(job_workers, main.MovedBlocksResource()))
+        self.app.add_route('/moved-blocks/jobs/{job_id}', main.JobResource(self.queue))
+        self.app.add_route('/moved-blocks/jobs/{job_id}/result', main.JobResultResource(self.queue))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_submit_poll_and_fetch_result(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=60, seed=5)
+        result = self.simulate_post('/moved-blocks/jobs', json={'diff_text': diff_text})
+        self.assertEqual(result.status, falcon.HTTP_202)
+        job_id = result.json['job_id']
+        self.assertEqual(result.headers['Location'], f'/moved-blocks/jobs/{job_id}')
+        self.assertEqual(self.simulate_get(f'/moved-blocks/jobs/{job_id}').json['status'], QUEUED)
+        self.assertEqual(self.simulate_get(f'/moved-blocks/jobs/{job_id}/result').status, falcon.HTTP_409)
+
+        self.queue.run(*self.queue.claim())
+        self.assertEqual(self.simulate_get(f'/moved-blocks/jobs/{job_id}').json['status'], DONE)
+        result = self.simulate_get(f'/moved-blocks/jobs/{job_id}/result')
+        self.assertEqual(result.status, falcon.HTTP_200)
+        expected = json.dumps(MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks(),
+                              cls=main.CustomJsonEncoder)
+        self.assertEqual(result.text, expected)
+
+    def test_result_of_job_is_in_requested_schema(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=60, seed=5)
+        job_id = self.simulate_post('/moved-blocks/jobs', json={'diff_text': diff_text}).json['job_id']
+        result = self.simulate_post('/moved-blocks/jobs',
+                                    json={'diff_text': diff_text, 'schema': serialization.COMPACT, 'edit_spans': True})
+        self.assertNotEqual(result.json['job_id'], job_id)
+
+        self.queue.run(*self.queue.claim())
+        self.queue.run(*self.queue.claim())
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        self.assertEqual(self.simulate_get(f'/moved-blocks/jobs/{result.json["job_id"]}/result').content,
+                         serialization.blocks_to_json(blocks, schema=serialization.COMPACT, edit_spans=True))
+
+    def test_too_long_request_is_rejected(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=60, seed=5)
+        self.app.add_route('/moved-blocks/limited-jobs', main.JobsResource(
+            JobWorkers(self.queue, count=0), main.MovedBlocksResource(max_request_bytes=len(diff_text) // 2)))
+        result = self.simulate_post('/moved-blocks/limited-jobs', json={'diff_text': diff_text})
+        self.assertEqual(result.status, falcon.HTTP_413)
+        self.assertIsNone(self.queue.claim())
+
+    def test_invalid_diff_is_rejected(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=60, seed=5)
+        diff_text = diff_text.replace('@@ -', '@@ -1000,1000 +1000,1000 @@\n@@ -', 1)
+        result = self.simulate_post('/moved-blocks/jobs', json={'diff_text': diff_text})
+        self.assertEqual((result.status, result.json['title']), (falcon.HTTP_400, 'Invalid diff'))
+        self.assertIsNone(self.queue.claim())
+
+    def test_unknown_job(self):
+        self.assertEqual(self.simulate_get('/moved-blocks/jobs/unknown').status, falcon.HTTP_404)
+        self.assertEqual(self.simulate_get('/moved-blocks/jobs/unknown/result').status, falcon.HTTP_404)
+
+
+if __name__ == '__main__':
+    unittest.main()
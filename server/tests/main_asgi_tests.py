@@ -0,0 +1,149 @@
+import asyncio
+import gzip
+import json
+import time
+import unittest
+
+import falcon.asgi
+from falcon import testing
+
+import main
+import main_asgi
+from budget import EXACT_ONLY
+from detector import MovedBlocksDetector
+from diff_parser import DiffParseError
+from result_cache import ResultCache
+from tests.synthetic_diff import generate_diff
+
+
+class FailingPool(object):
+    timeout_seconds = 1
+
+    def __init__(self, error):
+        self.error = error
+
+    async def run(self, fun, *args):
+        raise self.error
+
+
+class ResultPool(object):
+    """Pool returning the same result of detection for every task."""
+
+    def __init__(self, body, degradations=()):
+        self.result = (body, {'seconds': {}, 'counts': {}, 'degradations': list(degradations)})
+        self.tasks_count = 0
+
+    async def run(self, fun, *args):
+        self.tasks_count += 1
+        return self.result
+
+
+class DetectionPoolTest(unittest.TestCase):
+    def test_runs_tasks_in_workers(self):
+        pool = main_asgi.DetectionPool(workers=2, max_queued=2, timeout_seconds=10)
+
+        async def run_tasks():
+            return await asyncio.gather(*(pool.run(pow, 2, i) for i in range(4)))
+
+        try:
+            self.assertEqual(asyncio.run(run_tasks()), [1, 2, 4, 8])
+        finally:
+            pool.shutdown()
+
+    def test_rejects_tasks_over_workers_and_queue(self):
+        pool = main_asgi.DetectionPool(workers=1, max_queued=1, timeout_seconds=10)
+
+        async def run_tasks():
+            return await asyncio.gather(*(pool.run(time.sleep, 0.2) for _ in range(3)), return_exceptions=True)
+
+        try:
+            results = asyncio.run(run_tasks())
+        finally:
+            pool.shutdown()
+        self.assertEqual(results[:2], [None, None])
+        self.assertIsInstance(results[2], main_asgi.PoolFull)
+
+    def test_times_out(self):
+        pool = main_asgi.DetectionPool(workers=1, max_queued=1, timeout_seconds=0.1)
+        try:
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(pool.run(time.sleep, 1))
+        finally:
+            pool.shutdown()
+
+
+class MovedBlocksResourceTest(unittest.TestCase):
+    def post(self, small_diff_pool, diff_text, result_cache=None, **kwargs):
+        app = falcon.asgi.App()
+        app.add_route('/moved-blocks', main_asgi.MovedBlocksResource(small_diff_pool, None,
+                                                                     small_diff_bytes=1024 * 1024,
+                                                                     result_cache=result_cache))
+
+        async def simulate_post():
+            async with testing.ASGIConductor(app) as conductor:
+                return await conductor.simulate_post('/moved-blocks', **(kwargs or {'json': {'diff_text': diff_text}}))
+
+        return asyncio.run(simulate_post())
+
+    def test_detects_moved_blocks(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=60, seed=1)
+        pool = main_asgi.DetectionPool(workers=1, max_queued=1, timeout_seconds=60)
+        try:
+            result = self.post(pool, diff_text)
+        finally:
+            pool.shutdown()
+        expected = json.dumps(MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks(),
+                              cls=main.CustomJsonEncoder)
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(result.text, expected)
+
+    def test_gzip_raw_diff_and_response(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=60, seed=1)
+        pool = main_asgi.DetectionPool(workers=1, max_queued=1, timeout_seconds=60)
+        try:
+            result = self.post(pool, diff_text, body=gzip.compress(diff_text.encode('utf-8')),
+                               headers={'Content-Type': 'text/x-diff', 'Content-Encoding': 'gzip',
+                                        'Accept-Encoding': 'gzip'})
+        finally:
+            pool.shutdown()
+        expected = json.dumps(MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks(),
+                              cls=main.CustomJsonEncoder)
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(gzip.decompress(result.content).decode('utf-8'), expected)
+
+    def test_degraded_result_is_flagged_and_not_cached(self):
+        result_cache = ResultCache()
+        degraded_pool = ResultPool(b'[]', degradations=[EXACT_ONLY])
+        result = self.post(degraded_pool, 'diff', result_cache)
+        self.assertEqual(result.headers['X-Detection-Degraded'], EXACT_ONLY)
+        self.assertEqual(result_cache.stats()['memory_entries'], 0)
+
+        pool = ResultPool(b'[]')
+        for _ in range(2):
+            result = self.post(pool, 'diff', result_cache)
+            self.assertNotIn('X-Detection-Degraded', result.headers)
+            self.assertEqual(result.content, b'[]')
+        self.assertEqual(pool.tasks_count, 1)
+
+    def test_too_many_requests(self):
+        result = self.post(FailingPool(main_asgi.PoolFull()), '')
+        self.assertEqual(result.status, falcon.HTTP_429)
+        self.assertEqual(result.headers['Retry-After'], '1')
+
+    def test_detection_timeout(self):
+        result = self.post(FailingPool(asyncio.TimeoutError()), '')
+        self.assertEqual(result.status, falcon.HTTP_503)
+
+    def test_invalid_diff(self):
+        result = self.post(FailingPool(DiffParseError('Hunk is shorter than expected')), '')
+        self.assertEqual((result.status, result.json['title']), (falcon.HTTP_400, 'Invalid diff'))
+
+
+class ImportTest(unittest.TestCase):
+    def test_importing_main_does_not_create_wsgi_app(self):
+        self.assertIsNotNone(main_asgi.app)
+        self.assertNotIn('app', vars(main))
+
+
+if __name__ == '__main__':
+    unittest.main()
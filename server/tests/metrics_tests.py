@@ -0,0 +1,91 @@
+import unittest
+
+import falcon
+from falcon import testing
+
+import main
+import metrics
+from detector import MovedBlocksDetector
+from result_cache import ResultCache
+from tests.synthetic_diff import generate_diff
+from time_utils import MeasureTime, collect_durations
+
+
+class HistogramTest(unittest.TestCase):
+    def test_rendered_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', 'stage', (0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe('parse', value)
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{stage="parse",le="0.1"} 1',
+            'test_seconds_bucket{stage="parse",le="1"} 3',
+            'test_seconds_bucket{stage="parse",le="+Inf"} 4',
+            'test_seconds_sum{stage="parse"} 4.05',
+            'test_seconds_count{stage="parse"} 4',
+        ])
+
+
+class MeasureTimeTest(unittest.TestCase):
+    def test_failed_stage_is_reported(self):
+        errors = metrics.STAGE_ERRORS.value('failing_test_stage')
+        with collect_durations() as durations:
+            with self.assertRaises(ValueError):
+                with MeasureTime('failing_test_stage'):
+                    raise ValueError()
+        self.assertIn('failing_test_stage', durations)
+        self.assertEqual(metrics.STAGE_ERRORS.value('failing_test_stage'), errors + 1)
+        self.assertEqual(metrics.STAGE_SECONDS.count('failing_test_stage'), errors + 1)
+
+
+class DetectionCountsTest(unittest.TestCase):
+    def test_counts_of_parallel_detection(self):
+        diff_text = generate_diff(files_count=40, lines_per_file=300, seed=2)
+        serial_detector = MovedBlocksDetector.from_diff(diff_text)
+        serial_detector.detect_moved_blocks()
+        parallel_detector = MovedBlocksDetector.from_diff(diff_text)
+        parallel_detector.detect_moved_blocks(processes=2)
+        self.assertEqual(serial_detector.counts['removed_lines'], len(serial_detector.removed_lines))
+        self.assertGreater(serial_detector.counts['fuzzy_matches'], 0)
+        # texts of lines of both chunks are scored by both workers
+        self.assertGreaterEqual(parallel_detector.counts['scored_texts'], serial_detector.counts['scored_texts'])
+        for name in ('removed_lines', 'created_blocks', 'merged_blocks', 'join_loops_made', 'filtered_blocks',
+                     'detected_blocks'):
+            self.assertEqual(parallel_detector.counts[name], serial_detector.counts[name], name)
+
+
+class ProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.result_cache = ResultCache()
+        self.app = falcon.App()
+        self.app.add_route('/moved-blocks', main.MovedBlocksResource(result_cache=self.result_cache))
+        self.app.add_route('/metrics', main.MetricsResource())
+        self.diff_text = generate_diff(files_count=3, lines_per_file=100, seed=1)
+
+    def post(self, params=None):
+        return testing.TestClient(self.app).simulate_post('/moved-blocks', json={'diff_text': self.diff_text},
+                                                          params=params)
+
+    def test_profile_of_request(self):
+        result = self.post({'profile': '1'})
+        self.assertEqual(result.status, falcon.HTTP_200)
+        profile = result.json['profile']
+        for stage in ('post_moved_blocks', 'diff_to_lines', 'detect_moved_blocks', 'grow_blocks', 'blocks_to_json'):
+            self.assertIn(stage, profile['seconds'])
+        self.assertGreater(profile['counts']['detected_blocks'], 0)
+        self.assertEqual(profile['counts']['detected_blocks'], len(result.json['result']))
+        # a profiled result is not cached
+        self.assertEqual(self.result_cache.stats()['memory_entries'], 0)
+        self.assertEqual(self.post().json, result.json['result'])
+
+    def test_metrics(self):
+        self.post()
+        result = testing.TestClient(self.app).simulate_get('/metrics')
+        self.assertEqual(result.headers['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('reviewraccoon_stage_seconds_count{stage="detect_moved_blocks"}', result.text)
+        self.assertIn('reviewraccoon_detection_count_bucket{count="join_loops_made",le="+Inf"}', result.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
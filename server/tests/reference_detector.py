@@ -0,0 +1,111 @@
+"""Former implementations of steps of MovedBlocksDetector kept as oracles of the current ones, and fixtures of
+diffs they are compared on - used by tests and benchmarks alike.
+"""
+from collections import defaultdict
+
+from detector import LineTable, MatchingBlock
+
+
+def linear_scan_grow_blocks(detector, removed_indexes, fuzzy_matching_pairs_by_text):
+    """grow_blocks as it was before blocks were indexed by their next added line (without max_new_blocks_per_line)."""
+    removed_lines = detector.removed_lines
+    added_lines = detector.added_lines
+    detected_blocks = []
+    currently_matching_blocks = []
+    new_matching_blocks = []
+    for removed_index in removed_indexes:
+        removed_trim_text = removed_lines.trim_text(removed_index)
+        if removed_trim_text:
+            fuzzy_matching_pairs = fuzzy_matching_pairs_by_text[removed_trim_text]
+            detector.extend_matching_blocks_with_empty_added_lines_if_possible(currently_matching_blocks)
+        else:
+            fuzzy_matching_pairs = [[1, '']]
+        if not fuzzy_matching_pairs:
+            continue
+        for match_probability, text in fuzzy_matching_pairs:
+            for added_index in detector.added_indexes_by_trim_text.get(text, ()):
+                line_extended_any_block = False
+                already_added = set()
+                for i, matching_block in enumerate(currently_matching_blocks):
+                    if i in already_added:
+                        continue
+                    if matching_block.try_extend_with_indexes(removed_index, added_index, match_probability):
+                        new_matching_blocks.append(matching_block)
+                        line_extended_any_block = True
+                        already_added.add(i)
+                if not line_extended_any_block and removed_trim_text != '':
+                    new_matching_blocks.append(MatchingBlock.from_indexes(removed_lines, added_lines, removed_index,
+                                                                          added_index, match_probability))
+                currently_matching_blocks = [matching_block for i, matching_block in
+                                             enumerate(currently_matching_blocks) if i not in already_added]
+        if removed_trim_text == '':
+            extended_blocks, not_extended_blocks = \
+                detector.extend_matching_blocks_with_empty_removed_lines_if_possible(currently_matching_blocks)
+            new_matching_blocks.extend(extended_blocks)
+            currently_matching_blocks = not_extended_blocks
+        detected_blocks.extend(currently_matching_blocks)
+        currently_matching_blocks = new_matching_blocks
+        new_matching_blocks = []
+    return detected_blocks, currently_matching_blocks
+
+
+def fragments(fragments_count, chain_length):
+    """Return blocks of 2 lines with one not matching line between them, chained in groups of chain_length."""
+    removed_lines = LineTable()
+    added_lines = LineTable()
+    blocks = []
+    line_no = 1
+    for i in range(fragments_count):
+        if i % chain_length == 0:
+            line_no += 10  # too far to join with the previous chain
+        indexes = []
+        for offset in range(2):
+            text = f'fragment_{i}_line_{offset}()'
+            indexes.append((removed_lines.append('removed.py', line_no + offset, text),
+                            added_lines.append('added.py', line_no + offset, text)))
+        block = MatchingBlock.from_indexes(removed_lines, added_lines, *indexes[0])
+        block.extend_with_indexes(*indexes[1], 1)
+        blocks.append(block)
+        line_no += 3
+    return blocks
+
+
+def pairwise_join(detector, matching_blocks, max_space_between=2):
+    """join_nearby_blocks as it was before the one sweep join, merging blocks pair by pair."""
+    max_space_between += 1
+    blocks_grouped_by_files = defaultdict(list)
+    for block in matching_blocks:
+        blocks_grouped_by_files[(block.file_removed, block.file_added)].append(block)
+    blocks_after_merge = []
+    for block_list in blocks_grouped_by_files.values():
+        block_list.sort(key=lambda block: (block.first_removed_line_no, -block.match_density))
+        indexes_of_merged_blocks = set()
+        merged_blocks_list = []
+        for i in range(len(block_list)):
+            block = block_list[i]
+            for j in range(i+1, len(block_list)):
+                next_block = block_list[j]
+                if next_block.first_removed_line_no - block.last_removed_line_no > max_space_between:
+                    break
+                elif (next_block.first_removed_line_no > block.last_removed_line_no
+                        and next_block.first_added_line_no - block.last_added_line_no <= max_space_between
+                        and next_block.first_added_line_no > block.last_added_line_no):
+                    block = detector.merge_blocks([block, next_block])
+                    indexes_of_merged_blocks.add(i)
+                    indexes_of_merged_blocks.add(j)
+            if i in indexes_of_merged_blocks:
+                merged_blocks_list.append(block)
+        for i in range(len(block_list)):
+            if i not in indexes_of_merged_blocks:
+                blocks_after_merge.append(block_list[i])
+        blocks_after_merge.extend(merged_blocks_list)
+    return blocks_after_merge
+
+
+def braces_diff(lines_count):
+    """Return diff removing lines_count lines of `}` from one file and adding them to another one."""
+    lines = ['diff --git a/old.c b/old.c', '--- a/old.c', '+++ b/old.c', f'@@ -1,{lines_count} +0,0 @@']
+    lines.extend('-}' for _ in range(lines_count))
+    lines.extend(['diff --git a/new.c b/new.c', '--- a/new.c', '+++ b/new.c', f'@@ -0,0 +1,{lines_count} @@'])
+    lines.extend('+}' for _ in range(lines_count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from result_cache import ResultCache
+from tests.fake_clock import FakeClock
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.disk_path = os.path.join(self.temp_dir.name, 'results.sqlite')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key_depends_on_diff_text_and_params(self):
+        key = ResultCache.make_key("diff", 2)
+        self.assertEqual(key, ResultCache.make_key("diff", 2))
+        self.assertNotEqual(key, ResultCache.make_key("diff", 3))
+        self.assertNotEqual(key, ResultCache.make_key("diff2", 2))
+
+    def test_memory_tier_evicts_least_recently_used_entries_over_byte_budget(self):
+        cache = ResultCache(max_memory_bytes=10, time_function=self.clock)
+        cache.set('a', b'aaaa')
+        cache.set('b', b'bbbb')
+        self.assertEqual(cache.get('a'), b'aaaa')
+        cache.set('c', b'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.get('c'), b'cccc')
+        self.assertEqual(cache.stats()['memory_bytes'], 8)
+        self.assertEqual(cache.stats()['memory_hits'], 3)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = ResultCache(ttl_seconds=60, disk_path=self.disk_path, time_function=self.clock)
+        cache.set('a', b'aaaa')
+        self.clock.now += 59
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.clock.now += 2
+        self.assertIsNone(cache.get('a'))
+
+    def test_disk_tier_is_shared_between_caches(self):
+        ResultCache(disk_path=self.disk_path, time_function=self.clock).set('a', b'aaaa')
+        other_cache = ResultCache(disk_path=self.disk_path, time_function=self.clock)
+        self.assertEqual(other_cache.get('a'), b'aaaa')
+        self.assertEqual(other_cache.get('a'), b'aaaa')
+        self.assertEqual(other_cache.stats()['disk_hits'], 1)
+        self.assertEqual(other_cache.stats()['memory_hits'], 1)
+
+    def test_entries_read_from_disk_expire_when_stored_ones_do(self):
+        ResultCache(ttl_seconds=60, disk_path=self.disk_path, time_function=self.clock).set('a', b'aaaa')
+        self.clock.now += 50
+        other_cache = ResultCache(ttl_seconds=60, disk_path=self.disk_path, time_function=self.clock)
+        self.assertEqual(other_cache.get('a'), b'aaaa')
+        self.clock.now += 11
+        self.assertIsNone(other_cache.get('a'))
+
+    def test_disk_tier_evicts_least_recently_used_entries_over_size_limit(self):
+        cache = ResultCache(max_memory_bytes=0, disk_path=self.disk_path, max_disk_bytes=10, time_function=self.clock)
+        cache.set('a', b'aaaa')
+        self.clock.now += 1
+        cache.set('b', b'bbbb')
+        self.clock.now += 1
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.clock.now += 1
+        cache.set('c', b'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.get('c'), b'cccc')
@@ -0,0 +1,52 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import reviewraccoon
+import serialization
+from detector import MovedBlocksDetector
+from tests.synthetic_diff import generate_diff
+
+
+class DetectCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.diff_text = generate_diff(files_count=5, lines_per_file=100, seed=4)
+        self.diff_path = os.path.join(self.temp_dir.name, 'pr.diff')
+        with open(self.diff_path, 'w', encoding='utf-8') as diff_file:
+            diff_file.write(self.diff_text)
+        self.output_path = os.path.join(self.temp_dir.name, 'blocks.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_output(self):
+        with open(self.output_path, 'rb') as output_file:
+            return output_file.read()
+
+    def test_output_is_the_same_as_response_of_the_endpoint(self):
+        for schema in serialization.SCHEMAS:
+            self.assertEqual(reviewraccoon.main(['detect', self.diff_path, '--output', self.output_path,
+                                                 '--schema', schema, '--min-lines-count', '3']), 0)
+            blocks = MovedBlocksDetector.from_diff(self.diff_text).detect_moved_blocks(3)
+            self.assertEqual(self.read_output(), serialization.blocks_to_json(blocks, schema=schema))
+
+    def test_empty_diff(self):
+        open(self.diff_path, 'w').close()
+        self.assertEqual(reviewraccoon.main(['detect', self.diff_path, '--output', self.output_path]), 0)
+        self.assertEqual(json.loads(self.read_output()), [])
+
+    def test_invalid_diff(self):
+        with open(self.diff_path, 'w') as diff_file:
+            diff_file.write('@@ -1 +1 @@\n-a\n+b\n')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(reviewraccoon.main(['detect', self.diff_path, '--output', self.output_path]), 1)
+        self.assertIn('Unexpected hunk found', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import unittest
+import warnings
+
+import falcon
+from falcon import testing
+from falcon.util.deprecation import DeprecatedWarning
+
+import main
+import serialization
+from detector import LineTable, MatchingBlock, MovedBlocksDetector
+from tests.synthetic_diff import generate_diff
+
+
+def padded_block():
+    removed_lines = LineTable()
+    added_lines = LineTable()
+    texts = ['\tdef "quoted"(self):', '        return "zażółć" \\ 1', '', '    pass']
+    for offset, text in enumerate(texts):
+        removed_lines.append('old/ünicode.py', 10 + offset, text)
+        added_lines.append('new.py', 20 + offset, text)
+    block = MatchingBlock.from_indexes(removed_lines, added_lines, 0, 0)
+    block.extend_with_indexes(1, 1, 0.8765432)
+    block.extend_with_empty_removed_index(2)
+    block.extend_with_empty_added_index(2)
+    block.extend_with_indexes(3, 3, 1)
+    return block
+
+
+class FullSchemaTest(unittest.TestCase):
+    def test_is_the_same_as_json_of_blocks(self):
+        blocks = [padded_block(), padded_block()]
+        self.assertEqual(serialization.blocks_to_json(blocks),
+                         json.dumps(blocks, cls=main.CustomJsonEncoder).encode('utf-8'))
+        self.assertEqual(serialization.blocks_to_json([]), b'[]')
+
+    def test_is_the_same_as_json_of_detected_blocks(self):
+        diff_text = generate_diff(files_count=4, lines_per_file=200, edit_noise=0.3, seed=2)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        self.assertTrue(blocks)
+        self.assertEqual(serialization.blocks_to_json(blocks),
+                         json.dumps(blocks, cls=main.CustomJsonEncoder).encode('utf-8'))
+
+    def test_is_encoded_in_chunks(self):
+        diff_text = generate_diff(files_count=10, lines_per_file=300, seed=3)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        chunks = list(serialization.encode_blocks(blocks))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), serialization.blocks_to_json(blocks))
+
+
+class CompactSchemaTest(unittest.TestCase):
+    def test_runs_of_line_numbers(self):
+        result = json.loads(serialization.blocks_to_json([padded_block()], serialization.COMPACT))
+        self.assertEqual(result, {
+            'files': ['old/ünicode.py', 'new.py'],
+            'blocks': [{
+                'removed_file': 0,
+                'added_file': 1,
+                'runs': [[10, 20, 2], [12, None, 1], [None, 22, 1], [13, 23, 1]],
+                'match_probabilities': [1, 0.877, 0, 0, 1],
+            }],
+        })
+
+    def test_has_lines_of_full_schema(self):
+        diff_text = generate_diff(files_count=4, lines_per_file=200, edit_noise=0.3, seed=2)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        full = json.loads(serialization.blocks_to_json(blocks))
+        compact = json.loads(serialization.blocks_to_json(blocks, serialization.COMPACT))
+        self.assertEqual(len(compact['blocks']), len(full))
+        for block, full_block in zip(compact['blocks'], full):
+            lines = []
+            for removed_line_no, added_line_no, count in block['runs']:
+                for offset in range(count):
+                    lines.append((removed_line_no + offset if removed_line_no is not None else None,
+                                  added_line_no + offset if added_line_no is not None else None))
+            self.assertEqual(lines, [(line['removed_line'] and line['removed_line']['line_no'],
+                                      line['added_line'] and line['added_line']['line_no'])
+                                     for line in full_block['lines']])
+            self.assertEqual(compact['files'][block['removed_file']],
+                             [line['removed_line'] for line in full_block['lines'] if line['removed_line']][0]['file'])
+            self.assertEqual(compact['files'][block['added_file']],
+                             [line['added_line'] for line in full_block['lines'] if line['added_line']][0]['file'])
+            for probability, line in zip(block['match_probabilities'], full_block['lines']):
+                self.assertAlmostEqual(probability, line['match_probability'], places=3)
+
+    def test_unknown_schema(self):
+        with self.assertRaises(ValueError):
+            serialization.blocks_to_json([], 'xml')
+
+
+class MovedBlocksResourceTest(unittest.TestCase):
+    def post(self, media):
+        app = falcon.App()
+        app.add_route('/moved-blocks', main.MovedBlocksResource())
+        return testing.TestClient(app).simulate_post('/moved-blocks', json=media)
+
+    def test_streams_blocks_in_schema(self):
+        diff_text = generate_diff(files_count=3, lines_per_file=100, seed=1)
+        blocks = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        result = self.post({'diff_text': diff_text})
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(result.content, serialization.blocks_to_json(blocks))
+        result = self.post({'diff_text': diff_text, 'schema': serialization.COMPACT})
+        self.assertEqual(result.content, serialization.blocks_to_json(blocks, serialization.COMPACT))
+        result = self.post({'diff_text': diff_text, 'edit_spans': True})
+        self.assertEqual(result.content, serialization.blocks_to_json(blocks, edit_spans=True))
+
+    def test_unknown_schema(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecatedWarning)
+            result = self.post({'diff_text': '', 'schema': 'xml'})
+        self.assertEqual((result.status, result.json['title']), (falcon.HTTP_400, 'Unknown schema'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import warnings
+
+import falcon
+from falcon import testing
+from falcon.util.deprecation import DeprecatedWarning
+
+import main
+import similarity
+from detector import MovedBlocksDetector
+from tests.synthetic_diff import generate_diff
+
+
+class SimilarityBackendsTest(unittest.TestCase):
+    def create_backend(self, name, texts):
+        backend = similarity.create_backend(name)
+        for text in texts:
+            backend.add(text)
+        return backend
+
+    def test_fuzzyset_backend_returns_fuzzy_set_matches(self):
+        backend = self.create_backend('fuzzyset', ['def calculate_total(items):', 'return None'])
+        matches, no_matches = backend.get_many(['def calculate_totals(items):', 'xyz'], 0.5)
+        self.assertEqual(matches[0][1], 'def calculate_total(items):')
+        self.assertIsNone(no_matches)
+
+    def test_minhash_backend_finds_equal_and_similar_texts(self):
+        texts = [f'value_{i} = compute_something(argument_{i}, other_argument)' for i in range(200)]
+        backend = self.create_backend('minhash', texts + ['Same Text', 'same text'])
+        equal, similar, lowercase, empty = backend.get_many(
+            [texts[10], texts[20] + ' + 1', 'SAME TEXT', ''], 0.5)
+        self.assertEqual(equal[0], (1.0, texts[10]))
+        self.assertEqual(similar[0][1], texts[20])
+        self.assertTrue(all(score >= 0.5 for score, _ in similar))
+        self.assertEqual(similar, sorted(similar, key=lambda match: -match[0]))
+        self.assertEqual(lowercase, [(1.0, 'Same Text')])
+        self.assertIsNone(empty)
+
+    def test_minhash_backend_matches_are_fuzzy_set_matches(self):
+        added_texts = [f'item_{i % 50}.update(name="{i}")' for i in range(300)]
+        removed_texts = [f'item_{i % 50}.update(name="{i + 1}")' for i in range(100)]
+        fuzzy_set_matches = self.create_backend('fuzzyset', added_texts).get_many(removed_texts, 0.5)
+        minhash_matches = self.create_backend('minhash', added_texts).get_many(removed_texts, 0.5)
+        for expected, matches in zip(fuzzy_set_matches, minhash_matches):
+            for score, text in matches or ():
+                self.assertIn(text, [expected_text for _, expected_text in expected])
+
+    def test_exact_backend_matches_texts_equal_up_to_whitespaces(self):
+        backend = self.create_backend('exact', ['a  =  b', 'a = b', 'a = c'])
+        matches, no_matches = backend.get_many(['a =\tb', 'a = d'], 0.5)
+        self.assertEqual(matches, [(1, 'a  =  b'), (1, 'a = b')])
+        self.assertIsNone(no_matches)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            similarity.create_backend('levenshtein')
+
+    def test_unknown_backend_of_request(self):
+        app = falcon.App()
+        app.add_route('/moved-blocks', main.MovedBlocksResource())
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecatedWarning)
+            result = testing.TestClient(app).simulate_post('/moved-blocks', json={
+                'diff_text': '', 'similarity_backend': 'levenshtein'})
+        self.assertEqual((result.status, result.json['title']), (falcon.HTTP_400, 'Unknown similarity backend'))
+
+    def test_detector_with_every_backend_finds_moved_blocks(self):
+        diff_text = generate_diff(files_count=4, lines_per_file=100, seed=3)
+        expected = MovedBlocksDetector.from_diff(diff_text).detect_moved_blocks()
+        for name in similarity.BACKENDS:
+            with self.subTest(backend=name):
+                blocks = MovedBlocksDetector.from_diff(diff_text, similarity_backend=name).detect_moved_blocks()
+                self.assertTrue(blocks)
+                if name != similarity.ExactBackend.name:
+                    self.assertEqual(len(blocks), len(expected))
+
+    def test_detection_state_is_kept_only_with_fuzzyset_backend(self):
+        with self.assertRaises(ValueError):
+            MovedBlocksDetector([], [], keep_state=True, similarity_backend='exact')
+
+
+if __name__ == '__main__':
+    unittest.main()
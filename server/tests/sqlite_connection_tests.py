@@ -0,0 +1,39 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlite_connection import ProcessConnection
+
+
+def create_table(connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS items (value INTEGER)')
+
+
+class ProcessConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.connection = ProcessConnection(os.path.join(self.temp_dir.name, 'items.sqlite'), create_table)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_connection_is_set_up_once_per_process(self):
+        connection = self.connection.get()
+        connection.execute('INSERT INTO items VALUES (1)')
+        self.assertIs(self.connection.get(), connection)
+        self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            forked_connection = self.connection.get()
+        self.assertIsNot(forked_connection, connection)
+        self.assertEqual(forked_connection.execute('SELECT value FROM items').fetchall(), [(1,)])
+
+    def test_pickled_connection_opens_its_own_one(self):
+        self.connection.get().execute('INSERT INTO items VALUES (2)')
+        unpickled = pickle.loads(pickle.dumps(self.connection))
+        self.assertEqual(unpickled.get().execute('SELECT value FROM items').fetchall(), [(2,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
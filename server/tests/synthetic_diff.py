@@ -0,0 +1,117 @@
+"""Synthetic diffs used by tests and benchmarks alike (see also tests/reference_detector.py).
+
+Benchmarks import their diffs and reference implementations from the tests package, never the other way round,
+so the test suite does not depend on any benchmark script.
+"""
+import random
+import string
+
+INDENTS = ['', '    ', '        ', '            ']
+REPEATED_LINES = ['}', 'return None', 'end', ')', 'else:', 'pass', '']
+
+
+class SyntheticDiff(object):
+    """Generator of git-style unified diffs in which blocks of lines are moved between files.
+
+    files_count files of lines_per_file lines are generated, move_ratio of their lines is removed in hunks
+    and re-added (as a whole block) in some other place, edit_noise is the probability that a moved line is
+    slightly changed on the way, repetition is the share of low information lines (like `}`).
+    """
+
+    def __init__(self, files_count=10, lines_per_file=200, move_ratio=0.3, edit_noise=0.1, repetition=0.1,
+                 vocabulary_size=2000, seed=0):
+        self.files_count = files_count
+        self.lines_per_file = lines_per_file
+        self.move_ratio = move_ratio
+        self.edit_noise = edit_noise
+        self.repetition = repetition
+        self.random = random.Random(seed)
+        self.vocabulary = [self._random_word() for _ in range(vocabulary_size)]
+
+    def _random_word(self):
+        return ''.join(self.random.choice(string.ascii_letters + '_') for _ in range(self.random.randint(2, 12)))
+
+    def _random_line(self):
+        if self.random.random() < self.repetition:
+            return self.random.choice(REPEATED_LINES)
+        words = [self.random.choice(self.vocabulary) for _ in range(self.random.randint(1, 8))]
+        return self.random.choice(INDENTS) + ' '.join(words)
+
+    def _edit(self, line):
+        if not line.strip() or self.random.random() >= self.edit_noise:
+            return line
+        chars = list(line)
+        chars[self.random.randrange(len(chars))] = self.random.choice(string.ascii_lowercase)
+        return ''.join(chars)
+
+    def _removed_hunks(self, lines):
+        """Return list of (first line number, lines count) of hunks removed from file."""
+        hunks = []
+        line_no = 1
+        while True:
+            line_no += self.random.randint(3, 30)
+            count = self.random.randint(2, 20)
+            if line_no + count >= len(lines):
+                break
+            if self.random.random() < self.move_ratio * 2:
+                hunks.append((line_no, count))
+                line_no += count
+        return hunks
+
+    def generate(self):
+        files = [(f'src/module_{i}/file_{i}.py', [self._random_line() for _ in range(self.lines_per_file)])
+                 for i in range(self.files_count)]
+        removed_hunks = {path: self._removed_hunks(lines) for path, lines in files}
+        moved_blocks = [lines[line_no - 1:line_no - 1 + count]
+                        for path, lines in files for line_no, count in removed_hunks[path]]
+        self.random.shuffle(moved_blocks)
+
+        diff_lines = []
+        for path, lines in files:
+            diff_lines.extend([
+                f'diff --git a/{path} b/{path}',
+                'index 0123456..789abcd 100644',
+                f'--- a/{path}',
+                f'+++ b/{path}',
+            ])
+            offset = 0
+            for line_no, count in removed_hunks[path]:
+                added = [self._edit(line) for line in moved_blocks.pop()] if moved_blocks else []
+                context = lines[line_no - 2]
+                diff_lines.append(f'@@ -{line_no - 1},{count + 1} +{line_no - 1 + offset},{len(added) + 1} @@')
+                diff_lines.append(' ' + context)
+                diff_lines.extend('-' + line for line in lines[line_no - 1:line_no - 1 + count])
+                diff_lines.extend('+' + line for line in added)
+                offset += len(added) - count
+        return '\n'.join(diff_lines) + '\n'
+
+
+def generate_diff(**kwargs):
+    return SyntheticDiff(**kwargs).generate()
+
+
+def generate_wide_diff(files_count, edited_lines, moves_count, move_lines, seed=0):
+    """Return diff of files_count files with edited_lines lines of each edited in place (removed and added back
+    with a change, as a rename of a symbol would do) and moves_count blocks of move_lines lines moved between
+    random files."""
+    synthetic = SyntheticDiff(seed=seed)
+    rng = random.Random(seed)
+    files = {f'src/package_{i}/module_{i}.py': [synthetic._random_line() for _ in range(edited_lines + move_lines)]
+             for i in range(files_count)}
+    paths = list(files)
+    moved_from = set(rng.sample(paths, min(moves_count, len(paths))))
+    moved_to = {path: rng.choice(paths) for path in moved_from}
+    added_blocks = {path: [] for path in paths}
+    for path in moved_from:
+        added_blocks[moved_to[path]].append(files[path][edited_lines:])
+    diff_lines = []
+    for path, lines in files.items():
+        removed = lines[:edited_lines] + (lines[edited_lines:] if path in moved_from else [])
+        added = [f'{line} and_more' if line.strip() else line for line in lines[:edited_lines]]
+        for block in added_blocks[path]:
+            added.extend(block)
+        diff_lines.extend([f'diff --git a/{path} b/{path}', f'--- a/{path}', f'+++ b/{path}',
+                           f'@@ -1,{len(removed)} +1,{len(added)} @@'])
+        diff_lines.extend('-' + line for line in removed)
+        diff_lines.extend('+' + line for line in added)
+    return '\n'.join(diff_lines) + '\n'
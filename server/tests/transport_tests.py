@@ -0,0 +1,116 @@
+import gzip
+import io
+import json
+import unittest
+from unittest import mock
+
+import falcon
+from falcon import testing
+
+import diff_parser
+import main
+import transport
+from result_cache import ResultCache
+from tests.synthetic_diff import generate_diff
+
+
+class IterateTextLinesTest(unittest.TestCase):
+    def test_lines_are_the_same_as_of_text(self):
+        text = 'first\r\nzażółć\n\n+ gęślą jaźń\nlast without line end'
+        for chunk_bytes in (1, 2, 3, 1024):
+            with mock.patch.object(transport, 'READ_CHUNK_BYTES', chunk_bytes):
+                lines = list(transport.iterate_text_lines(io.BytesIO(text.encode('utf-8'))))
+            self.assertEqual(lines, list(diff_parser.iterate_lines(text)))
+
+    def test_corrupted_body(self):
+        body = gzip.compress(b'some diff\n' * 100)[:-20]
+        with self.assertRaises(transport.InvalidBody):
+            list(transport.iterate_text_lines(transport.decompressed(io.BytesIO(body), 'gzip')))
+
+    def test_hashed_lines_give_key_of_text(self):
+        text = generate_diff(files_count=2, lines_per_file=50, seed=1)
+        digest = ResultCache.key_digest(3, 'full')
+        self.assertEqual(list(transport.hashed_lines(diff_parser.iterate_lines(text), [digest])),
+                         list(diff_parser.iterate_lines(text)))
+        self.assertEqual(digest.hexdigest(), ResultCache.make_key(text, 3, 'full'))
+
+    def test_unsupported_encoding(self):
+        with self.assertRaises(transport.UnsupportedEncoding):
+            transport.decompressed(io.BytesIO(b''), 'br')
+
+
+class ResponseEncodingTest(unittest.TestCase):
+    def test_preferred_supported_encoding(self):
+        preferred = transport.supported_encodings()[0]
+        self.assertIsNone(transport.response_encoding(None))
+        self.assertIsNone(transport.response_encoding('br, deflate'))
+        self.assertEqual(transport.response_encoding('gzip, deflate, br'), transport.GZIP)
+        self.assertEqual(transport.response_encoding('gzip;q=0.5, *'), preferred)
+        self.assertEqual(transport.response_encoding('*'), preferred)
+        self.assertIsNone(transport.response_encoding('gzip;q=0, zstd;q=0'))
+
+    def test_compressed_chunks(self):
+        chunks = [b'first chunk ' * 100, b'', b'second chunk ' * 100]
+        self.assertEqual(gzip.decompress(b''.join(transport.compress_chunks(chunks, transport.GZIP))),
+                         b''.join(chunks))
+        self.assertEqual(list(transport.compress_chunks(chunks, None)), chunks)
+
+
+class MovedBlocksResourceTest(unittest.TestCase):
+    def setUp(self):
+        self.diff_text = generate_diff(files_count=3, lines_per_file=100, seed=1)
+        self.expected = testing.TestClient(self.app()).simulate_post('/moved-blocks', json={
+            'diff_text': self.diff_text, 'min_lines_count': 3, 'exact_anchors': True})
+
+    @staticmethod
+    def app():
+        app = falcon.App()
+        app.add_route('/moved-blocks', main.MovedBlocksResource(result_cache=ResultCache()))
+        return app
+
+    def post(self, body, headers, params=None):
+        return testing.TestClient(self.app()).simulate_post('/moved-blocks', body=body, headers=headers,
+                                                            params=params)
+
+    def test_gzip_raw_diff(self):
+        result = self.post(gzip.compress(self.diff_text.encode('utf-8')),
+                           {'Content-Type': 'text/x-diff', 'Content-Encoding': 'gzip'},
+                           {'min_lines_count': '3', 'exact_anchors': 'true'})
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(result.content, self.expected.content)
+        self.assertEqual(result.headers['X-Result-Token'], self.expected.headers['X-Result-Token'])
+
+    def test_gzip_json(self):
+        body = json.dumps({'diff_text': self.diff_text, 'min_lines_count': 3, 'exact_anchors': True})
+        result = self.post(gzip.compress(body.encode('utf-8')),
+                           {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        self.assertEqual(result.content, self.expected.content)
+
+    def test_compressed_response(self):
+        result = self.post(self.diff_text, {'Content-Type': 'text/x-diff', 'Accept-Encoding': 'gzip'},
+                           {'min_lines_count': '3', 'exact_anchors': '1'})
+        self.assertEqual(result.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(result.content), self.expected.content)
+
+    def test_invalid_bodies(self):
+        self.assertEqual(self.post(b'diff', {'Content-Type': 'text/x-diff', 'Content-Encoding': 'br'}).status,
+                         falcon.HTTP_415)
+        self.assertEqual(self.post(gzip.compress(self.diff_text.encode('utf-8'))[:-20],
+                                   {'Content-Type': 'text/x-diff', 'Content-Encoding': 'gzip'}).status,
+                         falcon.HTTP_400)
+        self.assertEqual(self.post(gzip.compress(b'[1, 2'),
+                                   {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}).status,
+                         falcon.HTTP_400)
+        self.assertEqual(self.post(self.diff_text, {'Content-Type': 'text/x-diff'}, {'min_lines_count': 'x'}).status,
+                         falcon.HTTP_400)
+
+    def test_invalid_diffs(self):
+        diff_text = self.diff_text.replace('@@ -', '@@ -1000,1000 +1000,1000 @@\n@@ -', 1)
+        result = self.post(diff_text, {'Content-Type': 'text/x-diff'})
+        self.assertEqual((result.status, result.json['title']), (falcon.HTTP_400, 'Invalid diff'))
+        result = self.post(json.dumps({'diff_text': diff_text}), {'Content-Type': 'application/json'})
+        self.assertEqual((result.status, result.json['title']), (falcon.HTTP_400, 'Invalid diff'))
+
+
+if __name__ == '__main__':
+    unittest.main()
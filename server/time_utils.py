@@ -1,9 +1,24 @@
+import contextlib
 import functools
 import logging
+import threading
 import time
+from collections import defaultdict
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# collectors of this thread - dicts of stat name -> total duration collected by collect_durations
+_local = threading.local()
+
+
+def _collectors():
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    return collectors
+
 
 class MeasureTime:
     def __init__(self, stat_name):
@@ -11,18 +26,35 @@ class MeasureTime:
         self._start_time = None
 
     def __enter__(self):
-        self._start_time = time.time()
+        self._start_time = time.perf_counter()
         return self
 
     def __exit__(self, exc_type, _exc_val, _exc_tb):
-        if exc_type is not None:  # exception was thrown
-            return
-        duration = time.time() - self._start_time
-        self.report(duration)
+        duration = time.perf_counter() - self._start_time
+        self.report(duration, failed=exc_type is not None)
 
-    def report(self, duration):
+    def report(self, duration, failed=False):
+        """Log duration, add it to collectors of this thread and observe it in metrics."""
         stat_name = self._stat_name
-        logger.debug(f"{stat_name} took {duration:.3f} seconds")
+        if failed:
+            logger.debug(f"{stat_name} failed after {duration:.3f} seconds")
+        else:
+            logger.debug(f"{stat_name} took {duration:.3f} seconds")
+        for durations in _collectors():
+            durations[stat_name] += duration
+        metrics.observe_stage(stat_name, duration, failed)
+
+
+@contextlib.contextmanager
+def collect_durations():
+    """Return dict of total durations by stat name measured in this thread within the with block."""
+    durations = defaultdict(float)
+    collectors = _collectors()
+    collectors.append(durations)
+    try:
+        yield durations
+    finally:
+        collectors.remove(durations)
 
 
 def measure_fun_time():
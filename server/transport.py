@@ -0,0 +1,191 @@
+"""Compressed and raw request bodies and compressed responses of the API.
+
+A diff is posted either as JSON ({"diff_text": ..., other fields of the request}) or as raw text with Content-Type
+text/x-diff (or text/x-patch, text/plain) and other fields of the request in the query string. Either may be
+compressed with Content-Encoding gzip or zstd (zstd needs the zstandard package). A raw diff is decompressed and
+decoded chunk by chunk into lines for the diff parser, so neither the compressed body nor the whole text of the diff
+is kept in memory.
+
+Responses are compressed with zstd or gzip if the client accepts it (Accept-Encoding).
+"""
+import codecs
+import gzip
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # only gzip is supported
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+IDENTITY = 'identity'
+
+DIFF_CONTENT_TYPES = ('text/x-diff', 'text/x-patch', 'text/plain')
+
+# Bodies are decompressed and decoded in chunks of this size.
+READ_CHUNK_BYTES = 64 * 1024
+# Smaller response bodies are sent as they are.
+MIN_COMPRESSED_BYTES = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class InvalidBody(ValueError):
+    pass
+
+
+def supported_encodings():
+    return [ZSTD, GZIP] if zstandard is not None else [GZIP]
+
+
+def decompressed(stream, content_encoding):
+    """Return binary file-like object reading stream decompressed according to Content-Encoding header value."""
+    encoding = (content_encoding or IDENTITY).strip().lower()
+    if encoding == IDENTITY:
+        return stream
+    if encoding in (GZIP, 'x-gzip'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise UnsupportedEncoding(f'Unsupported Content-Encoding: {content_encoding}, supported ones are: '
+                              f'{", ".join(supported_encodings() + [IDENTITY])}')
+
+
+def read(stream):
+    """Return all bytes of (decompressed) stream."""
+    chunks = []
+    while True:
+        try:
+            chunk = stream.read(READ_CHUNK_BYTES)
+        except _DECOMPRESSION_ERRORS as e:
+            raise InvalidBody(f'Body could not be decompressed: {e}')
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def iterate_text_lines(stream):
+    """Yield lines (with line ends, split at \\n only as diff_parser does) of UTF-8 text read from stream."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    rest = ''
+    while True:
+        try:
+            chunk = stream.read(READ_CHUNK_BYTES)
+        except _DECOMPRESSION_ERRORS as e:
+            raise InvalidBody(f'Body could not be decompressed: {e}')
+        lines = (rest + decoder.decode(chunk, final=not chunk)).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if not chunk:
+            break
+    if rest:
+        yield rest
+
+
+def hashed_lines(lines, digests):
+    """Yield lines updating digests (see ResultCache.key_digest) with every one of them."""
+    for line in lines:
+        encoded_line = line.encode('utf-8', 'surrogatepass')
+        for digest in digests:
+            digest.update(encoded_line)
+        yield line
+
+
+def is_diff_content_type(content_type):
+    return (content_type or '').split(';')[0].strip().lower() in DIFF_CONTENT_TYPES
+
+
+def media_of_params(params):
+    """Return fields of a request with a raw diff given in its query string params (values are strings)."""
+    media = dict(params)
+    try:
+        if media.get('min_lines_count'):
+            media['min_lines_count'] = int(media['min_lines_count'])
+    except ValueError:
+        raise InvalidBody(f'min_lines_count should be a number, not: {media["min_lines_count"]}')
+    for name in ('exact_anchors', 'edit_spans'):
+        if name in media:
+            media[name] = media[name].lower() in ('1', 'true', 'yes')
+    return media
+
+
+def read_request(stream, content_type, content_encoding, params):
+    """Return (fields of request, diff) of request body stream, diff is the text of a JSON request and iterator of
+    lines of a raw one - it is read only as the lines are."""
+    stream = decompressed(stream, content_encoding)
+    if is_diff_content_type(content_type):
+        return media_of_params(params), iterate_text_lines(stream)
+    try:
+        media = json.loads(read(stream))
+    except ValueError as e:  # including UnicodeDecodeError
+        raise InvalidBody(f'Body is not a JSON document: {e}')
+    if not isinstance(media, dict):
+        raise InvalidBody('Body should be a JSON object')
+    return media, media.get('diff_text') or ''
+
+
+def response_encoding(accept_encoding):
+    """Return the supported encoding preferred by Accept-Encoding header value or None if there is no such one."""
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        encoding, _, parameters = item.strip().lower().partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[encoding.strip()] = quality
+    encodings = [encoding for encoding in supported_encodings()
+                 if qualities.get(encoding, qualities.get('*', 0.0)) > 0]
+    return max(encodings, key=lambda encoding: qualities.get(encoding, qualities.get('*')), default=None)
+
+
+def compress_chunks(chunks, encoding):
+    """Return iterator of chunks compressed with encoding (chunks themselves if it is None)."""
+    if encoding is None:
+        return iter(chunks)
+    return _compress_chunks(chunks, encoding)
+
+
+def _compress_chunks(chunks, encoding):
+    if encoding == ZSTD:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip header and trailer
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    yield compressor.flush()
+
+
+def set_data(req, resp, data):
+    """Set body of resp to data, compressed if req accepts it and data is not too small."""
+    encoding = response_encoding(req.get_header('Accept-Encoding'))
+    resp.append_header('Vary', 'Accept-Encoding')
+    if encoding is None or len(data) < MIN_COMPRESSED_BYTES:
+        resp.data = data
+    else:
+        resp.set_header('Content-Encoding', encoding)
+        resp.data = b''.join(compress_chunks([data], encoding))
+
+
+def set_stream(req, resp, chunks):
+    """Stream chunks as body of resp, compressed if req accepts it."""
+    encoding = response_encoding(req.get_header('Accept-Encoding'))
+    resp.append_header('Vary', 'Accept-Encoding')
+    if encoding is not None:
+        resp.set_header('Content-Encoding', encoding)
+    resp.stream = compress_chunks(chunks, encoding)